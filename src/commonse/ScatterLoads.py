@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+ScatterLoads.py
+
+Copyright (c) NREL. All rights reserved.
+"""
+
+#-------------------------------------------------------------------------------
+# Name:        ScatterLoads.py
+# Purpose:     Distributed wind and wave loads on a tower for every case of a joint
+#              (U, Hs, Tp, direction) scatter diagram.  Same chain as
+#              PowerWind/LinearWaves -> TowerWindDrag/TowerWaveDrag -> AeroHydroLoads,
+#              but shared sub-computations (identical wind speeds, identical sea
+#              states) are evaluated once and the unique cases are spread over a
+#              process pool.
+#-------------------------------------------------------------------------------
+
+import multiprocessing
+import numpy as np
+
+from commonse.utilities import sind, cosd
+from commonse.environment import powerWindCases, linearWavesCases
+from commonse.WindWaveDrag import dragForce, morisonForce
+
+
+# -----------------
+#  Worker Tasks
+# -----------------
+# module level so they can be sent to worker processes
+
+
+def _windTask(args):
+    """wind drag for a block of unique reference wind speeds"""
+
+    Uref, tower, env = args
+
+    U = powerWindCases(Uref, env['zref'], tower['z'], env['z0'], env['shearExp'])[0]
+    F = dragForce(U, tower['d'], env['rho_air'], env['mu_air'], env['cd_usr_air'])
+    q = 0.5*env['rho_air']*U**2
+
+    return F, q
+
+
+def _waveTask(args):
+    """wave (Morison) loads for a block of unique sea states"""
+
+    Hs, Tp, tower, env = args
+
+    U, A = linearWavesCases(env['hmax_factor']*Hs, Tp, tower['z'], env['z_surface'],
+        env['z_floor'], env['Uc'], env['g'])
+    F = morisonForce(U, A, tower['d'], env['rho_water'], env['mu_water'], env['cm'], env['cd_usr_water'])
+    q = 0.5*env['rho_water']*U**2
+
+    return F, q
+
+
+def _blocks(n, size):
+    return [slice(i, min(i+size, n)) for i in range(0, n, size)]
+
+
+# -----------------
+#  Pipeline
+# -----------------
+
+
+def scatterLoads(U, Hs, Tp, direction, z, d, zref, z_surface, z_floor=0.0, z0=0.0, shearExp=0.2,
+        betaWind=0.0, yaw=0.0, hmax_factor=1.86, Uc=0.0, g=9.81, rho_air=1.225, mu_air=1.7934e-5,
+        rho_water=1027.0, mu_water=1.3351e-3, cm=2.0, cd_usr_air=0.0, cd_usr_water=0.0,
+        nworkers=1, cases_per_task=64):
+    """distributed wind and wave loads on a tower for every row of a scatter table.
+
+    Wind uses a power-law profile with drag from :func:`dragForce`, waves use
+    linear (Airy) theory for the maximum wave with Morison loads from
+    :func:`morisonForce`, and the loads are combined in the yaw-aligned
+    coordinate system as in AeroHydroLoads.  Each unique wind speed and each
+    unique (Hs, Tp) sea state is only evaluated once.
+
+    Parameters
+    ----------
+    U : array_like(float) (m/s)
+        reference (hub height) wind speed of each case
+    Hs : array_like(float) (m)
+        significant wave height of each case
+    Tp : array_like(float) (s)
+        wave period of each case
+    direction : array_like(float) (deg)
+        wave direction of each case relative to the inertial coordinate system
+    z : array_like(float) (m)
+        heights along the tower
+    d : array_like(float) (m)
+        corresponding tower diameters
+    zref : float (m)
+        reference height of the wind speed
+    z_surface : float (m)
+        vertical location of water surface
+    z_floor : float (m)
+        vertical location of sea floor
+    z0 : float (m)
+        bottom of wind profile (height of ground/sea)
+    shearExp : float
+        shear exponent
+    betaWind : float (deg)
+        wind direction relative to the inertial coordinate system
+    yaw : float (deg)
+        yaw angle
+    hmax_factor : float
+        maximum wave height as a multiple of Hs
+    Uc : float (m/s)
+        mean current speed
+    g, rho_air, mu_air, rho_water, mu_water, cm, cd_usr_air, cd_usr_water : float
+        same meaning as in LinearWaves, TowerWindDrag, and TowerWaveDrag
+    nworkers : int
+        number of worker processes.  1 evaluates everything in this process
+    cases_per_task : int
+        number of unique wind speeds or sea states sent to a worker at once
+
+    Returns
+    -------
+    loads : dict(str, ndarray)
+        columnar results 'Px', 'Py', 'Pz', 'qdyn' (N/m, N/m**2) of shape (ncases, nz),
+        plus 'z' (nz,)
+
+    """
+
+    U = np.asarray(U, dtype=float)
+    Hs = np.asarray(Hs, dtype=float)
+    Tp = np.asarray(Tp, dtype=float)
+    direction = np.asarray(direction, dtype=float)
+
+    tower = {'z': np.asarray(z, dtype=float), 'd': np.asarray(d, dtype=float)}
+    env = {'zref': zref, 'z0': z0, 'shearExp': shearExp, 'rho_air': rho_air, 'mu_air': mu_air,
+           'cd_usr_air': cd_usr_air, 'hmax_factor': hmax_factor, 'z_surface': z_surface,
+           'z_floor': z_floor, 'Uc': Uc, 'g': g, 'rho_water': rho_water, 'mu_water': mu_water,
+           'cm': cm, 'cd_usr_water': cd_usr_water}
+
+    # deduplicate shared sub-computations
+    Uu, iwind = np.unique(U, return_inverse=True)
+    seastates = np.column_stack([Hs, Tp]).view([('Hs', float), ('Tp', float)]).ravel()
+    Su, iwave = np.unique(seastates, return_inverse=True)
+
+    windtasks = [(Uu[b], tower, env) for b in _blocks(len(Uu), cases_per_task)]
+    wavetasks = [(Su['Hs'][b], Su['Tp'][b], tower, env) for b in _blocks(len(Su), cases_per_task)]
+
+    # fan out unique cases
+    if nworkers > 1:
+        pool = multiprocessing.Pool(nworkers)
+        try:
+            windresults = pool.map_async(_windTask, windtasks)
+            waveresults = pool.map(_waveTask, wavetasks)
+            windresults = windresults.get()
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        windresults = list(map(_windTask, windtasks))
+        waveresults = list(map(_waveTask, wavetasks))
+
+    Fwind = np.vstack([r[0] for r in windresults])[iwind]
+    qwind = np.vstack([r[1] for r in windresults])[iwind]
+    Fwave = np.vstack([r[0] for r in waveresults])[iwave]
+    qwave = np.vstack([r[1] for r in waveresults])[iwave]
+
+    # rotate to the yaw-aligned c.s. (wind c.s. is defined by the wind direction)
+    theta = betaWind + yaw
+    relwind = (betaWind - theta)*np.ones((len(U), 1))
+    relwave = (direction - theta)[:, np.newaxis]
+
+    loads = {}
+    loads['Px'] = Fwind*cosd(relwind) + Fwave*cosd(relwave)
+    loads['Py'] = Fwind*sind(relwind) + Fwave*sind(relwave)
+    loads['Pz'] = np.zeros_like(loads['Px'])
+    loads['qdyn'] = qwind + qwave
+    loads['z'] = tower['z']
+
+    return loads
@@ -8,8 +8,10 @@ Copyright (c) NREL. All rights reserved.
 """
 
 from math import sqrt, cos, atan2, pi
+from itertools import islice
+import multiprocessing
 import numpy as np
-from commonse.utilities import CubicSplineSegment, cubic_spline_eval, smooth_max, smooth_min
+from commonse.utilities import cubic_spline_eval, cubic_hermite_eval, cubic_hermite_deriv, smooth_max, smooth_min
 
 #-------------------------------------------------------------------------------
 # Name:        UtilizationSupplement.py
@@ -24,21 +26,100 @@ from commonse.utilities import CubicSplineSegment, cubic_spline_eval, smooth_max
 #-------------------------------------------------------------------------------
 
 
-def fatigue(M_DEL, N_DEL, d, t, m=4, DC=80.0, eta=1.265, stress_factor=1.0, weld_factor=True):
+def _weldFactor(t, return_derivs=False):
+    """empirical weld factor for thickness t (mm) (added cubic spline around corner)"""
+
+    x1 = 24.0
+    x2 = 26.0
+    spline = (x1, x2, 1.0, (25.0/x2)**0.25, 0.0, 25.0**0.25*-0.25*x2**-1.25, t)
+
+    weld = np.select([t <= x1, t >= x2], [1.0, (25.0/t)**0.25], cubic_hermite_eval(*spline))
+
+    if not return_derivs:
+        return weld
+
+    dweld_dt = np.select([t <= x1, t >= x2], [0.0, -0.25*(25.0/t)**0.25/t], cubic_hermite_deriv(*spline)[-1])
+
+    return weld, dweld_dt
+
+
+def snCycles(S, Smax, m=4, N_knee=(), N1=2e6, return_derivs=False):
+    """number of cycles to failure from a (multi-slope) S-N curve.
+    The curve passes through (N1, Smax) with slope m[0], and the slope changes to
+    m[k+1] below the stress at N_knee[k] cycles, e.g., m=(3, 5), N_knee=(5e6,)
+    for a bilinear curve.
+
+    Parameters
+    ----------
+    S : array_like(float)
+        stress range
+    Smax : array_like(float)
+        stress range at N1 cycles, broadcast against S
+    m : float or array_like(float)
+        slope(s) of S/N curve
+    N_knee : array_like(float)
+        cycles at the slope changes, ascending.  len(N_knee) == len(m) - 1
+    N1 : float
+        reference number of cycles
+    return_derivs : bool
+        if True also return the derivatives
+
+    Returns
+    -------
+    Nf : ndarray(float)
+        number of cycles to failure
+    dNf_dS, dNf_dSmax : ndarray(float)
+        (only if return_derivs) derivatives of Nf w.r.t. S and Smax
+
+    """
+
+    m = np.atleast_1d(np.asarray(m, dtype=float))
+    N_knee = np.atleast_1d(np.asarray(N_knee, dtype=float))
+    if len(N_knee) != len(m) - 1:
+        raise ValueError('need one knee point per change of slope, got m={} and N_knee={}'.format(m, N_knee))
+
+    S = np.asarray(S, dtype=float)
+
+    # first segment, then continue through each knee (zero stress gives infinite life)
+    with np.errstate(divide='ignore'):
+        Nf = N1*(Smax/S)**m[0]
+        mlocal = m[0]*np.ones(Nf.shape)
+        Nref = N1
+        Sref = Smax
+        for k in range(len(N_knee)):
+            Sref = Sref*(Nref/N_knee[k])**(1.0/m[k])  # stress at the knee
+            Nref = N_knee[k]
+            Nf = np.where(S < Sref, Nref*(Sref/S)**m[k+1], Nf)
+            mlocal = np.where(S < Sref, m[k+1], mlocal)
+
+    if not return_derivs:
+        return Nf
+
+    # all knee stresses scale with Smax, so on every segment Nf ~ (Smax/S)**m
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dNf_dS = -mlocal*Nf/S
+        dNf_dSmax = mlocal*Nf/Smax
+
+    return Nf, dNf_dS, dNf_dSmax
+
+
+def fatigue(M_DEL, N_DEL, d, t, m=4, DC=80.0, eta=1.265, stress_factor=1.0, weld_factor=True, N_knee=(),
+        return_derivs=False):
     """estimate fatigue damage for tower station
 
     Parmeters
     ---------
     M_DEL : array_like(float) (N*m)
-        damage equivalent moment at tower section
+        damage equivalent moment at tower section.  may have trailing dimensions,
+        e.g., (nsections, nbins) moment ranges of a load histogram
     N_DEL : array_like(int)
-        corresponding number of cycles in lifetime
+        corresponding number of cycles in lifetime, broadcast against M_DEL
     d : array_like(float) (m)
         tower diameter at section
     t : array_like(float) (m)
         tower shell thickness at section
-    m : int
-        slope of S/N curve
+    m : int or array_like(float)
+        slope(s) of S/N curve
     DC : float (N/mm**2)
         some max stress from a standard
     eta : float
@@ -47,66 +128,97 @@ def fatigue(M_DEL, N_DEL, d, t, m=4, DC=80.0, eta=1.265, stress_factor=1.0, weld
         load_factor * stress_concentration_factor
     weld_factor : bool
         if True include an empirical weld factor
+    N_knee : array_like(float)
+        number of cycles where the S/N slope changes (see :func:`snCycles`)
+    return_derivs : bool
+        if True also return the (elementwise) derivatives
 
     Returns
     -------
-    damage : float
-        damage from Miner's rule for this tower section
+    damage : ndarray(float)
+        damage from Miner's rule for each tower section (same shape as M_DEL)
+    ddamage_dM_DEL, ddamage_dN_DEL, ddamage_dd, ddamage_dt : ndarray(float)
+        (only if return_derivs) derivatives of damage w.r.t. the inputs
     """
 
+    M_DEL = np.asarray(M_DEL, dtype=float)
+    ndim = max(M_DEL.ndim, np.ndim(N_DEL))
 
     # convert to mm
-    dvec = np.array(d)*1e3
-    tvec = np.array(t)*1e3
-
-    nvec = len(d)
-    damage = np.zeros(nvec)
+    dvec = _sectionColumn(d, ndim)*1e3
+    tvec = _sectionColumn(t, ndim)*1e3
 
-    # initialize weld factor (added cubic spline around corner)
+    # weld factor
     if weld_factor:
-        x1 = 24.0
-        x2 = 26.0
-        spline = CubicSplineSegment(x1, x2, 1.0, (25.0/x2)**0.25, 0.0, 25.0**0.25*-0.25*x2**-1.25)
+        weld = _weldFactor(tvec)
+    else:
+        weld = 1.0
 
+    # stress
+    r = dvec/2.0
+    I = pi*r**3*tvec
+    c = r
+    dsigma_dM = c/I * stress_factor * 1e3  # convert to N/mm^2
+    sigma = M_DEL*dsigma_dM
 
-    for i in range(nvec):
+    # maximum allowed stress
+    Smax = DC * weld / eta
 
-        d = dvec[i]
-        t = tvec[i]
+    # number of cycles to failure
+    N1 = 2e6  # TODO: where does this come from?
+    if not return_derivs:
+        return N_DEL/snCycles(sigma, Smax, m, N_knee, N1)  # damage
 
-        # weld factor
-        if not weld_factor or t <= x1:
-            weld = 1.0
-        elif t >= x2:
-            weld = (25.0/t)**0.25
-        else:
-            weld = spline.eval(t)
+    Nf, dNf_dS, dNf_dSmax = snCycles(sigma, Smax, m, N_knee, N1, return_derivs=True)
+    damage = N_DEL/Nf
 
+    if weld_factor:
+        dweld_dt = _weldFactor(tvec, return_derivs=True)[1]
+    else:
+        dweld_dt = 0.0
+
+    # d(N/Nf) = -N/Nf**2 dNf, which vanishes for zero stress
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dD_dS = np.where(sigma > 0, -damage/Nf*dNf_dS, 0.0)
+        dD_dSmax = np.where(sigma > 0, -damage/Nf*dNf_dSmax, 0.0)
+
+    ddamage_dM = dD_dS*dsigma_dM
+    ddamage_dN = 1.0/Nf
+    ddamage_dd = dD_dS*(-2.0*sigma/dvec)*1e3
+    ddamage_dt = (dD_dS*(-sigma/tvec) + dD_dSmax*DC/eta*dweld_dt)*1e3
 
-        # stress
-        r = d/2.0
-        I = pi*r**3*t
-        c = r
-        sigma = M_DEL[i]*c/I * stress_factor * 1e3  # convert to N/mm^2
+    return damage, ddamage_dM, ddamage_dN, ddamage_dd, ddamage_dt
 
-        # maximum allowed stress
-        Smax = DC * weld / eta
 
-        # number of cycles to failure
-        Nf = (Smax/sigma)**m
+def fatigueHistogram(M_bins, counts, d, t, m=4, DC=80.0, eta=1.265, stress_factor=1.0, weld_factor=True, N_knee=()):
+    """lifetime fatigue damage from a load histogram (Markov matrix), summed with Miner's rule
+
+    Parmeters
+    ---------
+    M_bins : array_like(float) (N*m)
+        moment range of each bin, (nbins,) or (nsections, nbins)
+    counts : array_like(float)
+        lifetime number of cycles in each bin, (nsections, nbins)
+    d, t, m, DC, eta, stress_factor, weld_factor, N_knee
+        same as in :func:`fatigue`
+
+    Returns
+    -------
+    damage : ndarray(float)
+        damage for each tower section
+    """
 
-        # number of cycles for this load
-        N1 = 2e6  # TODO: where does this come from?
-        N = N_DEL[i]/N1
+    counts = np.asarray(counts, dtype=float)
+    M_bins = np.asarray(M_bins, dtype=float)*np.ones_like(counts)
 
-        # damage
-        damage[i] = N/Nf
+    damage = fatigue(M_bins, counts, d, t, m, DC, eta, stress_factor, weld_factor, N_knee)
 
-    return damage
+    return np.sum(damage, axis=-1)
 
 
-def vonMisesStressUtilization(axial_stress, hoop_stress, shear_stress, gamma, sigma_y):
-    """combine stress for von Mises"""
+def vonMisesStressUtilization(axial_stress, hoop_stress, shear_stress, gamma, sigma_y, return_derivs=False):
+    """combine stress for von Mises.  if return_derivs, also returns the (elementwise)
+    derivatives of the utilization w.r.t. axial_stress, hoop_stress, shear_stress, and sigma_y"""
 
     # von mises stress
     a = ((axial_stress + hoop_stress)/2.0)**2
@@ -117,11 +229,22 @@ def vonMisesStressUtilization(axial_stress, hoop_stress, shear_stress, gamma, si
     # stress margin
     stress_utilization = gamma * von_mises / sigma_y
 
-    return stress_utilization  # This must be <1 to pass
+    if not return_derivs:
+        return stress_utilization  # This must be <1 to pass
+
+    const = gamma / sigma_y / von_mises
+    du_daxial = const*(2.0*axial_stress - hoop_stress)/2.0
+    du_dhoop = const*(2.0*hoop_stress - axial_stress)/2.0
+    du_dshear = const*3.0*shear_stress
+    du_dsigma_y = -stress_utilization/sigma_y
 
+    return stress_utilization, du_daxial, du_dhoop, du_dshear, du_dsigma_y
 
-def hoopStressEurocode(z, d, t, L_reinforced, q_dyn):
-    """default method for computing hoop stress using Eurocode method"""
+
+def hoopStressEurocode(z, d, t, L_reinforced, q_dyn, return_derivs=False):
+    """default method for computing hoop stress using Eurocode method.
+    if return_derivs, also returns the (elementwise) derivatives of the hoop stress
+    w.r.t. d, t, L_reinforced, and q_dyn"""
 
     r = d/2.0-t/2.0  # radius of cylinder middle surface
     omega = L_reinforced/np.sqrt(r*t)
@@ -133,10 +256,27 @@ def hoopStressEurocode(z, d, t, L_reinforced, q_dyn):
     Peq = k_w*q_dyn
     hoop_stress = -Peq*r/t
 
-    return hoop_stress
+    if not return_derivs:
+        return hoop_stress
+
+    # k_w = 0.46*(1 + 0.1*sqrt(X)) with X = C_theta*r**1.5/(sqrt(t)*L_reinforced)
+    X = C_theta/omega*r/t
+    Xdk_dX = 0.46*0.1*0.5*np.sqrt(X)
+
+    dhoop_dr = -q_dyn/t*(k_w + 1.5*Xdk_dX)
+    dhoop_dt_r = -q_dyn*r/t*(-0.5*Xdk_dX - k_w)/t  # at constant r
+
+    dhoop_dd = 0.5*dhoop_dr
+    dhoop_dt = -0.5*dhoop_dr + dhoop_dt_r
+    dhoop_dL = q_dyn*r/t*Xdk_dX/L_reinforced
+    dhoop_dq = -k_w*r/t
 
+    return hoop_stress, dhoop_dd, dhoop_dt, dhoop_dL, dhoop_dq
 
-def bucklingGL(d, t, Fz, Myy, tower_height, E, sigma_y, gamma_f=1.2, gamma_b=1.1, gamma_g=1.1):
+
+def bucklingGL(d, t, Fz, Myy, tower_height, E, sigma_y, gamma_f=1.2, gamma_b=1.1, gamma_g=1.1, return_derivs=False):
+    """GL buckling utilization.  if return_derivs, also returns the (elementwise)
+    derivatives of the utilization w.r.t. d, t, Fz, Myy, and tower_height"""
 
     # other factors
     alpha = 0.21  # buckling imperfection factor
@@ -169,40 +309,108 @@ def bucklingGL(d, t, Fz, Myy, tower_height, E, sigma_y, gamma_f=1.2, gamma_b=1.1
 
     GL_utilization = Nd/(kappa*Np) + beta*Md/Mp + delta_n  #this is utilization must be <1
 
-    return GL_utilization
+    if not return_derivs:
+        return GL_utilization
+
+    # lambda_bar**2 = A/I*... ~ 1/d**2 and ~ tower_height**2 (independent of t)
+    dkappa_dlambda = np.zeros_like(d)
+    root = np.sqrt(phi[idx]**2 - lambda_bar[idx]**2)
+    dphi = 0.5*(alpha + 2*lambda_bar[idx])
+    dkappa_dlambda[idx] = -kappa[idx]**2*(dphi + (phi[idx]*dphi - lambda_bar[idx])/root)
+
+    ddelta_dlambda = np.where(0.25*kappa*lambda_bar**2 < 0.1,
+        0.25*(dkappa_dlambda*lambda_bar**2 + 2*kappa*lambda_bar), 0.0)
+
+    axial = Nd/(kappa*Np)
+    bending = beta*Md/Mp
+    dU_dlambda = -axial/kappa*dkappa_dlambda + ddelta_dlambda
 
+    dU_dd = -axial/d - 2*bending/d - dU_dlambda*lambda_bar/d
+    dU_dt = -(axial + bending)/t
+    dU_dFz = -gamma_g/(kappa*Np)
+    dU_dMyy = beta*gamma_f/Mp
+    dU_dh = dU_dlambda*lambda_bar/(tower_height/sk_factor)
 
+    return GL_utilization, dU_dd, dU_dt, dU_dFz, dU_dMyy, dU_dh
 
 
 
-def shellBucklingEurocode(d, t, sigma_z, sigma_t, tau_zt, L_reinforced, E, sigma_y, gamma_f=1.2, gamma_b=1.1):
+
+
+def shellBucklingEurocode(d, t, sigma_z, sigma_t, tau_zt, L_reinforced, E, sigma_y, gamma_f=1.2, gamma_b=1.1,
+        return_derivs=False):
     """
     Estimate shell buckling utilization along tower.
 
     Arguments:
-    npt - number of locations at each node at which stress is evaluated.
-    sigma_z - axial stress at npt*node locations.  must be in order
-                  [(node1_pts1-npt), (node2_pts1-npt), ...]
-    sigma_t - azimuthal stress given at npt*node locations
-    tau_zt - shear stress (z, theta) at npt*node locations
-    E - modulus of elasticity
-    sigma_y - yield stress
-    L_reinforced - reinforcement length - structure is re-discretized with this spacing
+    d - diameter at each section
+    t - shell thickness at each section
+    sigma_z - axial stress at each section, either (nsections,) or (nsections, ncases)
+              to evaluate many load cases at once
+    sigma_t - azimuthal stress, same shape as sigma_z
+    tau_zt - shear stress (z, theta), same shape as sigma_z
+    L_reinforced - reinforcement length at each section
+    E - modulus of elasticity at each section
+    sigma_y - yield stress at each section
     gamma_f - safety factor for stresses
     gamma_b - safety factor for buckling
+    return_derivs - if True also return the (elementwise) derivatives
 
     Returns:
-    z
-    EU_utilization: - array of shell buckling utilizations evaluted at (z[0] at npt locations, \n
-                      z[0]+L_reinforced at npt locations, ...). \n
+    EU_utilization: - array of shell buckling utilizations, same shape as sigma_z. \n
                       Each utilization must be < 1 to avoid failure.
+    dU_dd, dU_dt, dU_dsigma_z, dU_dsigma_t, dU_dtau_zt, dU_dL_reinforced - (only if return_derivs)
+                      derivatives of the utilization, same shape as EU_utilization
     """
 
+    sigma_z = np.asarray(sigma_z, dtype=float)
+    sigma_t = np.asarray(sigma_t, dtype=float)
+    tau_zt = np.asarray(tau_zt, dtype=float)
+
+    # section properties broadcast along the load case dimension
+    ndim = max(sigma_z.ndim, sigma_t.ndim, tau_zt.ndim)
+    d, t, h, E, sigma_y = [_sectionColumn(x, ndim) for x in (d, t, L_reinforced, E, sigma_y)]
+
+    r = d/2.0 - t/2.0
+
+    # TODO: the following is non-smooth, although in general its probably OK
+    # change to magnitudes and add safety factor
+    sigma_z_shell = gamma_f*np.abs(sigma_z)
+    sigma_t_shell = gamma_f*np.abs(sigma_t)
+    tau_zt_shell = gamma_f*np.abs(tau_zt)
+
+    out = _shellBucklingSections(h, r, r, t, t, gamma_b, sigma_z_shell, sigma_t_shell, tau_zt_shell, E, sigma_y, return_derivs)
+
+    if not return_derivs:
+        return out  # this is utilization must be <1
+
+    EU_utilization, dU_domega, dU_drovert, dU_domega_tau, dU_drovert_tau, dU_dsz, dU_dst, dU_dtau = out
+
+    # for a cylinder both checks use omega = h/sqrt(r*t) and rovert = r/t
+    omega = h/np.sqrt(r*t)
+    dU_domega = dU_domega + dU_domega_tau
+    dU_drovert = dU_drovert + dU_drovert_tau
+
+    dU_dr = -dU_domega*omega/(2*r) + dU_drovert/t
+    dU_dt_r = -dU_domega*omega/(2*t) - dU_drovert*r/t**2  # at constant r
+
+    dU_dd = 0.5*dU_dr
+    dU_dt = -0.5*dU_dr + dU_dt_r
+    dU_dL = dU_domega*omega/h
+
+    dU_dsigma_z = dU_dsz*gamma_f*np.sign(sigma_z)
+    dU_dsigma_t = dU_dst*gamma_f*np.sign(sigma_t)
+    dU_dtau_zt = dU_dtau*gamma_f*np.sign(tau_zt)
+
+    return EU_utilization, dU_dd, dU_dt, dU_dsigma_z, dU_dsigma_t, dU_dtau_zt, dU_dL
+
+
+def shellBucklingEurocodeScalar(d, t, sigma_z, sigma_t, tau_zt, L_reinforced, E, sigma_y, gamma_f=1.2, gamma_b=1.1):
+    """Reference implementation of :func:`shellBucklingEurocode` that loops over the
+    sections with the scalar _shellBucklingOneSection.  Slower, kept for verification."""
+
     n = len(d)
     EU_utilization = np.zeros(n)
-    sigma_z_sh = np.zeros(n)
-    sigma_t_sh = np.zeros(n)
-    tau_zt_sh = np.zeros(n)
 
     for i in range(n):
         h = L_reinforced[i]
@@ -212,28 +420,222 @@ def shellBucklingEurocode(d, t, sigma_z, sigma_t, tau_zt, L_reinforced, E, sigma
         t1 = t[i]
         t2 = t[i]
 
-        sigma_z_shell = sigma_z[i]
-        sigma_t_shell = sigma_t[i]
-        tau_zt_shell = tau_zt[i]
-
-        # TODO: the following is non-smooth, although in general its probably OK
         # change to magnitudes and add safety factor
-        sigma_z_shell = gamma_f*abs(sigma_z_shell)
-        sigma_t_shell = gamma_f*abs(sigma_t_shell)
-        tau_zt_shell = gamma_f*abs(tau_zt_shell)
+        sigma_z_shell = gamma_f*abs(sigma_z[i])
+        sigma_t_shell = gamma_f*abs(sigma_t[i])
+        tau_zt_shell = gamma_f*abs(tau_zt[i])
 
         EU_utilization[i] = _shellBucklingOneSection(h, r1, r2, t1, t2, gamma_b, sigma_z_shell, sigma_t_shell, tau_zt_shell, E[i], sigma_y[i])
 
-        #make them into vectors
-        sigma_z_sh[i]=sigma_z_shell
-        sigma_t_sh[i]=sigma_t_shell
-        tau_zt_sh[i]=tau_zt_shell
-
     return EU_utilization  # this is utilization must be <1
 
 
 
 
+class UtilizationEnvelope(object):
+    """Running envelope of the stress (von Mises), shell buckling (Eurocode), and
+    global buckling (GL) utilizations over any number of load cases.  Only the
+    per-section maxima and the id of the case that produced them are stored, so
+    memory is O(nsections) however many cases stream through.  Envelopes of
+    separate groups of cases can be combined with merge.
+
+    Parameters
+    ----------
+    d, t : array_like(float) (m)
+        diameter and shell thickness at each section
+    L_reinforced : array_like(float) (m)
+        reinforcement length at each section
+    E, sigma_y : array_like(float) (N/m**2)
+        modulus of elasticity and yield stress at each section
+    tower_height : float (m)
+        needed for the global buckling check, which is skipped if None
+    gamma_f, gamma_m, gamma_n, gamma_b, gamma_g : float
+        safety factors on loads, materials, consequence of failure, buckling, and gravity
+
+    """
+
+    checks = ('stress', 'shell', 'global')
+
+    def __init__(self, d, t, L_reinforced, E, sigma_y, tower_height=None,
+            gamma_f=1.35, gamma_m=1.3, gamma_n=1.0, gamma_b=1.1, gamma_g=1.1):
+
+        self.d = np.asarray(d, dtype=float)
+        self.t = np.asarray(t, dtype=float)
+        self.L_reinforced = np.asarray(L_reinforced, dtype=float)
+        self.E = np.asarray(E, dtype=float)*np.ones(len(self.d))
+        self.sigma_y = np.asarray(sigma_y, dtype=float)*np.ones(len(self.d))
+        self.tower_height = tower_height
+        self.gamma_f = gamma_f
+        self.gamma_m = gamma_m
+        self.gamma_n = gamma_n
+        self.gamma_b = gamma_b
+        self.gamma_g = gamma_g
+
+        self.clear()
+
+
+    def clear(self):
+        """reset the envelope (no cases seen)"""
+
+        n = len(self.d)
+        self.max = dict((name, -np.inf*np.ones(n)) for name in self.checks)
+        self.argmax = dict((name, -np.ones(n, dtype=int)) for name in self.checks)
+        self.ncases = 0
+
+
+    def copy(self, empty=False):
+        """copy of this envelope, optionally with no cases seen"""
+
+        other = UtilizationEnvelope.__new__(UtilizationEnvelope)
+        other.__dict__.update(self.__dict__)
+        if empty:
+            other.clear()
+        else:
+            other.max = dict((name, v.copy()) for name, v in self.max.items())
+            other.argmax = dict((name, v.copy()) for name, v in self.argmax.items())
+
+        return other
+
+
+    def _record(self, name, utilization, case_id):
+
+        u = utilization.reshape(len(self.d), -1)
+        j = np.argmax(u, axis=1)
+        umax = u[np.arange(len(self.d)), j]
+
+        idx = umax > self.max[name]
+        self.max[name][idx] = umax[idx]
+        self.argmax[name][idx] = case_id[j[idx]]
+
+
+    def update(self, axial_stress, hoop_stress, shear_stress, Fz=None, Myy=None, case_id=None):
+        """add one load case, or a batch of cases given as (nsections, ncases) arrays
+
+        Parameters
+        ----------
+        axial_stress, hoop_stress, shear_stress : array_like(float) (N/m**2)
+            stresses at each section
+        Fz, Myy : array_like(float) (N, N*m)
+            axial force and bending moment at each section (for the global buckling check)
+        case_id : int or array_like(int)
+            id(s) of the case(s).  defaults to a running count
+
+        """
+
+        axial_stress = np.asarray(axial_stress, dtype=float)
+        hoop_stress = np.asarray(hoop_stress, dtype=float)
+        shear_stress = np.asarray(shear_stress, dtype=float)
+
+        ndim = max(axial_stress.ndim, hoop_stress.ndim, shear_stress.ndim)
+        ncases = 1 if ndim == 1 else np.broadcast(axial_stress, hoop_stress, shear_stress).shape[1]
+
+        if case_id is None:
+            case_id = self.ncases + np.arange(ncases)
+        case_id = np.atleast_1d(np.asarray(case_id, dtype=int))
+        self.ncases += ncases
+
+        d, t, L, E, sigma_y = [_sectionColumn(x, ndim) for x in
+                               (self.d, self.t, self.L_reinforced, self.E, self.sigma_y)]
+
+        gamma = self.gamma_f*self.gamma_m*self.gamma_n
+        stress = vonMisesStressUtilization(axial_stress, hoop_stress, shear_stress, gamma, sigma_y)
+        self._record('stress', stress, case_id)
+
+        shell = shellBucklingEurocode(d, t, axial_stress, hoop_stress, shear_stress, L, E, sigma_y,
+                                      self.gamma_f, self.gamma_b)
+        self._record('shell', shell, case_id)
+
+        if Fz is not None and Myy is not None and self.tower_height is not None:
+            GL = bucklingGL(d, t, np.asarray(Fz), np.asarray(Myy), self.tower_height, E, sigma_y,
+                            self.gamma_f, self.gamma_b, self.gamma_g)
+            self._record('global', GL, case_id)
+
+
+    def updateCases(self, cases, chunk_size=64):
+        """consume an iterator of (case_id, loads) pairs, where loads is a dict with
+        'axial_stress', 'hoop_stress', 'shear_stress' and optionally 'Fz' and 'Myy'
+        (arrays over the sections).  cases are evaluated in vectorized batches of chunk_size"""
+
+        while True:
+            chunk = list(islice(cases, chunk_size))
+            if len(chunk) == 0:
+                break
+
+            ids = [c[0] for c in chunk]
+            loads = [c[1] for c in chunk]
+            stack = lambda key: np.column_stack([l[key] for l in loads]) if key in loads[0] else None
+
+            self.update(stack('axial_stress'), stack('hoop_stress'), stack('shear_stress'),
+                        stack('Fz'), stack('Myy'), ids)
+
+
+    def merge(self, other):
+        """combine with the envelope of another group of cases (in place)"""
+
+        for name in self.checks:
+            idx = other.max[name] > self.max[name]
+            self.max[name][idx] = other.max[name][idx]
+            self.argmax[name][idx] = other.argmax[name][idx]
+        self.ncases += other.ncases
+
+        return self
+
+
+def _envelopeTask(args):
+    """envelope of one chunk of cases (pool task)"""
+
+    envelope, chunk = args
+    envelope.updateCases(iter(chunk), len(chunk))
+
+    return envelope
+
+
+def utilizationEnvelope(cases, envelope, nworkers=1, chunk_size=64):
+    """stream load cases through a UtilizationEnvelope, optionally in parallel.
+
+    Parameters
+    ----------
+    cases : iterable
+        (case_id, loads) pairs as in UtilizationEnvelope.updateCases
+    envelope : UtilizationEnvelope
+        envelope to update (in place)
+    nworkers : int
+        number of worker processes.  chunks are handed out nworkers at a time so
+        only a bounded number of cases is ever in memory
+    chunk_size : int
+        number of cases evaluated together
+
+    Returns
+    -------
+    envelope : UtilizationEnvelope
+        the updated envelope
+
+    """
+
+    cases = iter(cases)
+
+    if nworkers <= 1:
+        envelope.updateCases(cases, chunk_size)
+        return envelope
+
+    pool = multiprocessing.Pool(nworkers)
+    try:
+        while True:
+            chunks = [list(islice(cases, chunk_size)) for i in range(nworkers)]
+            tasks = [(envelope.copy(empty=True), c) for c in chunks if len(c) > 0]
+            if len(tasks) == 0:
+                break
+            for partial in pool.map(_envelopeTask, tasks):
+                envelope.merge(partial)
+    finally:
+        pool.close()
+        pool.join()
+
+    return envelope
+
+
+
+
 def _cxsmooth(omega, rovert):
 
     Cxb = 6.0  # clamped-clamped
@@ -546,3 +948,375 @@ def _buckling_reduction_factor(alpha, beta, eta, lambda_0, lambda_bar):
     #     chi = 1.0 - beta*((lambda_bar-lambda_0)/(lambda_p-lambda_0))**eta
 
     return chi
+
+
+
+# -----------------
+#  Array Versions
+# -----------------
+# same branches as the scalar functions above (np.select picks the first true
+# condition, just like the if/elif chains) with closed-form Hermite blending
+
+
+def _sectionColumn(x, ndim):
+    """reshape a per-section property so it broadcasts against (nsections, ncases) arrays"""
+
+    x = np.asarray(x, dtype=float)
+    if x.ndim == 0:
+        return x
+    return x.reshape(x.shape + (1,)*(ndim - x.ndim))
+
+
+def _hermite(spline, dspline_dp, return_derivs):
+    """evaluate a Hermite transition, optionally with derivatives w.r.t. its
+    abscissa and a parameter p that the end points/values/slopes depend on"""
+
+    f = cubic_hermite_eval(*spline)
+    if not return_derivs:
+        return f, 0.0, 0.0
+
+    derivs = cubic_hermite_deriv(*spline)
+    df_dp = sum(dF*dq for dF, dq in zip(derivs[:-1], dspline_dp))
+
+    return f, derivs[-1], df_dp
+
+
+def _cxsmoothArray(omega, rovert, return_derivs=False):
+
+    Cxb = 6.0  # clamped-clamped
+    constant = 1 + 1.83/1.7 - 2.07/1.7**2
+
+    ptL1 = 1.7-0.25
+    ptR1 = 1.7+0.25
+
+    ptL2 = 0.5*rovert - 1.0
+    ptR2 = 0.5*rovert + 1.0
+
+    ptL3 = (0.5+Cxb)*rovert - 1.0
+    ptR3 = (0.5+Cxb)*rovert + 1.0
+
+    condlist = [omega < ptL1,
+                omega <= ptR1,
+                omega < ptL2,
+                omega <= ptR2,
+                omega < ptL3,
+                omega <= ptR3]
+
+    dslope = 0.4/Cxb/rovert**2  # d/drovert of the rovert dependent values and slopes
+
+    s1 = _hermite((ptL1, ptR1, constant - 1.83/ptL1 + 2.07/ptL1**2, 1.0,
+                   1.83/ptL1**2 - 4.14/ptL1**3, 0.0, omega),
+                  (0.0, 0.0, 0.0, 0.0, 0.0, 0.0), return_derivs)
+    s2 = _hermite((ptL2, ptR2, 1.0, 1 + 0.2/Cxb*(1-2.0*ptR2/rovert),
+                   0.0, -0.4/Cxb/rovert, omega),
+                  (0.5, 0.5, 0.0, dslope, 0.0, dslope), return_derivs)
+    s3 = _hermite((ptL3, ptR3, 1 + 0.2/Cxb*(1-2.0*ptL3/rovert), 0.6,
+                   -0.4/Cxb/rovert, 0.0, omega),
+                  (0.5+Cxb, 0.5+Cxb, -dslope, 0.0, dslope, 0.0), return_derivs)
+
+    choicelist = [constant - 1.83/omega + 2.07/omega**2,
+                  s1[0],
+                  1.0,
+                  s2[0],
+                  1 + 0.2/Cxb*(1-2.0*omega/rovert),
+                  s3[0]]
+
+    Cx = np.select(condlist, choicelist, 0.6)
+
+    if not return_derivs:
+        return Cx
+
+    dCx_domega = np.select(condlist, [1.83/omega**2 - 4.14/omega**3, s1[1], 0.0, s2[1],
+                                      -0.4/Cxb/rovert, s3[1]], 0.0)
+    dCx_drovert = np.select(condlist, [0.0, s1[2], 0.0, s2[2],
+                                       0.4/Cxb*omega/rovert**2, s3[2]], 0.0)
+
+    return Cx, dCx_domega, dCx_drovert
+
+
+def _sigmasmoothArray(omega, E, rovert, return_derivs=False):
+
+    Ctheta = 1.5  # clamped-clamped
+
+    ptL = 1.63*rovert*Ctheta - 1
+    ptR = 1.63*rovert*Ctheta + 1
+
+    alpha1 = 0.92/1.63 - 2.03/1.63**4
+    offset = (10.0/(20*Ctheta)**2 - 5/(20*Ctheta)**3)
+    Cthetas = 1.5 + 10.0/omega**2 - 5/omega**3 - offset
+
+    fL = 0.92*E*Ctheta/ptL/rovert
+    fR = E*(1.0/rovert)**2*(alpha1 + 2.03*(Ctheta/ptR*rovert)**4)
+    gL = -0.92*E*Ctheta/rovert/ptL**2
+    gR = -E*(1.0/rovert)*2.03*4*(Ctheta/ptR*rovert)**3*Ctheta/ptR**2
+
+    # derivatives of the transition end values and slopes w.r.t. rovert
+    dpt = 1.63*Ctheta
+    q = Ctheta/ptR*rovert
+    dq = Ctheta/ptR**2
+    dfL = -fL*(dpt/ptL + 1.0/rovert)
+    dfR = -2.0*fR/rovert + E/rovert**2*2.03*4*q**3*dq
+    dgL = -gL*(1.0/rovert + 2.0*dpt/ptL)
+    dgR = gR*(-1.0/rovert + 3.0*dq/q - 2.0*dpt/ptR)
+
+    spline = _hermite((ptL, ptR, fL, fR, gL, gR, omega), (dpt, dpt, dfL, dfR, dgL, dgR), return_derivs)
+
+    condlist = [omega < 20.0*Ctheta,
+                omega < ptL,
+                omega <= ptR]
+
+    choicelist = [0.92*E*Cthetas/omega/rovert,
+                  0.92*E*Ctheta/omega/rovert,
+                  spline[0]]
+
+    p = Ctheta/omega*rovert
+    sigma_long = E*(1.0/rovert)**2*(alpha1 + 2.03*p**4)
+
+    sigma = np.select(condlist, choicelist, sigma_long)
+
+    if not return_derivs:
+        return sigma
+
+    dCthetas = -20.0/omega**3 + 15.0/omega**4
+
+    dsigma_domega = np.select(condlist, [0.92*E/rovert*(dCthetas/omega - Cthetas/omega**2),
+                                         -choicelist[1]/omega,
+                                         spline[1]],
+                              -E/rovert**2*2.03*4*p**4/omega)
+    dsigma_drovert = np.select(condlist, [-choicelist[0]/rovert,
+                                          -choicelist[1]/rovert,
+                                          spline[2]],
+                               -2.0*sigma_long/rovert + E/rovert**2*2.03*4*p**3*Ctheta/omega)
+
+    return sigma, dsigma_domega, dsigma_drovert
+
+
+def _tausmoothArray(omega, rovert, return_derivs=False):
+
+    ptL1 = 9
+    ptR1 = 11
+
+    ptL2 = 8.7*rovert - 1
+    ptR2 = 8.7*rovert + 1
+
+    fL = sqrt(1.0 + 42.0/ptL1**3 - 42.0/10**3)
+
+    condlist = [omega < ptL1,
+                omega <= ptR1,
+                omega < ptL2,
+                omega <= ptR2]
+
+    s1 = _hermite((ptL1, ptR1, fL, 1.0, -63.0/ptL1**4/fL, 0.0, omega),
+                  (0.0, 0.0, 0.0, 0.0, 0.0, 0.0), return_derivs)
+    s2 = _hermite((ptL2, ptR2, 1.0, 1.0/3.0*np.sqrt(ptR2/rovert) + 1 - sqrt(8.7)/3,
+                   0.0, 1.0/6/np.sqrt(ptR2*rovert), omega),
+                  (8.7, 8.7, 0.0, -1.0/6/np.sqrt(ptR2/rovert)/rovert**2,
+                   0.0, -1.0/12*(ptR2*rovert)**-1.5*(17.4*rovert + 1)), return_derivs)
+
+    C_short = np.sqrt(1.0 + 42.0/omega**3 - 42.0/10**3)
+
+    choicelist = [C_short,
+                  s1[0],
+                  1.0,
+                  s2[0]]
+
+    C_tau = np.select(condlist, choicelist, 1.0/3.0*np.sqrt(omega/rovert) + 1 - sqrt(8.7)/3)
+
+    if not return_derivs:
+        return C_tau
+
+    dC_domega = np.select(condlist, [-63.0/omega**4/C_short, s1[1], 0.0, s2[1]],
+                          1.0/6/np.sqrt(omega*rovert))
+    dC_drovert = np.select(condlist, [0.0, s1[2], 0.0, s2[2]],
+                           -1.0/6*np.sqrt(omega)/rovert**1.5)
+
+    return C_tau, dC_domega, dC_drovert
+
+
+def _bucklingReductionFactorArray(alpha, beta, eta, lambda_0, lambda_bar, return_derivs=False):
+
+    lambda_p = np.sqrt(alpha/(1.0-beta))
+
+    ptL = 0.9*lambda_0
+    ptR = 1.1*lambda_0
+
+    fracR = (ptR-lambda_0)/(lambda_p-lambda_0)
+    fL = 1.0
+    fR = 1-beta*fracR**eta
+    gL = 0.0
+    gR = -beta*eta*fracR**(eta-1)/(lambda_p-lambda_0)
+
+    # derivatives of the transition end value and slope w.r.t. lambda_p
+    dfracR = -fracR/(lambda_p-lambda_0)
+    dfR = -beta*eta*fracR**(eta-1)*dfracR
+    dgR = -beta*eta*((eta-1)*fracR**(eta-2)*dfracR - fracR**(eta-1)/(lambda_p-lambda_0))/(lambda_p-lambda_0)
+
+    spline = _hermite((ptL, ptR, fL, fR, gL, gR, lambda_bar), (0.0, 0.0, 0.0, dfR, 0.0, dgR), return_derivs)
+
+    # power of a negative base is only evaluated (and discarded) off-branch
+    w = (lambda_bar-lambda_0)/(lambda_p-lambda_0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        linear = 1.0 - beta*w**eta
+        dlinear_dw = -beta*eta*w**(eta-1)
+
+    condlist = [lambda_bar < ptL,
+                lambda_bar <= ptR,
+                lambda_bar < lambda_p]
+
+    choicelist = [1.0,
+                  spline[0],
+                  linear]
+
+    chi = np.select(condlist, choicelist, alpha/lambda_bar**2)
+
+    if not return_derivs:
+        return chi
+
+    dlambdap_dalpha = 0.5/lambda_p/(1.0-beta)
+
+    dchi_dlambda = np.select(condlist, [0.0, spline[1], dlinear_dw/(lambda_p-lambda_0)],
+                             -2.0*alpha/lambda_bar**3)
+    dchi_dalpha = np.select(condlist, [0.0, spline[2]*dlambdap_dalpha,
+                                       -dlinear_dw*w/(lambda_p-lambda_0)*dlambdap_dalpha],
+                            1.0/lambda_bar**2)
+
+    return chi, dchi_dlambda, dchi_dalpha
+
+
+def _powDerivs(x, k):
+    """x**k and its derivatives w.r.t. x and k (x >= 0, k > 1)"""
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y = x**k
+        dy_dx = np.where(x > 0, k*y/x, 0.0)
+        dy_dk = np.where(x > 0, y*np.log(x), 0.0)
+
+    return y, dy_dx, dy_dk
+
+
+def _shellBucklingSections(h, r1, r2, t1, t2, gamma_b, sigma_z, sigma_t, tau_zt, E, sigma_y, return_derivs=False):
+    """array version of _shellBucklingOneSection, all arguments are broadcast
+    against each other (e.g., (nsections, 1) geometry and (nsections, ncases) stresses).
+
+    if return_derivs, also returns the derivatives of the utilization w.r.t.
+    the length parameter and radius/thickness ratio of the axial/hoop checks
+    (omega, rovert) and of the shear check (omega_tau, rovert_tau), and w.r.t.
+    sigma_z, sigma_t, and tau_zt"""
+
+    # ----- geometric parameters --------
+    beta = np.arctan2(r1-r2, h)
+    L = h/np.cos(beta)
+    t = 0.5*(t1+t2)
+
+    # ------------- axial stress -------------
+    re = 0.5*(r1+r2)/np.cos(beta)
+    omega = L/np.sqrt(re*t)
+    rovert = re/t
+
+    Cx = _cxsmoothArray(omega, rovert)
+    sigma_z_Rcr = 0.605*E*Cx/rovert
+
+    lambda_z0 = 0.2
+    beta_z = 0.6
+    eta_z = 1.0
+    Q = 25.0  # quality parameter - high
+    lambda_z = np.sqrt(sigma_y/sigma_z_Rcr)
+    delta_wk = 1.0/Q*np.sqrt(rovert)*t
+    y = (delta_wk/t)**1.44
+    alpha_z = 0.62/(1 + 1.91*y)
+
+    chi_z = _bucklingReductionFactorArray(alpha_z, beta_z, eta_z, lambda_z0, lambda_z)
+
+    sigma_z_Rd = chi_z*sigma_y/gamma_b
+
+    # ---------------- hoop stress ------------------
+    sigma_t_Rcr = _sigmasmoothArray(omega, E, rovert)
+
+    alpha_t = 0.65  # high fabrication quality
+    lambda_t0 = 0.4
+    beta_t = 0.6
+    eta_t = 1.0
+    lambda_t = np.sqrt(sigma_y/sigma_t_Rcr)
+
+    chi_theta = _bucklingReductionFactorArray(alpha_t, beta_t, eta_t, lambda_t0, lambda_t)
+    sigma_t_Rd = chi_theta*sigma_y/gamma_b
+
+    # ----------------- shear stress ----------------------
+    rho = np.sqrt((r1+r2)/(2.0*r2))
+    re = (1.0 + rho - 1.0/rho)*r2*np.cos(beta)
+    omega_tau = h/np.sqrt(re*t)
+    rovert_tau = re/t
+
+    C_tau = _tausmoothArray(omega_tau, rovert_tau)
+    tau_zt_Rcr = 0.75*E*C_tau*np.sqrt(1.0/omega_tau)/rovert_tau
+
+    alpha_tau = 0.65  # high fabrifaction quality
+    beta_tau = 0.6
+    lambda_tau0 = 0.4
+    eta_tau = 1.0
+    lambda_tau = np.sqrt(sigma_y/sqrt(3)/tau_zt_Rcr)
+
+    chi_tau = _bucklingReductionFactorArray(alpha_tau, beta_tau, eta_tau, lambda_tau0, lambda_tau)
+    tau_zt_Rd = chi_tau*sigma_y/sqrt(3)/gamma_b
+
+    # buckling interaction parameters
+    k_z = 1.25 + 0.75*chi_z
+    k_theta = 1.25 + 0.75*chi_theta
+    k_tau = 1.75 + 0.25*chi_tau
+    k_i = (chi_z*chi_theta)**2
+
+    # shell buckling utilization
+    x_z = sigma_z/sigma_z_Rd
+    x_t = sigma_t/sigma_t_Rd
+    x_tau = tau_zt/tau_zt_Rd
+
+    utilization = x_z**k_z + x_t**k_theta - k_i*x_z*x_t + x_tau**k_tau
+
+    if not return_derivs:
+        return utilization
+
+    # ----------------- derivatives ----------------------
+    _, dCx_domega, dCx_drovert = _cxsmoothArray(omega, rovert, return_derivs=True)
+    _, dRcrt_domega, dRcrt_drovert = _sigmasmoothArray(omega, E, rovert, return_derivs=True)
+    _, dCtau_domega, dCtau_drovert = _tausmoothArray(omega_tau, rovert_tau, return_derivs=True)
+
+    _, dchiz_dlambda, dchiz_dalpha = _bucklingReductionFactorArray(alpha_z, beta_z, eta_z, lambda_z0, lambda_z, True)
+    _, dchit_dlambda, _ = _bucklingReductionFactorArray(alpha_t, beta_t, eta_t, lambda_t0, lambda_t, True)
+    _, dchitau_dlambda, _ = _bucklingReductionFactorArray(alpha_tau, beta_tau, eta_tau, lambda_tau0, lambda_tau, True)
+
+    _, du_z_dx, du_z_dk = _powDerivs(x_z, k_z)
+    _, du_t_dx, du_t_dk = _powDerivs(x_t, k_theta)
+    _, du_tau_dx, du_tau_dk = _powDerivs(x_tau, k_tau)
+
+    # every resistance is chi*const, so the utilization depends on the geometry
+    # only through the three reduction factors
+    dU_dchiz = 0.75*du_z_dk - 2*chi_z*chi_theta**2*x_z*x_t - (du_z_dx - k_i*x_t)*x_z/chi_z
+    dU_dchit = 0.75*du_t_dk - 2*chi_theta*chi_z**2*x_z*x_t - (du_t_dx - k_i*x_z)*x_t/chi_theta
+    dU_dchitau = 0.25*du_tau_dk - du_tau_dx*x_tau/chi_tau
+
+    # lambda = sqrt(sigma_y/Rcr)
+    dlambdaz_dRcr = -0.5*lambda_z/sigma_z_Rcr
+    dchiz_domega = dchiz_dlambda*dlambdaz_dRcr*0.605*E*dCx_domega/rovert
+    dchiz_drovert = dchiz_dlambda*dlambdaz_dRcr*0.605*E*(dCx_drovert - Cx/rovert)/rovert \
+        + dchiz_dalpha*(-0.62*1.91*0.72*y/rovert/(1 + 1.91*y)**2)
+
+    dlambdat_dRcr = -0.5*lambda_t/sigma_t_Rcr
+    dchit_domega = dchit_dlambda*dlambdat_dRcr*dRcrt_domega
+    dchit_drovert = dchit_dlambda*dlambdat_dRcr*dRcrt_drovert
+
+    dlambdatau_dRcr = -0.5*lambda_tau/tau_zt_Rcr
+    dRcrtau_domega = 0.75*E/rovert_tau*(dCtau_domega/np.sqrt(omega_tau) - 0.5*C_tau/omega_tau**1.5)
+    dRcrtau_drovert = 0.75*E/np.sqrt(omega_tau)*(dCtau_drovert - C_tau/rovert_tau)/rovert_tau
+    dchitau_domega = dchitau_dlambda*dlambdatau_dRcr*dRcrtau_domega
+    dchitau_drovert = dchitau_dlambda*dlambdatau_dRcr*dRcrtau_drovert
+
+    dU_domega = dU_dchiz*dchiz_domega + dU_dchit*dchit_domega
+    dU_drovert = dU_dchiz*dchiz_drovert + dU_dchit*dchit_drovert
+    dU_domega_tau = dU_dchitau*dchitau_domega
+    dU_drovert_tau = dU_dchitau*dchitau_drovert
+
+    dU_dsigma_z = (du_z_dx - k_i*x_t)/sigma_z_Rd
+    dU_dsigma_t = (du_t_dx - k_i*x_z)/sigma_t_Rd
+    dU_dtau_zt = du_tau_dx/tau_zt_Rd
+
+    return utilization, dU_domega, dU_drovert, dU_domega_tau, dU_drovert_tau, dU_dsigma_z, dU_dsigma_t, dU_dtau_zt
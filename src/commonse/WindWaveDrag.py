@@ -21,11 +21,11 @@ Copyright (c) NREL. All rights reserved.
 #-------------------------------------------------------------------------------
 import math
 import numpy as np
+import scipy.sparse as sp
 
 from openmdao.main.api import Component, VariableTree
 from openmdao.main.datatypes.api import Float, Array,VarTree
-from commonse.utilities import sind, cosd  # , linspace_with_deriv, interp_with_deriv, hstack, vstack
-from commonse.csystem import DirectionVector
+from commonse.utilities import sind, cosd, sparse_hstack, sparse_vstack, interpolation_plan, expand_ragged  # , linspace_with_deriv, interp_with_deriv, hstack, vstack
 
 from akima import Akima
 
@@ -40,6 +40,28 @@ cd_pt = [4.0000,  2.0000, 1.1100, 1.1100, 1.2000, 1.2000, 1.1700, 0.9000, 0.5400
 
 drag_spline = Akima(np.log10(Re_pt), cd_pt, delta_x=0.0)  # exact akima because control points do not change
 
+
+def _dragTable():
+    """piecewise-cubic coefficients of drag_spline in log10(Re/1e6).
+    Each Akima segment is a cubic Hermite polynomial, so the coefficients follow
+    from the spline values and slopes at the (fixed) control points."""
+
+    x = np.log10(Re_pt)
+    y, t = drag_spline.interp(x)
+
+    h = np.diff(x)
+    m = np.diff(y)/h
+
+    p0 = y[:-1]
+    p1 = t[:-1]
+    p2 = (3.0*m - 2.0*t[:-1] - t[1:])/h
+    p3 = (t[:-1] + t[1:] - 2.0*m)/h**2
+
+    return x, np.column_stack([p0, p1, p2, p3])
+
+drag_x, drag_coeff = _dragTable()
+
+
 def cylinderDrag(Re):
     """Drag coefficient for a smooth circular cylinder.
 
@@ -52,18 +74,234 @@ def cylinderDrag(Re):
     -------
     cd : array_like
         drag coefficient (normalized by cylinder diameter)
+    dcd_dRe : array_like
+        derivative of the drag coefficient w.r.t. Reynolds number
 
     """
 
-    ReN = Re / 1.0e6
+    Re = np.asarray(Re, dtype=float)
+    ReN = Re.ravel() / 1.0e6
 
-    cd = np.zeros_like(Re)
-    dcd_dRe = np.zeros_like(Re)
+    cd = np.zeros_like(ReN)
+    dcd_dRe = np.zeros_like(ReN)
     idx = ReN > 0
-    cd[idx], dcd_dRe[idx] = drag_spline.interp(np.log10(ReN[idx]))
-    dcd_dRe[idx] /= (Re[idx]*math.log(10))  # chain rule
 
-    return cd, dcd_dRe
+    # locate segment (end segments are extrapolated, as in akima)
+    x = np.log10(ReN[idx])
+    j = np.clip(np.searchsorted(drag_x, x, side='right') - 1, 0, len(drag_x) - 2)
+    dx = x - drag_x[j]
+    p0, p1, p2, p3 = drag_coeff[j].T
+
+    # Horner's rule
+    cd[idx] = p0 + dx*(p1 + dx*(p2 + dx*p3))
+    dcd_dRe[idx] = (p1 + dx*(2.0*p2 + dx*3.0*p3)) / (ReN[idx]*1.0e6*math.log(10))  # chain rule
+
+    return cd.reshape(Re.shape), dcd_dRe.reshape(Re.shape)
+
+
+def dragForce(U, d, rho, mu, cd_usr=0.0):
+    """Drag force per unit length on a circular cylinder, 0.5*rho*U*|U|*cd*d.
+    Vectorized over any array shape (e.g. nodes, cases x nodes, or time x nodes).
+
+    Parameters
+    ----------
+    U : array_like
+        flow speed (m/s).  the sign is preserved so oscillating flows are handled
+    d : array_like
+        cylinder diameter (m), broadcast against U
+    rho : float
+        fluid density (kg/m**3)
+    mu : float
+        dynamic viscosity (kg/(m*s))
+    cd_usr : float or array_like
+        user input drag coefficient to override Reynolds number based one.
+        an array (broadcast against U) overrides only where nonzero
+
+    Returns
+    -------
+    Fd : ndarray
+        drag force per unit length (N/m)
+
+    """
+
+    U = np.asarray(U, dtype=float)
+    cd_usr = np.asarray(cd_usr, dtype=float)
+
+    if np.all(cd_usr):
+        cd = cd_usr
+    else:
+        Re = rho*np.abs(U)*d/mu
+        cd = cylinderDrag(Re)[0]
+        if np.any(cd_usr):
+            cd = np.where(cd_usr != 0, cd_usr, cd)
+
+    return 0.5*rho*U*np.abs(U)*cd*d
+
+
+def morisonForce(U, A, d, rho, mu, cm, cd_usr=0.0):
+    """Inertial plus drag force per unit length from Morison's equation
+    (the motion of the cylinder is neglected).  Vectorized like :func:`dragForce`.
+
+    Parameters
+    ----------
+    U : array_like
+        flow speed (m/s)
+    A : array_like
+        flow acceleration (m/s**2)
+    d : array_like
+        cylinder diameter (m)
+    rho : float
+        fluid density (kg/m**3)
+    mu : float
+        dynamic viscosity (kg/(m*s))
+    cm : float
+        mass coefficient
+    cd_usr : float
+        user input drag coefficient to override Reynolds number based one
+
+    Returns
+    -------
+    Fp : ndarray
+        force per unit length (N/m)
+
+    """
+
+    return rho*cm*math.pi/4.0*d**2*np.asarray(A) + dragForce(U, d, rho, mu, cd_usr)
+
+
+def memberWindLoads(offsets, U, d, beta, rho=1.225, mu=1.7934e-5, cd_usr=0.0):
+    """Wind drag for many members (e.g., all members of a jacket) in one vectorized call.
+    Node quantities of all members are packed into flat arrays (see
+    :func:`commonse.utilities.pack_ragged`); member i owns nodes offsets[i]:offsets[i+1].
+    Same model as TowerWindDrag.
+
+    Parameters
+    ----------
+    offsets : array_like(int)
+        member offsets into the packed node arrays, shape (nmembers+1,)
+    U : array_like(float) (m/s)
+        packed wind speeds normal to the members, shape (nnodes,) or (ncases, nnodes)
+    d : array_like(float) (m)
+        diameters, per node (nnodes,) or per member (nmembers,)
+    beta : array_like(float) (deg)
+        wind angles relative to inertial c.s., scalar, per node, or per member
+    rho : float (kg/m**3)
+        air density
+    mu : float (kg/(m*s))
+        dynamic viscosity of air
+    cd_usr : float or array_like(float)
+        user input drag coefficient(s), scalar or per member (0 uses the Reynolds number based one)
+
+    Returns
+    -------
+    Px, Py, Pz, qdyn : ndarray(float)
+        packed force per unit length (N/m) and dynamic pressure (N/m**2), same shape as U
+
+    """
+
+    U = np.asarray(U, dtype=float)
+    d = expand_ragged(d, offsets)
+    beta = expand_ragged(beta, offsets)
+    cd_usr = expand_ragged(cd_usr, offsets)
+
+    Fp = dragForce(U, d, rho, mu, cd_usr)
+
+    return Fp*cosd(beta), Fp*sind(beta), np.zeros_like(Fp), 0.5*rho*U**2
+
+
+def memberWaveLoads(offsets, U, A, d, beta, rho=1027.0, mu=1.3351e-3, cm=2.0, cd_usr=0.0):
+    """Morison wave loads for many members in one vectorized call, using the packed
+    layout of :func:`memberWindLoads`.  Same model as TowerWaveDrag.
+
+    Parameters
+    ----------
+    offsets : array_like(int)
+        member offsets into the packed node arrays, shape (nmembers+1,)
+    U : array_like(float) (m/s)
+        packed wave speeds, shape (nnodes,) or (ncases, nnodes)
+    A : array_like(float) (m/s**2)
+        packed wave accelerations, same shape as U
+    d : array_like(float) (m)
+        diameters, per node (nnodes,) or per member (nmembers,)
+    beta : array_like(float) (deg)
+        wave angles relative to inertial c.s., scalar, per node, or per member
+    rho : float (kg/m**3)
+        water density
+    mu : float (kg/(m*s))
+        dynamic viscosity of water
+    cm : float or array_like(float)
+        mass coefficient(s), scalar or per member
+    cd_usr : float or array_like(float)
+        user input drag coefficient(s), scalar or per member (0 uses the Reynolds number based one)
+
+    Returns
+    -------
+    Px, Py, Pz, qdyn : ndarray(float)
+        packed force per unit length (N/m) and dynamic pressure (N/m**2), same shape as U
+
+    """
+
+    U = np.asarray(U, dtype=float)
+    d = expand_ragged(d, offsets)
+    beta = expand_ragged(beta, offsets)
+    cm = expand_ragged(cm, offsets)
+    cd_usr = expand_ragged(cd_usr, offsets)
+
+    Fp = morisonForce(U, A, d, rho, mu, cm, cd_usr)
+
+    return Fp*cosd(beta), Fp*sind(beta), np.zeros_like(Fp), 0.5*rho*U**2
+
+
+def yawedLoads(z, windLoads, waveLoads, yaw):
+    """Combined wind and wave loads in the yaw-aligned coordinate system for
+    one or more yaw angles (see AeroHydroLoads).  The loads are interpolated
+    onto z once; the rotation is then a single vectorized pass over all yaw angles.
+
+    Parameters
+    ----------
+    z : array_like(float) (m)
+        locations along tower (hub height is the last entry)
+    windLoads : FluidLoads
+        wind loads in inertial coordinate system
+    waveLoads : FluidLoads
+        wave loads in inertial coordinate system
+    yaw : float or array_like(float) (deg)
+        yaw angle(s)
+
+    Returns
+    -------
+    Px, Py, Pz, qdyn : ndarray(float)
+        force per unit length (N/m) and dynamic pressure (N/m**2), shape (nyaw, nz)
+
+    """
+
+    wind = windLoads
+    wave = waveLoads
+    yaw = np.atleast_1d(np.asarray(yaw, dtype=float))[:, np.newaxis]
+
+    hubHt = z[-1]  # top of tower
+    betaMain = np.interp(hubHt, z, wind.beta)  # wind coordinate system defined relative to hub height
+
+    # inertial components on the tower grid (interpolation plans are cached across runs)
+    windplan = interpolation_plan(wind.z, z)
+    waveplan = interpolation_plan(wave.z, z)
+    Px, Py, Pz, qdyn = windplan(np.vstack([wind.Px, wind.Py, wind.Pz, wind.qdyn])) \
+        + waveplan(np.vstack([wave.Px, wave.Py, wave.Pz, wave.qdyn]))
+
+    # inertial -> wind -> yaw is one rotation about z by betaMain + yaw
+    # (same convention as DirectionVector.inertialToWind(...).windToYaw(...))
+    theta = np.radians(betaMain + yaw)
+    c = np.cos(theta)
+    s = np.sin(theta)
+
+    nyaw = len(yaw)
+    Pxy = Px*c + Py*s
+    Pyy = -Px*s + Py*c
+    Pzy = np.tile(Pz, (nyaw, 1))
+    qdyn = np.tile(qdyn, (nyaw, 1))
+
+    return Pxy, Pyy, Pzy, qdyn
+
 
 # -----------------
 #  Variable Trees
@@ -104,17 +342,12 @@ class AeroHydroLoads(Component):
 
     def execute(self):
         # aero/hydro loads
-        wind = self.windLoads
-        wave = self.waveLoads
-        hubHt = self.z[-1]  # top of tower
-        betaMain = np.interp(hubHt, self.z, wind.beta)  # wind coordinate system defined relative to hub height
-        windLoads = DirectionVector(wind.Px, wind.Py, wind.Pz).inertialToWind(betaMain).windToYaw(self.yaw)
-        waveLoads = DirectionVector(wave.Px, wave.Py, wave.Pz).inertialToWind(betaMain).windToYaw(self.yaw)
-
-        self.outloads.Px = np.interp(self.z, wind.z, windLoads.x) + np.interp(self.z, wave.z, waveLoads.x)
-        self.outloads.Py = np.interp(self.z, wind.z, windLoads.y) + np.interp(self.z, wave.z, waveLoads.y)
-        self.outloads.Pz = np.interp(self.z, wind.z, windLoads.z) + np.interp(self.z, wave.z, waveLoads.z)
-        self.outloads.qdyn = np.interp(self.z, wind.z, wind.qdyn) + np.interp(self.z, wave.z, wave.qdyn)
+        Px, Py, Pz, qdyn = yawedLoads(self.z, self.windLoads, self.waveLoads, self.yaw)
+
+        self.outloads.Px = Px[0]
+        self.outloads.Py = Py[0]
+        self.outloads.Pz = Pz[0]
+        self.outloads.qdyn = qdyn[0]
         self.outloads.z = self.z
         #The following are redundant, at one point we will consolidate them to something that works for both tower (not using vartrees) and jacket (still using vartrees)
 
@@ -146,6 +379,9 @@ class TowerWindDrag(Component):
 
     missing_deriv_policy = 'assume_zero'
 
+    # if True, provideJ returns a scipy.sparse CSR matrix (all blocks are diagonal)
+    sparse_jacobian = False
+
 
     def execute(self):
 
@@ -206,6 +442,17 @@ class TowerWindDrag(Component):
 
         n = len(self.z)
 
+        if self.sparse_jacobian:
+            zeron = sp.csr_matrix((n, n))
+
+            dPx = sparse_hstack([sp.diags(self.dPx_dU, 0), zeron, sp.diags(self.dPx_dd, 0)])
+            dPy = sparse_hstack([sp.diags(self.dPy_dU, 0), zeron, sp.diags(self.dPy_dd, 0)])
+            dPz = sp.csr_matrix((n, 3*n))
+            dq = sparse_hstack([sp.diags(self.dq_dU, 0), sp.csr_matrix((n, 2*n))])
+            dz = sparse_hstack([zeron, sp.identity(n), zeron])
+
+            return sparse_vstack([dPx, dPy, dPz, dq, dz])
+
         zeron = np.zeros((n, n))
 
         dPx = np.hstack([np.diag(self.dPx_dU), zeron, np.diag(self.dPx_dd)])
@@ -246,6 +493,9 @@ class TowerWaveDrag(Component):
 
     missing_deriv_policy = 'assume_zero'
 
+    # if True, provideJ returns a scipy.sparse CSR matrix (all blocks are diagonal)
+    sparse_jacobian = False
+
 
     def execute(self):
 
@@ -335,6 +585,72 @@ class TowerWaveDrag(Component):
         self.dPy_dA = const*sind(beta)
 
 
+    def _timeStep(self, U, A):
+        """Morison loads for a block of time steps (nt x nz)"""
+
+        Fp = morisonForce(U, A, self.d, self.rho, self.mu, self.cm, self.cd_usr)
+        q = 0.5*self.rho*U**2
+
+        return Fp*cosd(self.beta), Fp*sind(self.beta), 0.*Fp, q
+
+
+    def timeDomainLoads(self, U, A, chunk_size=1000):
+        """Distributed wave loads at every time step, using the geometry and
+        parameters of this component (d, beta, rho, mu, cm, cd_usr).
+        Unlike execute, the drag term keeps the sign of the velocity (U*|U|).
+        The quantities at z=0 MSL (Px0, Py0, Pz0, q0) are not computed, as they
+        would need the wave speed and acceleration at MSL at every time step.
+
+        Parameters
+        ----------
+        U : ndarray(float) (m/s)
+            wave speed, shape (nt, nz)
+        A : ndarray(float) (m/s**2)
+            wave acceleration, shape (nt, nz)
+        chunk_size : int
+            number of time steps processed at once (bounds temporary memory)
+
+        Returns
+        -------
+        Px, Py, Pz : ndarray(float) (N/m)
+            distributed loads in inertial coordinate system, shape (nt, nz)
+        qdyn : ndarray(float) (N/m**2)
+            dynamic pressure, shape (nt, nz)
+
+        """
+
+        nt = len(U)
+        Px = np.empty(np.shape(U))
+        Py = np.empty(np.shape(U))
+        Pz = np.empty(np.shape(U))
+        qdyn = np.empty(np.shape(U))
+
+        for start in range(0, nt, chunk_size):
+            block = slice(start, min(start + chunk_size, nt))
+            Px[block], Py[block], Pz[block], qdyn[block] = self._timeStep(U[block], A[block])
+
+        return Px, Py, Pz, qdyn
+
+
+    def iterTimeDomainLoads(self, chunks):
+        """Streaming version of timeDomainLoads.
+
+        Parameters
+        ----------
+        chunks : iterable
+            yields (t, U, A) with U, A of shape (nt, nz), e.g., IrregularWaves.timeseries()
+
+        Returns
+        -------
+        generator yielding (t, Px, Py, Pz, qdyn) for each chunk
+
+        """
+
+        for t, U, A in chunks:
+            Px, Py, Pz, qdyn = self._timeStep(U, A)
+            yield t, Px, Py, Pz, qdyn
+
+
     def list_deriv_vars(self):
 
         inputs = ('U', 'A', 'z', 'd')
@@ -347,6 +663,17 @@ class TowerWaveDrag(Component):
 
         n = len(self.z)
 
+        if self.sparse_jacobian:
+            zeron = sp.csr_matrix((n, n))
+
+            dPx = sparse_hstack([sp.diags(self.dPx_dU, 0), sp.diags(self.dPx_dA, 0), zeron, sp.diags(self.dPx_dd, 0)])
+            dPy = sparse_hstack([sp.diags(self.dPy_dU, 0), sp.diags(self.dPy_dA, 0), zeron, sp.diags(self.dPy_dd, 0)])
+            dPz = sp.csr_matrix((n, 4*n))
+            dq = sparse_hstack([sp.diags(self.dq_dU, 0), sp.csr_matrix((n, 3*n))])
+            dz = sparse_hstack([zeron, zeron, sp.identity(n), zeron])
+
+            return sparse_vstack([dPx, dPy, dPz, dq, dz, sp.csr_matrix((n, 4*n))])  # TODO: remove these zeros after OpenMDAO bug fix (don't need waveLoads.beta)
+
         zeron = np.zeros((n, n))
 
         dPx = np.hstack([np.diag(self.dPx_dU), np.diag(self.dPx_dA), zeron, np.diag(self.dPx_dd)])
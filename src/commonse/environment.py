@@ -9,11 +9,423 @@ Copyright (c) NREL. All rights reserved.
 
 import math
 import numpy as np
-from scipy.optimize import brentq
+import scipy.sparse as sp
 from openmdao.main.api import Component
-from openmdao.main.datatypes.api import Float, Array
+from openmdao.main.datatypes.api import Float, Array, Int, Enum
+
+from utilities import hstack, vstack, sparse_hstack, LRUCache
+
+
+# -----------------
+#  Helper Functions
+# -----------------
+
+
+def _caseColumns(*params):
+    """convert scalar or per-case parameters to column vectors (ncases x 1)
+    so they broadcast against a row of heights"""
+
+    return [np.atleast_1d(np.asarray(p, dtype=float))[:, np.newaxis] for p in params]
+
+
+def powerWindCases(Uref, zref, z, z0=0.0, shearExp=0.2, betaWind=0.0):
+    """power-law wind profiles for many load cases in one vectorized pass.
+    Any of the case parameters may be a scalar (shared by all cases) or an
+    array with one entry per case.
+
+    Parameters
+    ----------
+    Uref : float or array_like(float) (m/s)
+        reference wind speed (usually at hub height)
+    zref : float or array_like(float) (m)
+        corresponding reference height
+    z : array_like(float) (m)
+        heights where wind speed should be computed (shared by all cases)
+    z0 : float or array_like(float) (m)
+        bottom of wind profile (height of ground/sea)
+    shearExp : float or array_like(float)
+        shear exponent
+    betaWind : float or array_like(float) (deg)
+        wind angle relative to inertial coordinate system
+
+    Returns
+    -------
+    U : ndarray(float) (m/s)
+        wind speed, shape (ncases, nz)
+    beta : ndarray(float) (deg)
+        wind angles, shape (ncases, nz)
+    dU_dUref : ndarray(float)
+        derivative of U w.r.t. Uref, shape (ncases, nz)
+    dU_dz : ndarray(float)
+        diagonal of the derivative of U w.r.t. z, shape (ncases, nz)
+    dU_dzref : ndarray(float)
+        derivative of U w.r.t. zref, shape (ncases, nz)
+
+    """
+
+    Uref, zref, z0, shearExp, betaWind = _caseColumns(Uref, zref, z0, shearExp, betaWind)
+    z = np.asarray(z, dtype=float)[np.newaxis, :]
+    z, Uref, zref, z0, shearExp, betaWind = np.broadcast_arrays(z, Uref, zref, z0, shearExp, betaWind)
+
+    # velocity
+    idx = z > z0
+    ratio = np.ones_like(z)  # filler avoids fractional powers of negative numbers
+    ratio[idx] = (z[idx] - z0[idx])/(zref[idx] - z0[idx])
+    profile = np.where(idx, ratio**shearExp, 0.0)
+    U = Uref*profile
+    beta = betaWind.copy()
+
+    # gradients
+    dU_dUref = profile
+    dU_dz = np.zeros_like(z)
+    dU_dzref = np.zeros_like(z)
+    dU_dz[idx] = U[idx]*shearExp[idx]/(z[idx] - z0[idx])
+    dU_dzref[idx] = -U[idx]*shearExp[idx]/(zref[idx] - z0[idx])
+
+    return U, beta, dU_dUref, dU_dz, dU_dzref
+
+
+def logWindCases(Uref, zref, z, z0=0.0, z_roughness=10.0, betaWind=0.0):
+    """logarithmic-profile wind for many load cases in one vectorized pass.
+    Any of the case parameters may be a scalar (shared by all cases) or an
+    array with one entry per case.
+
+    Parameters
+    ----------
+    Uref : float or array_like(float) (m/s)
+        reference wind speed (usually at hub height)
+    zref : float or array_like(float) (m)
+        corresponding reference height
+    z : array_like(float) (m)
+        heights where wind speed should be computed (shared by all cases)
+    z0 : float or array_like(float) (m)
+        bottom of wind profile (height of ground/sea)
+    z_roughness : float or array_like(float) (mm)
+        surface roughness length
+    betaWind : float or array_like(float) (deg)
+        wind angle relative to inertial coordinate system
+
+    Returns
+    -------
+    U, beta, dU_dUref, dU_dz, dU_dzref : ndarray(float)
+        same layout as :func:`powerWindCases`, each of shape (ncases, nz)
+
+    """
+
+    Uref, zref, z0, z_roughness, betaWind = _caseColumns(Uref, zref, z0, z_roughness, betaWind)
+    z = np.asarray(z, dtype=float)[np.newaxis, :]
+    z, Uref, zref, z0, z_roughness, betaWind = np.broadcast_arrays(z, Uref, zref, z0, z_roughness, betaWind)
+    z_roughness = z_roughness/1e3  # convert to m
+
+    # velocity
+    idx = z - z0 > z_roughness
+    lt = np.zeros_like(z)
+    lt[idx] = np.log((z[idx] - z0[idx])/z_roughness[idx])
+    lb = np.log((zref - z0)/z_roughness)
+    U = Uref*lt/lb
+    beta = betaWind.copy()
+
+    # gradients
+    dU_dUref = lt/lb
+    dU_dz = np.zeros_like(z)
+    dU_dzref = np.zeros_like(z)
+    dU_dz[idx] = Uref[idx]/lb[idx] / (z[idx] - z0[idx])
+    dU_dzref[idx] = -Uref[idx]*lt[idx] / lb[idx]**2 / (zref[idx] - z0[idx])
+
+    return U, beta, dU_dUref, dU_dz, dU_dzref
+
+
+_wavenumber_cache = LRUCache(maxsize=8192)
+
+
+def _solveDispersion(T, d, g, tol=1e-15, maxiter=50):
+    """vectorized Newton solve of omega^2 = g k tanh(k d) starting from
+    Eckart's explicit approximation"""
+
+    omega = 2.0*math.pi/T
+    k0 = omega**2/g  # deep water wave number
+
+    # Eckart (1952) explicit approximation, within a few percent everywhere
+    k = k0/np.sqrt(np.tanh(k0*d))
+
+    # Newton polishing
+    for i in range(maxiter):
+        th = np.tanh(k*d)
+        f = g*k*th - omega**2
+        df = g*th + g*k*d*(1.0 - th**2)
+        dk = f/df
+        k = k - dk
+        if np.all(np.abs(dk) <= tol*k):
+            break
+
+    return k
+
+
+def wavenumber(T, d, g=9.81, cache=True):
+    """wave number from the linear dispersion relation omega^2 = g k tanh(k d).
+    vectorized over periods and depths.  solutions are kept in an LRU cache
+    keyed by each unique (T, d, g) so repeated and overlapping solves are free.
+
+    Parameters
+    ----------
+    T : float or array_like(float) (s)
+        wave period
+    d : float or array_like(float) (m)
+        water depth
+    g : float or array_like(float) (m/s**2)
+        acceleration of gravity
+    cache : bool
+        if True, look up and store the solution in the module level cache
+
+    Returns
+    -------
+    k : float or ndarray(float) (1/m)
+        wave number, same shape as the broadcast inputs
+
+    """
+
+    # scalar case (e.g., LinearWaves)
+    if np.isscalar(T) and np.isscalar(d) and np.isscalar(g):
+        key = (float(T), float(d), float(g))
+        k = _wavenumber_cache.get(key) if cache else None
+        if k is None:
+            k = float(_solveDispersion(*key))
+            if cache:
+                _wavenumber_cache.put(key, k)
+        return k
+
+    T, d, g = np.broadcast_arrays(np.asarray(T, dtype=float), np.asarray(d, dtype=float),
+        np.asarray(g, dtype=float))
+    shape = T.shape
+
+    if not cache:
+        return _solveDispersion(T.ravel(), d.ravel(), g.ravel()).reshape(shape)
+
+    # each unique (T, d, g) is looked up once, the misses are solved together
+    Tdg, inverse = np.unique(np.column_stack([T.ravel(), d.ravel(), g.ravel()]), axis=0,
+        return_inverse=True)
+    keys = [tuple(row) for row in Tdg.tolist()]
+
+    ku = np.array([_wavenumber_cache.get(key) for key in keys], dtype=float)  # None -> nan
+    miss = np.flatnonzero(np.isnan(ku))
+
+    if len(miss) > 0:
+        ku[miss] = _solveDispersion(Tdg[miss, 0], Tdg[miss, 1], Tdg[miss, 2])
+        for i in miss:
+            _wavenumber_cache.put(keys[i], float(ku[i]))
+
+    return ku[inverse].reshape(shape)
+
+
+def linearWavesCases(hmax, T, z, z_surface, z_floor=0.0, Uc=0.0, g=9.81, k=None):
+    """maximum linear (Airy) wave kinematics for many regular waves in one vectorized pass.
+    hmax, T, and Uc may be scalars or arrays with one entry per case.
+
+    Parameters
+    ----------
+    hmax : float or array_like(float) (m)
+        maximum wave height (crest-to-trough)
+    T : float or array_like(float) (s)
+        period of maximum wave height
+    z : array_like(float) (m)
+        heights where wave speed should be computed (shared by all cases)
+    z_surface : float (m)
+        vertical location of water surface
+    z_floor : float (m)
+        vertical location of sea floor
+    Uc : float or array_like(float) (m/s)
+        mean current speed
+    g : float (m/s**2)
+        acceleration of gravity
+    k : float or array_like(float) (1/m)
+        wave number of each case, if already known (otherwise solved from T)
+
+    Returns
+    -------
+    U : ndarray(float) (m/s)
+        maximum wave speed, shape (ncases, nz)
+    A : ndarray(float) (m/s**2)
+        maximum wave acceleration, shape (ncases, nz)
+
+    """
+
+    hmax, T, Uc = _caseColumns(hmax, T, Uc)
+    z = np.asarray(z, dtype=float)
+
+    # water depth
+    d = z_surface - z_floor
+
+    # circular frequency and wave number (each unique period is solved once)
+    omega = 2.0*math.pi/T
+    if k is None:
+        k = wavenumber(T, d, g)
+    else:
+        k = _caseColumns(k)[0]
+
+    # maximum velocity
+    z_rel = z - z_surface
+    U = hmax/2.0*omega*np.cosh(k*(z_rel + d))/np.sinh(k*d) + Uc
+    U = U*np.ones((1, len(z)))  # in case all case parameters are scalar
+
+    # check heights
+    U[:, np.logical_or(z < z_floor, z > z_surface)] = 0.
+
+    # acceleration
+    A = U * omega
+
+    return U, A
+
+
+def jonswap(omega, Hs, Tp, gamma=3.3):
+    """JONSWAP wave spectrum (DNV-RP-C205 form).  gamma=1 gives the Pierson-Moskowitz spectrum.
+
+    Parameters
+    ----------
+    omega : array_like(float) (rad/s)
+        circular frequencies
+    Hs : float (m)
+        significant wave height
+    Tp : float (s)
+        peak spectral period
+    gamma : float
+        peak enhancement factor
+
+    Returns
+    -------
+    S : ndarray(float) (m**2*s/rad)
+        spectral density at each frequency
+
+    """
+
+    omega = np.asarray(omega, dtype=float)
+    wp = 2.0*math.pi/Tp
+
+    # Pierson-Moskowitz
+    S = 5.0/16.0*Hs**2*wp**4*omega**-5*np.exp(-1.25*(wp/omega)**4)
+
+    # peak enhancement
+    sigma = np.where(omega <= wp, 0.07, 0.09)
+    alpha = np.exp(-0.5*((omega - wp)/(sigma*wp))**2)
+    S *= (1.0 - 0.287*math.log(gamma))*gamma**alpha
+
+    return S
+
+
+def kaimal(f, U, sigma, L):
+    """Kaimal spectrum (IEC 61400-1 form)
+
+    Parameters
+    ----------
+    f : array_like(float) (Hz)
+        frequencies
+    U : float (m/s)
+        mean wind speed
+    sigma : float or array_like(float) (m/s)
+        standard deviation of the wind speed
+    L : float (m)
+        integral length scale
+
+    Returns
+    -------
+    S : ndarray(float) (m**2/s)
+        one-sided spectral density at each frequency
+
+    """
+
+    f = np.asarray(f, dtype=float)
+    return 4.0*sigma**2*L/U / (1.0 + 6.0*f*L/U)**(5.0/3)
+
+
+def vonKarman(f, U, sigma, L):
+    """von Karman spectrum (IEC 61400-1 form), same arguments as :func:`kaimal`"""
+
+    f = np.asarray(f, dtype=float)
+    return 4.0*sigma**2*L/U / (1.0 + 70.8*(f*L/U)**2)**(5.0/6)
+
+
+def _airyTransfer(k, z_rel, d):
+    """cosh(k(z+d))/sinh(kd) for each wave number (rows) and depth (columns),
+    written with decaying exponentials so deep-water components do not overflow"""
+
+    k = k[:, np.newaxis]
+    z_rel = z_rel[np.newaxis, :]
+
+    return (np.exp(k*z_rel) + np.exp(-k*(z_rel + 2*d))) / (1.0 - np.exp(-2*k*d))
+
+
+def soilStiffness(r0, depth, G=140e6, nu=0.4, rigid=None):
+    """textbook soil stiffness (see TowerSoil) for many foundation candidates at once.
+    All inputs broadcast against each other.
+
+    Parameters
+    ----------
+    r0 : float or array_like(float) (m)
+        radius of base of tower
+    depth : float or array_like(float) (m)
+        depth of foundation in the soil
+    G : float or array_like(float) (Pa)
+        shear modulus of soil
+    nu : float or array_like(float)
+        Poisson's ratio of soil
+    rigid : array_like(bool)
+        directions that should be considered infinitely rigid, either shape (6,)
+        for all candidates or (n, 6) for one row per candidate.
+        order is x, theta_x, y, theta_y, z, theta_z
+
+    Returns
+    -------
+    k : ndarray(float) (N/m)
+        spring stiffness, shape (n, 6)
+    dk : ndarray(float)
+        derivatives of k w.r.t. (r0, depth), shape (n, 6, 2)
+
+    """
+
+    r0, h, G, nu = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float)) for x in (r0, depth, G, nu)])
+    n = len(r0)
+
+    # vertical
+    eta = 1.0 + 0.6*(1.0-nu)*h/r0
+    k_z = 4*G*r0*eta/(1.0-nu)
+    deta_dr0 = -0.6*(1.0-nu)*h/r0**2
+    dkz_dr0 = 4*G/(1.0-nu)*(eta + r0*deta_dr0)
+    deta_dh = 0.6*(1.0-nu)/r0
+    dkz_dh = 4*G*r0/(1.0-nu)*deta_dh
+
+    # horizontal
+    eta = 1.0 + 0.55*(2.0-nu)*h/r0
+    k_x = 32.0*(1.0-nu)*G*r0*eta/(7.0-8.0*nu)
+    deta_dr0 = -0.55*(2.0-nu)*h/r0**2
+    dkx_dr0 = 32.0*(1.0-nu)*G/(7.0-8.0*nu)*(eta + r0*deta_dr0)
+    deta_dh = 0.55*(2.0-nu)/r0
+    dkx_dh = 32.0*(1.0-nu)*G*r0/(7.0-8.0*nu)*deta_dh
+
+    # rocking
+    eta = 1.0 + 1.2*(1.0-nu)*h/r0 + 0.2*(2.0-nu)*(h/r0)**3
+    k_thetax = 8.0*G*r0**3*eta/(3.0*(1.0-nu))
+    deta_dr0 = -1.2*(1.0-nu)*h/r0**2 - 3*0.2*(2.0-nu)*(h/r0)**3/r0
+    dkthetax_dr0 = 8.0*G/(3.0*(1.0-nu))*(3*r0**2*eta + r0**3*deta_dr0)
+    deta_dh = 1.2*(1.0-nu)/r0 + 3*0.2*(2.0-nu)*(1.0/r0)**3*h**2
+    dkthetax_dh = 8.0*G*r0**3/(3.0*(1.0-nu))*deta_dh
+
+    # torsional
+    k_phi = 16.0*G*r0**3/3.0
+    dkphi_dr0 = 16.0*G*3*r0**2/3.0
+    dkphi_dh = np.zeros(n)
+
+    k = np.column_stack([k_x, k_thetax, k_x, k_thetax, k_z, k_phi])
+    dk = np.empty((n, 6, 2))
+    dk[:, :, 0] = np.column_stack([dkx_dr0, dkthetax_dr0, dkx_dr0, dkthetax_dr0, dkz_dr0, dkphi_dr0])
+    dk[:, :, 1] = np.column_stack([dkx_dh, dkthetax_dh, dkx_dh, dkthetax_dh, dkz_dh, dkphi_dh])
+
+    # rigid directions
+    if rigid is not None and np.size(rigid) > 0:
+        rigid = np.broadcast_to(np.asarray(rigid, dtype=bool), (n, 6))
+        k[rigid] = float('inf')
+        dk[rigid] = 0.0
+
+    return k, dk
 
-from utilities import hstack, vstack
 
 # -----------------
 #  Base Components
@@ -39,6 +451,10 @@ class WindBase(Component):
 
     missing_deriv_policy = 'assume_zero'  # TODO: for now OpenMDAO issue
 
+    # if True, provideJ returns a scipy.sparse CSR matrix rather than a dense array.
+    # the profiles only couple U[i] to z[i], so the dense Jacobian is almost all zeros.
+    sparse_jacobian = False
+
 
 class WaveBase(Component):
     """base component for wave speed/direction"""
@@ -98,17 +514,10 @@ class PowerWind(WindBase):
 
     def execute(self):
 
-        # rename
-        z = self.z
-        zref = self.zref
-        z0 = self.z0
-
         # velocity
-        idx = z > z0
-        n = len(z)
-        self.U = np.zeros(n)
-        self.U[idx] = self.Uref*((z[idx] - z0)/(zref - z0))**self.shearExp
-        self.beta = self.betaWind*np.ones_like(z)
+        U, beta = powerWindCases(self.Uref, self.zref, self.z, self.z0, self.shearExp, self.betaWind)[:2]
+        self.U = U[0]
+        self.beta = beta[0]
 
         # # add small cubic spline to allow continuity in gradient
         # k = 0.01  # fraction of profile with cubic spline
@@ -134,24 +543,12 @@ class PowerWind(WindBase):
 
     def provideJ(self):
 
-        # rename
-        z = self.z
-        zref = self.zref
-        z0 = self.z0
-        shearExp = self.shearExp
-        U = self.U
-        Uref = self.Uref
-
         # gradients
-        n = len(z)
-        dU_dUref = np.zeros(n)
-        dU_dz = np.zeros(n)
-        dU_dzref = np.zeros(n)
-
-        idx = z > z0
-        dU_dUref[idx] = U[idx]/Uref
-        dU_dz[idx] = U[idx]*shearExp/(z[idx] - z0)
-        dU_dzref[idx] = -U[idx]*shearExp/(zref - z0)
+        dU_dUref, dU_dz, dU_dzref = powerWindCases(self.Uref, self.zref, self.z, self.z0,
+            self.shearExp, self.betaWind)[2:]
+        dU_dUref = dU_dUref[0]
+        dU_dz = dU_dz[0]
+        dU_dzref = dU_dzref[0]
 
 
         # # cubic spline region
@@ -170,7 +567,10 @@ class PowerWind(WindBase):
         # dg2_dzref = -Uref*k**shearExp*shearExp/k/(zref - z0)**2
         # dU_dzref[idx] = self.spline.eval_deriv_params(z[idx], 0.0, dx2_dzref, 0.0, 0.0, 0.0, dg2_dzref)
 
-        J = hstack([dU_dUref, np.diag(dU_dz), dU_dzref])
+        if self.sparse_jacobian:
+            J = sparse_hstack([dU_dUref, sp.diags(dU_dz, 0), dU_dzref])
+        else:
+            J = hstack([dU_dUref, np.diag(dU_dz), dU_dzref])
 
         return J
 
@@ -188,17 +588,10 @@ class LogWind(WindBase):
 
     def execute(self):
 
-        # rename
-        z = self.z
-        zref = self.zref
-        z0 = self.z0
-        z_roughness = self.z_roughness/1e3  # convert to m
-
         # find velocity
-        idx = [z - z0 > z_roughness]
-        self.U = np.zeros_like(z)
-        self.U[idx] = self.Uref*np.log((z[idx] - z0)/z_roughness) / math.log((zref - z0)/z_roughness)
-        self.beta = self.betaWind*np.ones_like(z)
+        U, beta = logWindCases(self.Uref, self.zref, self.z, self.z0, self.z_roughness, self.betaWind)[:2]
+        self.U = U[0]
+        self.beta = beta[0]
 
 
     def list_deriv_vars(self):
@@ -211,29 +604,179 @@ class LogWind(WindBase):
 
     def provideJ(self):
 
-        # rename
-        z = self.z
-        zref = self.zref
-        z0 = self.z0
-        z_roughness = self.z_roughness/1e3
-        Uref = self.Uref
+        dU_dUref, dU_dz_diag, dU_dzref = logWindCases(self.Uref, self.zref, self.z, self.z0,
+            self.z_roughness, self.betaWind)[2:]
 
-        n = len(z)
+        if self.sparse_jacobian:
+            J = sparse_hstack([dU_dUref[0], sp.diags(dU_dz_diag[0], 0), dU_dzref[0]])
+        else:
+            J = hstack([dU_dUref[0], np.diag(dU_dz_diag[0]), dU_dzref[0]])
 
-        dU_dUref = np.zeros(n)
-        dU_dz_diag = np.zeros(n)
-        dU_dzref = np.zeros(n)
+        return J
 
-        idx = [z - z0 > z_roughness]
-        lt = np.log((z[idx] - z0)/z_roughness)
-        lb = math.log((zref - z0)/z_roughness)
-        dU_dUref[idx] = lt/lb
-        dU_dz_diag[idx] = Uref/lb / (z[idx] - z0)
-        dU_dzref[idx] = -Uref*lt / math.log((zref - z0)/z_roughness)**2 / (zref - z0)
 
-        J = hstack([dU_dUref, np.diag(dU_dz_diag), dU_dzref])
 
-        return J
+class TurbulentWind(WindBase):
+    """turbulent wind speed time series U(z, t) from a Kaimal or von Karman
+    spectrum with exponential (IEC) spatial coherence between nodes.
+    The mean profile is PowerWind or LogWind, and U (the component output)
+    is that mean profile.  The turbulent field is synthesized by inverse FFT
+    of overlapping segments that are joined with a power-complementary
+    crossfade, so timeseries() yields fixed-size chunks in bounded memory
+    (the spatial coherence is factored in frequency blocks within memory_budget).
+    Frequencies below 1/(segment*dt) are not represented, so the spectrum is scaled
+    for the represented band to carry the full variance (TI*Uref)**2."""
+
+    # parameters
+    profile = Enum('power', ('power', 'log'), iotype='in', desc='mean wind profile')
+    shearExp = Float(0.2, iotype='in', desc='shear exponent (power profile)')
+    z_roughness = Float(10.0, iotype='in', units='mm', desc='surface roughness length (log profile)')
+    betaWind = Float(0.0, iotype='in', units='deg', desc='wind angle relative to inertial coordinate system')
+    spectrum = Enum('kaimal', ('kaimal', 'vonkarman'), iotype='in', desc='turbulence spectrum')
+    TI = Float(0.14, iotype='in', desc='turbulence intensity at the reference height')
+    L = Float(340.2, iotype='in', units='m', desc='integral length scale')
+    coh_decay = Float(12.0, iotype='in', desc='coherence decrement')
+    Lc = Float(340.2, iotype='in', units='m', desc='coherence scale parameter')
+    duration = Float(600.0, iotype='in', units='s', desc='length of the simulated record')
+    dt = Float(0.1, iotype='in', units='s', desc='time step of the simulated record')
+    segment = Int(4096, iotype='in', desc='number of time steps in each FFT segment')
+    overlap = Int(256, iotype='in', desc='number of time steps crossfaded between segments')
+    seed = Int(0, iotype='in', desc='random seed for the Fourier phases')
+    memory_budget = Float(64.0, iotype='in', desc='memory (MB) for the coherence factors, which are built in frequency blocks of this size and kept between segments only if all of them fit')
+
+    missing_deriv_policy = 'assume_zero'
+
+
+    def _meanProfile(self):
+
+        if self.profile == 'power':
+            U, beta = powerWindCases(self.Uref, self.zref, self.z, self.z0, self.shearExp, self.betaWind)[:2]
+        else:
+            U, beta = logWindCases(self.Uref, self.zref, self.z, self.z0, self.z_roughness, self.betaWind)[:2]
+
+        return U[0], beta[0]
+
+
+    def _checkSegments(self):
+
+        if 2*self.overlap >= self.segment:
+            raise ValueError('overlap ({}) must be less than half of segment ({}), otherwise the '
+                'crossfades overlap'.format(self.overlap, self.segment))
+
+
+    def execute(self):
+
+        self._checkSegments()
+        self.U, self.beta = self._meanProfile()
+
+
+    def _spectrum(self):
+        """frequencies and auto-spectral density of each Fourier component"""
+
+        N = self.segment
+        f = np.arange(1, N//2)/(N*self.dt)  # skip mean and Nyquist
+        sigma = self.TI*self.Uref
+
+        if self.spectrum == 'kaimal':
+            S = kaimal(f, self.Uref, sigma, self.L)
+        else:
+            S = vonKarman(f, self.Uref, sigma, self.L)
+
+        # variance outside of the represented band is put back in proportionally
+        S *= sigma**2/(np.sum(S)/(N*self.dt))
+
+        return f, S
+
+
+    def _blockSize(self, nf):
+        """number of frequencies whose coherence matrix and Cholesky factor fit in the budget"""
+
+        nz = len(self.z)
+        bytes_per_f = 2*8*nz*nz  # coh and H
+        return int(min(nf, max(1, self.memory_budget*1e6 // bytes_per_f)))
+
+
+    def _factorBlocks(self, f, S):
+        """Cholesky factors of the cross-spectral matrix, one block of frequencies at a time.
+        yields (slice into f, factors of shape (nb, nz, nz))"""
+
+        r = np.abs(self.z[:, np.newaxis] - self.z[np.newaxis, :])
+        eye = 1e-10*np.eye(len(self.z))  # keep positive definite when nodes coincide
+        nb = self._blockSize(len(f))
+
+        for i in range(0, len(f), nb):
+            fb = f[i:i+nb, np.newaxis, np.newaxis]
+
+            # coherence (nb x nz x nz)
+            coh = np.exp(-self.coh_decay*np.sqrt((fb*r/self.Uref)**2 + (0.12*r/self.Lc)**2))
+            coh += eye
+
+            H = np.linalg.cholesky(coh)
+            H *= np.sqrt(S[i:i+nb])[:, np.newaxis, np.newaxis]
+
+            yield slice(i, i+nb), H
+
+
+    def timeseries(self):
+        """generator over the wind speed field, one segment at a time
+
+        Returns
+        -------
+        t : ndarray(float) (s)
+            times in this chunk, shape (nt,)
+        U : ndarray(float) (m/s)
+            wind speed (mean plus turbulence), shape (nt, nz).  zero at and below z0.
+
+        """
+
+        self._checkSegments()
+
+        N = self.segment
+        nover = self.overlap
+        nz = len(self.z)
+        nt = int(round(self.duration/self.dt))
+        rand = np.random.RandomState(self.seed)
+
+        Umean = self._meanProfile()[0]
+        active = Umean > 0
+
+        f, S = self._spectrum()
+        df = 1.0/(N*self.dt)
+        amp = N/2.0*np.sqrt(2.0*df)  # numpy irfft normalization
+
+        # the factors are kept between segments only if all of them fit in the budget
+        if self._blockSize(len(f)) == len(f):
+            blocks = list(self._factorBlocks(f, S))
+        else:
+            blocks = None
+
+        # power-complementary crossfade (independent segments keep their variance)
+        ramp = np.linspace(0.0, 0.5*math.pi, nover + 2)[1:-1, np.newaxis]
+        fade_out = np.cos(ramp)
+        fade_in = np.sin(ramp)
+
+        tail = None
+        start = 0
+        while start < nt:
+
+            # one segment of the turbulent field (N x nz)
+            phase = np.exp(2j*math.pi*rand.uniform(size=(len(f), nz)))
+            X = np.zeros((N//2 + 1, nz), dtype=complex)
+            for idx, H in (blocks or self._factorBlocks(f, S)):
+                X[1:N//2][idx] = amp*np.einsum('fij,fj->fi', H, phase[idx])
+            u = np.fft.irfft(X, n=N, axis=0)
+
+            if tail is None:
+                chunk = u[:N-nover]
+            else:
+                chunk = np.vstack([fade_out*tail + fade_in*u[:nover], u[nover:N-nover]])
+            tail = u[N-nover:]
+
+            chunk = chunk[:nt-start]
+            t = self.dt*np.arange(start, start + len(chunk))
+            start += len(chunk)
+
+            yield t, np.where(active, Umean + chunk, 0.0)
 
 
 
@@ -253,34 +796,42 @@ class LinearWaves(WaveBase):
 
     def execute(self):
 
-        # water depth
-        d = self.z_surface - self.z_floor
+        # wave number (kept for the derivatives)
+        self.k = wavenumber(self.T, self.z_surface - self.z_floor, self.g)
 
-        # design wave height
-        h = self.hmax
+        # maximum velocity and acceleration (last column is z=MSL)
+        U, A = linearWavesCases(self.hmax, self.T, np.append(self.z, self.z_surface),
+            self.z_surface, self.z_floor, self.Uc, self.g, self.k)
+        self.U = U[0, :-1]
+        self.U0 = U[0, -1]
+        self.A = A[0, :-1]
+        self.A0 = A[0, -1]
 
-        # circular frequency
-        omega = 2.0*math.pi/self.T
+        # angles
+        self.beta = self.betaWave*np.ones_like(self.z)
+        self.beta0 =self.betaWave
 
-        # compute wave number from dispersion relationship
-        k = brentq(lambda k: omega**2 - self.g*k*math.tanh(d*k), 0, 10*omega**2/self.g)
+        # only the scalars needed for the derivatives are kept here, the (dense)
+        # Jacobian is assembled in provideJ when it is actually requested
+        self.h = self.hmax
+        self.omega = 2.0*math.pi/self.T
 
-        # zero at surface
-        z_rel = self.z - self.z_surface
 
-        # maximum velocity
-        self.U = h/2.0*omega*np.cosh(k*(z_rel + d))/math.sinh(k*d) + self.Uc
-        self.U0 = h/2.0*omega*np.cosh(k*(0. + d))/math.sinh(k*d) + self.Uc
+    def list_deriv_vars(self):
 
-        # check heights
-        self.U[np.logical_or(self.z < self.z_floor, self.z > self.z_surface)] = 0.
+        inputs = ('z', 'Uc')
+        outputs = ('U', 'A', 'U0', 'A0')
 
-        # acceleration
-        self.A  = self.U * omega
-        self.A0 = self.U0 * omega
-        # angles
-        self.beta = self.betaWave*np.ones_like(self.z)
-        self.beta0 =self.betaWave
+        return inputs, outputs
+
+
+    def provideJ(self):
+
+        h = self.h
+        omega = self.omega
+        k = self.k
+        d = self.z_surface - self.z_floor
+        z_rel = self.z - self.z_surface
 
         # derivatives
         dU_dz = h/2.0*omega*np.sinh(k*(z_rel + d))/math.sinh(k*d)*k
@@ -295,20 +846,128 @@ class LinearWaves(WaveBase):
         dU0[-1] = 1.0
         dA0 = omega * dU0
 
-        self.J = vstack([hstack([np.diag(dU_dz), dU_dUc]), hstack([np.diag(dA_dz), dA_dUc]), np.transpose(dU0), np.transpose(dA0)])
+        J = vstack([hstack([np.diag(dU_dz), dU_dUc]), hstack([np.diag(dA_dz), dA_dUc]), np.transpose(dU0), np.transpose(dA0)])
 
+        return J
 
-    def list_deriv_vars(self):
 
-        inputs = ('z', 'Uc')
-        outputs = ('U', 'A', 'U0', 'A0')
 
-        return inputs, outputs
+class IrregularWaves(WaveBase):
+    """irregular sea from a JONSWAP (gamma=1: Pierson-Moskowitz) spectrum.
+    Linear superposition of nfreq regular Airy components with random phases.
+    The outputs U and A are the maximum velocity and acceleration magnitudes
+    seen over the simulated record (the irregular counterpart of LinearWaves).
+    The full kinematics are available chunk by chunk through timeseries()."""
 
+    # variables
+    Uc = Float(iotype='in', units='m/s', desc='mean current speed')
+
+    # parameters
+    Hs = Float(iotype='in', units='m', desc='significant wave height')
+    Tp = Float(iotype='in', units='s', desc='peak spectral period')
+    gamma = Float(3.3, iotype='in', desc='JONSWAP peak enhancement factor (1.0 for Pierson-Moskowitz)')
+    g = Float(9.81, iotype='in', units='m/s**2', desc='acceleration of gravity')
+    betaWave = Float(0.0, iotype='in', units='deg', desc='wave angle relative to inertial coordinate system')
+    nfreq = Int(200, iotype='in', desc='number of frequency components')
+    omega_min = Float(0.25, iotype='in', desc='lowest frequency component as a fraction of the peak frequency')
+    omega_max = Float(5.0, iotype='in', desc='highest frequency component as a fraction of the peak frequency')
+    duration = Float(3600.0, iotype='in', units='s', desc='length of the simulated record')
+    dt = Float(0.25, iotype='in', units='s', desc='time step of the simulated record')
+    chunk_size = Int(2000, iotype='in', desc='number of time steps evaluated at once (bounds memory use)')
+    seed = Int(0, iotype='in', desc='seed for the random component phases')
+
+    missing_deriv_policy = 'assume_zero'
+
+
+    def _components(self):
+        """frequencies, phases, and velocity/acceleration amplitudes at each z"""
+
+        d = self.z_surface - self.z_floor
+        wp = 2.0*math.pi/self.Tp
+
+        # frequency discretization (midpoints)
+        domega = (self.omega_max - self.omega_min)*wp/self.nfreq
+        omega = self.omega_min*wp + domega*(np.arange(self.nfreq) + 0.5)
+
+        # component amplitudes and random phases
+        a = np.sqrt(2.0*jonswap(omega, self.Hs, self.Tp, self.gamma)*domega)
+        phase = np.random.RandomState(self.seed).uniform(0.0, 2*math.pi, self.nfreq)
+
+        # depth attenuation (nfreq x nz+1), zero outside of the water column
+        k = wavenumber(2.0*math.pi/omega, d, self.g)
+        z = np.append(self.z, self.z_surface)  # last column is z=MSL
+        z_rel = np.minimum(z - self.z_surface, 0.0)
+        transfer = _airyTransfer(k, z_rel, d)
+        transfer[:, np.logical_or(z < self.z_floor, z > self.z_surface)] = 0.0
+
+        Bu = (a*omega)[:, np.newaxis]*transfer
+        Ba = -(a*omega**2)[:, np.newaxis]*transfer
+
+        return omega, phase, Bu, Ba
+
+
+    def _kinematics(self, chunk_size):
+        """velocity and acceleration at z and (last column) z=MSL, one time chunk at a time"""
+
+        omega, phase, Bu, Ba = self._components()
+
+        z = np.append(self.z, self.z_surface)
+        current = self.Uc*np.ones_like(z)
+        current[np.logical_or(z < self.z_floor, z > self.z_surface)] = 0.0
+
+        nt = int(round(self.duration/self.dt))
+        for start in range(0, nt, chunk_size):
+            t = self.dt*np.arange(start, min(start + chunk_size, nt))
+            theta = np.outer(t, omega) + phase
+            yield t, np.cos(theta).dot(Bu) + current, np.sin(theta).dot(Ba)
+
+
+    def timeseries(self, chunk_size=None):
+        """generator over the wave kinematics, one time chunk at a time,
+        so long records never have to be held in memory at once
+
+        Parameters
+        ----------
+        chunk_size : int
+            number of time steps per chunk (defaults to self.chunk_size)
+
+        Returns
+        -------
+        t : ndarray(float) (s)
+            times in this chunk, shape (nt,)
+        U : ndarray(float) (m/s)
+            horizontal velocity (including current), shape (nt, nz)
+        A : ndarray(float) (m/s**2)
+            horizontal acceleration, shape (nt, nz)
+
+        """
+
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+
+        for t, U, A in self._kinematics(chunk_size):
+            yield t, U[:, :-1], A[:, :-1]
+
+
+    def execute(self):
+
+        # streaming maxima over the record
+        Umax = np.zeros(len(self.z) + 1)
+        Amax = np.zeros(len(self.z) + 1)
+        for t, U, A in self._kinematics(self.chunk_size):
+            Umax = np.maximum(Umax, np.abs(U).max(axis=0))
+            Amax = np.maximum(Amax, np.abs(A).max(axis=0))
+
+        self.U = Umax[:-1]
+        self.A = Amax[:-1]
+        self.U0 = Umax[-1]
+        self.A0 = Amax[-1]
+
+        # angles
+        self.beta = self.betaWave*np.ones_like(self.z)
+        self.beta0 = self.betaWave
 
-    def provideJ(self):
 
-        return self.J
 
 class TowerSoilK(SoilBase):
     """Passthrough of Soil-Structure-INteraction equivalent spring constants used to bypass TowerSoil."""
@@ -345,28 +1004,7 @@ class TowerSoil(SoilBase):
 
     def execute(self):
 
-        G = self.G
-        nu = self.nu
-        h = self.depth
-        r0 = self.r0
-
-        # vertical
-        eta = 1.0 + 0.6*(1.0-nu)*h/r0
-        k_z = 4*G*r0*eta/(1.0-nu)
-
-        # horizontal
-        eta = 1.0 + 0.55*(2.0-nu)*h/r0
-        k_x = 32.0*(1.0-nu)*G*r0*eta/(7.0-8.0*nu)
-
-        # rocking
-        eta = 1.0 + 1.2*(1.0-nu)*h/r0 + 0.2*(2.0-nu)*(h/r0)**3
-        k_thetax = 8.0*G*r0**3*eta/(3.0*(1.0-nu))
-
-        # torsional
-        k_phi = 16.0*G*r0**3/3.0
-
-        self.k = np.array([k_x, k_thetax, k_x, k_thetax, k_z, k_phi])
-        self.k[self.rigid] = float('inf')
+        self.k = soilStiffness(self.r0, self.depth, self.G, self.nu, self.rigid)[0][0]
 
 
     def list_deriv_vars(self):
@@ -379,45 +1017,7 @@ class TowerSoil(SoilBase):
 
     def provideJ(self):
 
-        G = self.G
-        nu = self.nu
-        h = self.depth
-        r0 = self.r0
-
-        # vertical
-        eta = 1.0 + 0.6*(1.0-nu)*h/r0
-        deta_dr0 = -0.6*(1.0-nu)*h/r0**2
-        dkz_dr0 = 4*G/(1.0-nu)*(eta + r0*deta_dr0)
-
-        deta_dh = 0.6*(1.0-nu)/r0
-        dkz_dh = 4*G*r0/(1.0-nu)*deta_dh
-
-        # horizontal
-        eta = 1.0 + 0.55*(2.0-nu)*h/r0
-        deta_dr0 = -0.55*(2.0-nu)*h/r0**2
-        dkx_dr0 = 32.0*(1.0-nu)*G/(7.0-8.0*nu)*(eta + r0*deta_dr0)
-
-        deta_dh = 0.55*(2.0-nu)/r0
-        dkx_dh = 32.0*(1.0-nu)*G*r0/(7.0-8.0*nu)*deta_dh
-
-        # rocking
-        eta = 1.0 + 1.2*(1.0-nu)*h/r0 + 0.2*(2.0-nu)*(h/r0)**3
-        deta_dr0 = -1.2*(1.0-nu)*h/r0**2 - 3*0.2*(2.0-nu)*(h/r0)**3/r0
-        dkthetax_dr0 = 8.0*G/(3.0*(1.0-nu))*(3*r0**2*eta + r0**3*deta_dr0)
-
-        deta_dh = 1.2*(1.0-nu)/r0 + 3*0.2*(2.0-nu)*(1.0/r0)**3*h**2
-        dkthetax_dh = 8.0*G*r0**3/(3.0*(1.0-nu))*deta_dh
-
-        # torsional
-        dkphi_dr0 = 16.0*G*3*r0**2/3.0
-        dkphi_dh = 0.0
-
-        dk_dr0 = np.array([dkx_dr0, dkthetax_dr0, dkx_dr0, dkthetax_dr0, dkz_dr0, dkphi_dr0])
-        dk_dr0[self.rigid] = 0.0
-        dk_dh = np.array([dkx_dh, dkthetax_dh, dkx_dh, dkthetax_dh, dkz_dh, dkphi_dh])
-        dk_dh[self.rigid] = 0.0
-
-        J = hstack((dk_dr0, dk_dh))
+        J = soilStiffness(self.r0, self.depth, self.G, self.nu, self.rigid)[1][0]  # columns: dk_dr0, dk_dh
 
         return J
 
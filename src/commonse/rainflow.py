@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+rainflow.py
+
+Copyright (c) NREL. All rights reserved.
+"""
+
+#-------------------------------------------------------------------------------
+# Name:        rainflow.py
+# Purpose:     Rainflow cycle counting and damage equivalent loads (DEL) for load
+#              time series, e.g., tower section bending moments, producing the
+#              M_DEL/N_DEL inputs of UtilizationSupplement.fatigue.
+#-------------------------------------------------------------------------------
+
+import numpy as np
+
+
+def turning_points(x):
+    """reversals of a load history (plateaus are collapsed).  The first and last
+    samples are always kept.
+
+    Parameters
+    ----------
+    x : array_like(float)
+        load history
+
+    Returns
+    -------
+    tp : ndarray(float)
+        the turning points of x
+
+    """
+
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+    if n < 3:
+        return x.copy()
+
+    d = np.diff(x)
+    steps = np.flatnonzero(d)  # non-flat steps
+    if len(steps) == 0:
+        return x[:1].copy()
+
+    sign = np.sign(d[steps])
+    reversals = steps[1:][sign[1:] != sign[:-1]]  # start of a step that changes direction
+
+    return x[np.concatenate([[0], reversals, [n-1]])]
+
+
+def _four_point(tp):
+    """extract closed cycles from a sequence of turning points with the four-point rule.
+    All non-overlapping inner ranges that are no larger than both neighbors are removed
+    in one vectorized pass, repeated until none remain.
+
+    Returns
+    -------
+    ranges : ndarray(float)
+        ranges of the closed (full) cycles
+    residue : ndarray(float)
+        turning points that did not close
+
+    """
+
+    ranges = []
+
+    while len(tp) >= 4:
+
+        r = np.abs(np.diff(tp))
+        inner = r[1:-1]
+        cand = np.logical_and(inner <= r[:-2], inner <= r[2:])
+
+        # neighboring candidates share a point, keep the first of each run
+        cand[1:] = np.logical_and(cand[1:], np.logical_not(cand[:-1]))
+        idx = np.flatnonzero(cand) + 1  # index of the first point of each closed cycle
+
+        if len(idx) == 0:
+            break
+
+        ranges.append(r[idx])
+
+        keep = np.ones(len(tp), dtype=bool)
+        keep[idx] = False
+        keep[idx+1] = False
+        tp = tp[keep]
+
+    if len(ranges) > 0:
+        ranges = np.concatenate(ranges)
+    else:
+        ranges = np.zeros(0)
+
+    return ranges, tp
+
+
+def rainflow(x):
+    """rainflow counting of a complete load history.  The residue is counted as half cycles.
+
+    Parameters
+    ----------
+    x : array_like(float)
+        load history
+
+    Returns
+    -------
+    ranges : ndarray(float)
+        cycle ranges
+    counts : ndarray(float)
+        number of cycles for each range (1.0 for full cycles, 0.5 for half cycles)
+
+    """
+
+    full, residue = _four_point(turning_points(x))
+    half = np.abs(np.diff(residue))
+
+    ranges = np.concatenate([full, half])
+    counts = np.concatenate([np.ones(len(full)), 0.5*np.ones(len(half))])
+
+    return ranges, counts
+
+
+class RainflowCounter(object):
+    """Streaming rainflow counter for several load channels (e.g., tower sections).
+    Time series can be fed chunk by chunk; only the unclosed residue of each channel
+    and the running sums of n*S**m for each S-N slope are stored, so memory does not
+    depend on the length of the record.
+
+    Parameters
+    ----------
+    nsections : int
+        number of load channels
+    m : array_like(float)
+        S-N curve slopes for which damage equivalent loads are wanted
+    bins : array_like(float)
+        optional range bin edges.  if given, a (nsections, nbins) histogram of cycle
+        counts is also kept (ranges above the last edge go in the last bin), which
+        can be passed to UtilizationSupplement.fatigueHistogram
+
+    """
+
+    def __init__(self, nsections, m=(3.0, 4.0, 5.0), bins=None):
+
+        self.nsections = nsections
+        self.m = np.atleast_1d(np.asarray(m, dtype=float))
+        self.damage_sum = np.zeros((nsections, len(self.m)))  # sum of n*S**m
+        self.ncycles = np.zeros(nsections)
+        self._residue = [np.zeros(0) for i in range(nsections)]
+
+        if bins is not None:
+            self.bins = np.asarray(bins, dtype=float)
+            self.histogram = np.zeros((nsections, len(self.bins)-1))
+        else:
+            self.bins = None
+            self.histogram = None
+
+
+    def _add(self, i, ranges, counts):
+
+        self.damage_sum[i] += np.dot(counts, ranges[:, np.newaxis]**self.m)
+        self.ncycles[i] += np.sum(counts)
+
+        if self.bins is not None:
+            nbins = len(self.bins) - 1
+            idx = np.clip(np.searchsorted(self.bins, ranges, side='right') - 1, 0, nbins-1)
+            self.histogram[i] += np.bincount(idx, weights=counts, minlength=nbins)
+
+
+    def update(self, chunk):
+        """count the closed cycles in the next chunk of the load history
+
+        Parameters
+        ----------
+        chunk : array_like(float)
+            loads, shape (nt, nsections)
+
+        """
+
+        chunk = np.asarray(chunk, dtype=float).reshape(-1, self.nsections)
+
+        for i in range(self.nsections):
+            # the last point of the residue is the provisional end of the previous
+            # chunk, so turning points are recomputed across the boundary
+            tp = turning_points(np.concatenate([self._residue[i], chunk[:, i]]))
+            full, self._residue[i] = _four_point(tp)
+            self._add(i, full, np.ones(len(full)))
+
+
+    def finalize(self):
+        """count the remaining residue of each channel as half cycles.
+        Call once after the last chunk."""
+
+        for i in range(self.nsections):
+            half = np.abs(np.diff(self._residue[i]))
+            self._add(i, half, 0.5*np.ones(len(half)))
+            self._residue[i] = np.zeros(0)
+
+
+    def damage_equivalent_loads(self, N_eq, scale=1.0, out=None):
+        """damage equivalent load ranges for every channel and slope,
+        DEL = (sum(n*S**m)*scale/N_eq)**(1/m)
+
+        Parameters
+        ----------
+        N_eq : float
+            number of equivalent cycles
+        scale : float
+            multiplier on the counted cycles, e.g., lifetime / simulated time
+        out : ndarray(float)
+            optional (nsections, nslopes) array to write into
+
+        Returns
+        -------
+        DEL : ndarray(float)
+            damage equivalent ranges, shape (nsections, nslopes)
+
+        """
+
+        if out is None:
+            out = np.empty((self.nsections, len(self.m)))
+
+        out[:] = (self.damage_sum*scale/N_eq)**(1.0/self.m)
+
+        return out
+
+
+    def fatigue_inputs(self, m, N_eq, scale=1.0, M_DEL=None, N_DEL=None):
+        """write the M_DEL and N_DEL arrays consumed by UtilizationSupplement.fatigue
+        for one of the slopes (the loads fed to the counter must then be moments)
+
+        Parameters
+        ----------
+        m : float
+            S-N slope, must be one of the slopes given to the counter
+        N_eq : float
+            number of equivalent cycles
+        scale : float
+            multiplier on the counted cycles, e.g., lifetime / simulated time
+        M_DEL, N_DEL : ndarray(float)
+            optional (nsections,) arrays to write into
+
+        Returns
+        -------
+        M_DEL : ndarray(float)
+            damage equivalent moment at each section
+        N_DEL : ndarray(float)
+            corresponding number of cycles
+
+        """
+
+        k = np.flatnonzero(self.m == m)
+        if len(k) == 0:
+            raise ValueError('slope m={} was not counted, available slopes are {}'.format(m, self.m))
+
+        if M_DEL is None:
+            M_DEL = np.empty(self.nsections)
+        if N_DEL is None:
+            N_DEL = np.empty(self.nsections)
+
+        M_DEL[:] = (self.damage_sum[:, k[0]]*scale/N_eq)**(1.0/m)
+        N_DEL[:] = N_eq
+
+        return M_DEL, N_DEL
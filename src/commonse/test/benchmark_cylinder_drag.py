@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+benchmark_cylinder_drag.py
+
+Compares the tabulated cylinderDrag against the akima reference path
+(test_wind_wave_drag.cylinderDragAkima).  Run from this directory.
+"""
+
+import timeit
+import numpy as np
+from commonse.WindWaveDrag import cylinderDrag
+from test_wind_wave_drag import cylinderDragAkima
+
+
+if __name__ == '__main__':
+
+    for n in (10, 100, 1000, 10000):
+
+        Re = np.logspace(0, 8, n)
+        Re[0] = 0.0  # zero velocity nodes
+
+        cd, dcd = cylinderDrag(Re)
+        cd_ref, dcd_ref = cylinderDragAkima(Re)
+        err_cd = np.max(np.abs(cd - cd_ref))
+        err_dcd = np.max(np.abs(dcd - dcd_ref)/np.maximum(np.abs(dcd_ref), 1e-300))
+
+        repeat = max(10, 100000 // n)
+        t_table = min(timeit.repeat(lambda: cylinderDrag(Re), number=repeat, repeat=3))/repeat
+        t_akima = min(timeit.repeat(lambda: cylinderDragAkima(Re), number=repeat, repeat=3))/repeat
+
+        print 'n = {:6d}  table: {:.3e} s  akima: {:.3e} s  speedup: {:5.1f}  ' \
+            'max |dcd| = {:.1e}  max rel dcd/dRe = {:.1e}'.format(
+                n, t_table, t_akima, t_akima/t_table, err_cd, err_dcd)
@@ -11,7 +11,8 @@ Copyright (c) NREL. All rights reserved.
 import unittest
 import numpy as np
 from commonse.utilities import check_gradient
-from commonse.environment import PowerWind, LogWind, LinearWaves, TowerSoil
+from commonse.environment import PowerWind, LogWind, TurbulentWind, LinearWaves, IrregularWaves, TowerSoil, powerWindCases, logWindCases, \
+    wavenumber, soilStiffness, kaimal, _wavenumber_cache
 
 
 class TestPowerWind(unittest.TestCase):
@@ -89,6 +90,69 @@ class TestPowerWind(unittest.TestCase):
                 raise e
 
 
+    def test_cases(self):
+
+        Uref = np.array([5.0, 10.0, 25.0])
+        shearExp = np.array([0.1, 0.2, 0.14])
+        zref = 100.0
+        z0 = 0.0
+        z = np.linspace(-10.0, 110.0, 20)
+
+        U, beta, dU_dUref, dU_dz, dU_dzref = powerWindCases(Uref, zref, z, z0, shearExp, 5.0)
+
+        for i in range(len(Uref)):
+
+            # baseline closed form, zero at and below z0
+            idx = z > z0
+            Ui = np.zeros_like(z)
+            Ui[idx] = Uref[i]*((z[idx] - z0)/(zref - z0))**shearExp[i]
+            dUi_dUref = np.zeros_like(z)
+            dUi_dUref[idx] = ((z[idx] - z0)/(zref - z0))**shearExp[i]
+            dUi_dz = np.zeros_like(z)
+            dUi_dz[idx] = Ui[idx]*shearExp[i]/(z[idx] - z0)
+            dUi_dzref = np.zeros_like(z)
+            dUi_dzref[idx] = -Ui[idx]*shearExp[i]/(zref - z0)
+
+            np.testing.assert_allclose(U[i], Ui, rtol=1e-14)
+            np.testing.assert_array_equal(U[i][np.logical_not(idx)], 0.0)
+            np.testing.assert_array_equal(beta[i], 5.0)
+            np.testing.assert_allclose(dU_dUref[i], dUi_dUref, rtol=1e-14)
+            np.testing.assert_allclose(dU_dz[i], dUi_dz, rtol=1e-14)
+            np.testing.assert_allclose(dU_dzref[i], dUi_dzref, rtol=1e-14)
+
+            pw = PowerWind()
+            pw.Uref = Uref[i]
+            pw.zref = zref
+            pw.z0 = z0
+            pw.z = z
+            pw.shearExp = shearExp[i]
+            pw.betaWind = 5.0
+            pw.run()
+            J = pw.provideJ()
+
+            np.testing.assert_allclose(pw.U, Ui, rtol=1e-14)
+            np.testing.assert_allclose(J[:, 0], dUi_dUref, rtol=1e-14)
+            np.testing.assert_allclose(J[:, 1:-1], np.diag(dUi_dz), rtol=1e-14)
+            np.testing.assert_allclose(J[:, -1], dUi_dzref, rtol=1e-14)
+
+
+    def test_sparse(self):
+
+        pw = PowerWind()
+        pw.Uref = 10.0
+        pw.zref = 100.0
+        pw.z0 = 0.0
+        pw.z = np.linspace(-10.0, 110.0, 20)
+        pw.run()
+
+        J = pw.provideJ()
+        pw.sparse_jacobian = True
+        Jsparse = pw.provideJ()
+
+        self.assertEqual(Jsparse.shape, J.shape)
+        np.testing.assert_array_equal(Jsparse.toarray(), J)
+
+
 class TestLogWind(unittest.TestCase):
 
 
@@ -138,6 +202,179 @@ class TestLogWind(unittest.TestCase):
 
 
 
+    def test_cases(self):
+
+        Uref = np.array([8.0, 12.0])
+        z_roughness = np.array([10.0, 0.2])  # mm
+        zref = 100.0
+        z0 = 5.0
+        z = np.concatenate([[4.9, 5.0, 5.005], np.linspace(6.0, 100.0, 17)])
+
+        U, beta, dU_dUref, dU_dz, dU_dzref = logWindCases(Uref, zref, z, z0, z_roughness, 5.0)
+
+        for i in range(len(Uref)):
+
+            # baseline closed form, zero within the roughness length of z0
+            zr = z_roughness[i]/1e3
+            idx = z - z0 > zr
+            lb = np.log((zref - z0)/zr)
+            Ui = np.zeros_like(z)
+            Ui[idx] = Uref[i]*np.log((z[idx] - z0)/zr)/lb
+            dUi_dUref = np.zeros_like(z)
+            dUi_dUref[idx] = np.log((z[idx] - z0)/zr)/lb
+            dUi_dz = np.zeros_like(z)
+            dUi_dz[idx] = Uref[i]/lb/(z[idx] - z0)
+            dUi_dzref = np.zeros_like(z)
+            dUi_dzref[idx] = -Uref[i]*np.log((z[idx] - z0)/zr)/lb**2/(zref - z0)
+
+            np.testing.assert_allclose(U[i], Ui, rtol=1e-14)
+            np.testing.assert_array_equal(U[i][np.logical_not(idx)], 0.0)
+            np.testing.assert_array_equal(beta[i], 5.0)
+            np.testing.assert_allclose(dU_dUref[i], dUi_dUref, rtol=1e-14)
+            np.testing.assert_allclose(dU_dz[i], dUi_dz, rtol=1e-14)
+            np.testing.assert_allclose(dU_dzref[i], dUi_dzref, rtol=1e-14)
+
+            lw = LogWind()
+            lw.Uref = Uref[i]
+            lw.zref = zref
+            lw.z0 = z0
+            lw.z = z
+            lw.z_roughness = z_roughness[i]
+            lw.betaWind = 5.0
+            lw.run()
+            J = lw.provideJ()
+
+            np.testing.assert_allclose(lw.U, Ui, rtol=1e-14)
+            np.testing.assert_allclose(J[:, 0], dUi_dUref, rtol=1e-14)
+            np.testing.assert_allclose(J[:, 1:-1], np.diag(dUi_dz), rtol=1e-14)
+            np.testing.assert_allclose(J[:, -1], dUi_dzref, rtol=1e-14)
+
+
+    def test_sparse(self):
+
+        lw = LogWind()
+        lw.Uref = 10.0
+        lw.zref = 100.0
+        lw.z0 = 0.0
+        lw.z = np.linspace(-10.0, 110.0, 20)
+        lw.run()
+
+        J = lw.provideJ()
+        lw.sparse_jacobian = True
+        Jsparse = lw.provideJ()
+
+        self.assertEqual(Jsparse.shape, J.shape)
+        np.testing.assert_array_equal(Jsparse.toarray(), J)
+
+
+
+class TestTurbulentWind(unittest.TestCase):
+
+
+    def test_streaming(self):
+
+        tw = TurbulentWind()
+        tw.Uref = 12.0
+        tw.zref = 90.0
+        tw.z0 = 0.0
+        tw.z = np.array([0.0, 30.0, 60.0, 90.0])
+        tw.duration = 900.0
+        tw.dt = 0.2
+        tw.segment = 1024
+        tw.overlap = 64
+        tw.run()
+
+        nt = 0
+        for t, U in tw.timeseries():
+            self.assertEqual(U.shape, (len(t), 4))
+            self.assertTrue(len(t) <= tw.segment)
+            np.testing.assert_allclose(t, 0.2*np.arange(nt, nt + len(t)))
+            np.testing.assert_array_equal(U[:, 0], 0.0)  # at z0
+            nt += len(t)
+
+        self.assertEqual(nt, 4500)
+        np.testing.assert_allclose(tw.U[-1], 12.0)
+
+
+    def test_statistics(self):
+
+        # 3 h at the hub and 5 m below it
+        tw = TurbulentWind()
+        tw.Uref = 12.0
+        tw.zref = 90.0
+        tw.z0 = 0.0
+        tw.z = np.array([85.0, 90.0])
+        tw.TI = 0.14
+        tw.duration = 10800.0
+        tw.dt = 0.1
+        tw.run()
+
+        U = np.vstack([Ui for t, Ui in tw.timeseries()])
+        u = U - U.mean(axis=0)
+
+        np.testing.assert_allclose(np.mean(U, axis=0), tw.U, rtol=0.01)
+        np.testing.assert_allclose(np.std(u[:, 1]), tw.TI*tw.Uref, rtol=0.05)
+
+        # correlation is the spectrum-weighted IEC coherence at 5 m separation
+        f = np.arange(1, tw.segment//2)/(tw.segment*tw.dt)
+        S = kaimal(f, tw.Uref, tw.TI*tw.Uref, tw.L)
+        coh = np.exp(-tw.coh_decay*np.sqrt((f*5.0/tw.Uref)**2 + (0.12*5.0/tw.Lc)**2))
+        rho = np.corrcoef(u[:, 0], u[:, 1])[0, 1]
+
+        self.assertLess(rho, 1.0)
+        self.assertAlmostEqual(rho, np.sum(S*coh)/np.sum(S), delta=0.03)
+
+
+    def test_overlap(self):
+
+        tw = TurbulentWind()
+        tw.Uref = 12.0
+        tw.zref = 90.0
+        tw.z = np.array([30.0, 90.0])
+        tw.segment = 256
+        tw.overlap = 128
+
+        self.assertRaises(ValueError, tw.execute)
+        self.assertRaises(ValueError, next, tw.timeseries())
+
+        tw.overlap = 127
+        tw.execute()
+
+
+    def test_memory_budget(self):
+
+        def field(nz, budget):
+            tw = TurbulentWind()
+            tw.Uref = 12.0
+            tw.zref = 90.0
+            tw.z0 = 0.0
+            tw.z = np.linspace(0.0, 120.0, nz)
+            tw.duration = 120.0
+            tw.dt = 0.2
+            tw.segment = 256
+            tw.overlap = 16
+            tw.memory_budget = budget
+            tw.run()
+            return tw
+
+        # the factors never exceed the budget as the number of nodes grows
+        for nz in (10, 40, 160):
+            tw = field(nz, 1.0)
+            f, S = tw._spectrum()
+            nf = 0
+            for idx, H in tw._factorBlocks(f, S):
+                self.assertEqual(H.shape[1:], (nz, nz))
+                self.assertLessEqual(2*H.nbytes, 1e6)
+                nf += len(H)
+            self.assertEqual(nf, len(f))
+
+        # and the field does not depend on the blocking
+        U1 = np.vstack([U for t, U in field(40, 64.0).timeseries()])
+        U2 = np.vstack([U for t, U in field(40, 0.05).timeseries()])
+        np.testing.assert_array_equal(U1, U2)
+
+
+
 class TestLinearWave(unittest.TestCase):
 
 
@@ -191,6 +428,74 @@ class TestLinearWave(unittest.TestCase):
 
 
 
+    def test_wavenumber(self):
+
+        T = np.linspace(1.0, 20.0, 50)
+        d = np.array([2.0, 20.0, 200.0])[:, np.newaxis]
+        g = 9.81
+
+        k = wavenumber(T, d, g)
+        omega = 2*np.pi/T
+
+        self.assertEqual(k.shape, (3, 50))
+        np.testing.assert_allclose(g*k*np.tanh(k*d), np.tile(omega**2, (3, 1)), rtol=1e-13)
+        self.assertAlmostEqual(wavenumber(T[10], d[1, 0], g), k[1, 10], places=14)
+        np.testing.assert_array_equal(wavenumber(T, d, g), k)  # cached
+        np.testing.assert_allclose(wavenumber(T, d, g, cache=False), k, rtol=1e-14)
+
+
+    def test_wavenumber_overlap(self):
+
+        _wavenumber_cache.clear()
+        T1 = np.linspace(2.0, 10.0, 9)
+        T2 = np.linspace(6.0, 14.0, 9)  # shares 5 periods with T1
+
+        k1 = wavenumber(T1, 30.0)
+        self.assertEqual((_wavenumber_cache.hits, _wavenumber_cache.misses), (0, 9))
+
+        k2 = wavenumber(T2, 30.0)
+        self.assertEqual((_wavenumber_cache.hits, _wavenumber_cache.misses), (5, 13))
+
+        np.testing.assert_array_equal(k2[:5], k1[4:])
+        self.assertEqual(wavenumber(T2[0], 30.0), k2[0])  # scalar path shares the entries
+        np.testing.assert_allclose(k2, wavenumber(T2, 30.0, cache=False), rtol=1e-14)
+
+
+
+class TestIrregularWaves(unittest.TestCase):
+
+
+    def test_streaming(self):
+
+        iw = IrregularWaves()
+        iw.Uc = 0.5
+        iw.z_surface = 20.0
+        iw.z_floor = 0.0
+        iw.Hs = 4.0
+        iw.Tp = 9.0
+        iw.z = np.linspace(-5.0, 25.0, 13)
+        iw.duration = 600.0
+        iw.dt = 0.5
+        iw.chunk_size = 128
+        iw.run()
+
+        Umax = np.zeros(13)
+        Amax = np.zeros(13)
+        nt = 0
+        for t, U, A in iw.timeseries(chunk_size=200):
+            self.assertEqual(U.shape, (len(t), 13))
+            Umax = np.maximum(Umax, np.abs(U).max(axis=0))
+            Amax = np.maximum(Amax, np.abs(A).max(axis=0))
+            nt += len(t)
+
+        self.assertEqual(nt, 1200)
+        np.testing.assert_allclose(Umax, iw.U, rtol=1e-12)
+        np.testing.assert_allclose(Amax, iw.A, rtol=1e-12)
+        self.assertEqual(iw.U[0], 0.0)  # below sea floor
+        self.assertEqual(iw.U[-1], 0.0)  # above surface
+
+
+
 class TestSoil(unittest.TestCase):
 
 
@@ -216,5 +521,57 @@ class TestSoil(unittest.TestCase):
 
 
 
+    def test_vectorized(self):
+
+        # r0 = 2, depth = 4, G = 1e6, nu = 0.5 (h/r0 = 2) and a surface foundation
+        # r0 = 1, depth = 0, G = 2e6, nu = 0.25 (all embedment factors are 1)
+        r0 = np.array([2.0, 1.0, 2.0])
+        depth = np.array([4.0, 0.0, 4.0])
+        G = np.array([1e6, 2e6, 1e6])
+        nu = np.array([0.5, 0.25, 0.5])
+        rigid = np.array([[False]*6, [False]*6, [True, False, False, False, True, False]])
+
+        k, dk = soilStiffness(r0, depth, G, nu, rigid)
+
+        self.assertEqual(k.shape, (3, 6))
+        self.assertEqual(dk.shape, (3, 6, 2))
+
+        # k_x = 32(1-nu)G(r0 + 0.55(2-nu)h)/(7-8nu), k_z = 4G(r0 + 0.6(1-nu)h)/(1-nu),
+        # k_thetax = 8G(r0**3 + 1.2(1-nu)h r0**2 + 0.2(2-nu)h**3)/(3(1-nu)), k_phi = 16G r0**3/3
+        k_x = [32.0/3*2.65e6, 4.8*2e6]
+        k_thetax = [16.0/3*36.8e6, 32.0/9*2e6]
+        k_z = [25.6e6, 16.0/3*2e6]
+        k_phi = [128.0/3*1e6, 16.0/3*2e6]
+        dkx = [[16.0/3*1e6, 4.4e6], [4.8*2e6, 4.8*0.55*1.75*2e6]]
+        dkthetax = [[16.0/3*21.6e6, 16.0/3*16.8e6], [32.0/3*2e6, 32.0/9*0.9*2e6]]
+        dkz = [[8e6, 2.4e6], [16.0/3*2e6, 2.4*2e6]]
+        dkphi = [[64e6, 0.0], [16*2e6, 0.0]]
+
+        for i in range(2):
+            np.testing.assert_allclose(k[i], [k_x[i], k_thetax[i], k_x[i], k_thetax[i], k_z[i], k_phi[i]], rtol=1e-14)
+            np.testing.assert_allclose(dk[i], [dkx[i], dkthetax[i], dkx[i], dkthetax[i], dkz[i], dkphi[i]], rtol=1e-14)
+
+        # rigid directions are masked per row
+        self.assertTrue(np.all(np.isinf(k[2, [0, 4]])))
+        np.testing.assert_array_equal(dk[2, [0, 4]], 0.0)
+        np.testing.assert_array_equal(k[2, [1, 2, 3, 5]], k[0, [1, 2, 3, 5]])
+        np.testing.assert_array_equal(dk[2, [1, 2, 3, 5]], dk[0, [1, 2, 3, 5]])
+
+        # the component is one row
+        for i in range(3):
+            soil = TowerSoil()
+            soil.r0 = r0[i]
+            soil.depth = depth[i]
+            soil.G = G[i]
+            soil.nu = nu[i]
+            soil.rigid = rigid[i]
+            soil.run()
+
+            self.assertFalse(hasattr(soil, 'dk'))
+            np.testing.assert_array_equal(k[i], soil.k)
+            np.testing.assert_array_equal(dk[i], soil.provideJ())
+
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_rainflow.py
+
+Copyright (c) NREL. All rights reserved.
+"""
+
+
+import unittest
+import numpy as np
+from commonse.rainflow import turning_points, rainflow, _four_point, RainflowCounter
+
+
+# ASTM E1049-85 (2011), Fig. 6 and Table 4
+astm_history = [-2.0, 1.0, -3.0, 5.0, -1.0, 3.0, -4.0, 4.0, -2.0]
+astm_counts = {3.0: 0.5, 4.0: 1.5, 6.0: 0.5, 8.0: 1.0, 9.0: 0.5}
+
+
+def _totals(ranges, counts):
+    """cycle counts summed by range"""
+
+    totals = {}
+    for r, n in zip(ranges, counts):
+        totals[r] = totals.get(r, 0.0) + n
+
+    return totals
+
+
+class _RecordingCounter(RainflowCounter):
+    """keeps every counted (range, count) pair"""
+
+    def __init__(self, *args, **kwargs):
+        RainflowCounter.__init__(self, *args, **kwargs)
+        self.cycles = [[] for i in range(self.nsections)]
+
+    def _add(self, i, ranges, counts):
+        RainflowCounter._add(self, i, ranges, counts)
+        self.cycles[i].extend(zip(ranges, counts))
+
+
+
+class TestRainflow(unittest.TestCase):
+
+
+    def test_astm(self):
+
+        ranges, counts = rainflow(astm_history)
+
+        self.assertEqual(_totals(ranges, counts), astm_counts)
+
+
+    def test_turning_points(self):
+
+        x = [0.0, 1.0, 1.0, 3.0, 2.0, 2.0, 2.0, -1.0, 0.0, 0.0]
+
+        np.testing.assert_array_equal(turning_points(x), [0.0, 3.0, -1.0, 0.0])
+        np.testing.assert_array_equal(turning_points([1.0, 1.0, 1.0]), [1.0])
+
+
+    def test_streaming(self):
+
+        rand = np.random.RandomState(3)
+        x = np.cumsum(rand.randn(2000, 2), axis=0)
+
+        # single pass
+        ref = [sorted(zip(*rainflow(x[:, i]))) for i in range(2)]
+        residue = [_four_point(turning_points(x[:, i]))[1] for i in range(2)]
+
+        for splits in ([], [1, 2, 3], [500, 501, 1400], list(rand.randint(0, 2000, 20))):
+            counter = _RecordingCounter(2)
+            for chunk in np.split(x, sorted(splits)):
+                counter.update(chunk)
+
+            for i in range(2):
+                np.testing.assert_array_equal(counter._residue[i], residue[i])
+
+            counter.finalize()
+
+            for i in range(2):
+                self.assertEqual(sorted(counter.cycles[i]), ref[i])
+
+
+    def test_del(self):
+
+        x = np.array(astm_history)
+        counter = RainflowCounter(2, m=(3.0, 4.0), bins=[0.0, 5.0, 10.0])
+        counter.update(np.column_stack([x, 2*x]))
+        counter.finalize()
+
+        # sum(n*S**m) = 1094 (m=3) and 8449 (m=4) for the ASTM history
+        DEL = counter.damage_equivalent_loads(N_eq=2.0, scale=10.0)
+        np.testing.assert_allclose(DEL[0], [(1094*10/2.0)**(1/3.0), (8449*10/2.0)**0.25], rtol=1e-14)
+        np.testing.assert_allclose(DEL[1], 2*DEL[0], rtol=1e-14)
+
+        M_DEL, N_DEL = counter.fatigue_inputs(4.0, N_eq=2.0, scale=10.0)
+        np.testing.assert_allclose(M_DEL, DEL[:, 1], rtol=1e-14)
+        np.testing.assert_array_equal(N_DEL, 2.0)
+
+        np.testing.assert_array_equal(counter.ncycles, 4.0)
+        np.testing.assert_array_equal(counter.histogram, [[2.0, 2.0], [0.0, 4.0]])  # 2x ranges are all >= 5
+
+        self.assertRaises(ValueError, counter.fatigue_inputs, 5.0, 2.0)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_scatter_loads.py
+
+Copyright (c) NREL. All rights reserved.
+"""
+
+
+import unittest
+import numpy as np
+from commonse.environment import PowerWind, LinearWaves
+from commonse.WindWaveDrag import TowerWindDrag, TowerWaveDrag, AeroHydroLoads
+from commonse import ScatterLoads
+from commonse.ScatterLoads import scatterLoads
+
+
+class TestScatterLoads(unittest.TestCase):
+
+    def setUp(self):
+
+        # repeated wind speeds and sea states, in no particular order
+        self.U = np.array([12.0, 8.0, 12.0, 25.0, 8.0, 12.0])
+        self.Hs = np.array([2.0, 4.0, 2.0, 4.0, 6.0, 2.0])
+        self.Tp = np.array([8.0, 10.0, 8.0, 10.0, 12.0, 9.0])
+        self.direction = np.array([0.0, 15.0, -30.0, 15.0, 90.0, 0.0])
+
+        self.z = np.linspace(-20.0, 90.0, 12)
+        self.d = np.linspace(6.0, 3.87, 12)
+        self.kw = dict(zref=90.0, z_surface=0.0, z_floor=-20.0, z0=0.0, shearExp=0.14,
+            betaWind=10.0, yaw=5.0, Uc=0.5)
+
+
+    def chain(self, i):
+        """one case through PowerWind/LinearWaves -> TowerWindDrag/TowerWaveDrag -> AeroHydroLoads"""
+
+        kw = self.kw
+
+        wind = PowerWind()
+        wind.Uref = self.U[i]
+        wind.zref = kw['zref']
+        wind.z0 = kw['z0']
+        wind.z = self.z
+        wind.shearExp = kw['shearExp']
+        wind.betaWind = kw['betaWind']
+        wind.run()
+
+        wave = LinearWaves()
+        wave.hmax = 1.86*self.Hs[i]
+        wave.T = self.Tp[i]
+        wave.Uc = kw['Uc']
+        wave.z_surface = kw['z_surface']
+        wave.z_floor = kw['z_floor']
+        wave.betaWave = self.direction[i]
+        wave.z = self.z
+        wave.run()
+
+        winddrag = TowerWindDrag()
+        winddrag.U = wind.U
+        winddrag.z = self.z
+        winddrag.d = self.d
+        winddrag.beta = wind.beta
+        winddrag.run()
+
+        wavedrag = TowerWaveDrag()
+        wavedrag.U = wave.U
+        wavedrag.A = wave.A
+        wavedrag.U0 = wave.U0
+        wavedrag.A0 = wave.A0
+        wavedrag.z = self.z
+        wavedrag.d = self.d
+        wavedrag.beta = wave.beta
+        wavedrag.beta0 = wave.beta0
+        wavedrag.run()
+
+        loads = AeroHydroLoads()
+        loads.windLoads = winddrag.windLoads
+        loads.waveLoads = wavedrag.waveLoads
+        loads.z = self.z
+        loads.yaw = kw['yaw']
+        loads.run()
+
+        return loads
+
+
+    def test_chain(self):
+
+        out = scatterLoads(self.U, self.Hs, self.Tp, self.direction, self.z, self.d, **self.kw)
+
+        for i in range(len(self.U)):
+            loads = self.chain(i)
+            for name in ('Px', 'Py', 'Pz', 'qdyn'):
+                ref = getattr(loads, name)
+                np.testing.assert_allclose(out[name][i], ref, rtol=1e-12, atol=1e-12*np.max(np.abs(ref)))
+
+
+    def test_workers(self):
+
+        serial = scatterLoads(self.U, self.Hs, self.Tp, self.direction, self.z, self.d, **self.kw)
+
+        # several tasks of uneven size per pool
+        for cases_per_task in (1, 2, 64):
+            pooled = scatterLoads(self.U, self.Hs, self.Tp, self.direction, self.z, self.d,
+                nworkers=2, cases_per_task=cases_per_task, **self.kw)
+            for name in ('Px', 'Py', 'Pz', 'qdyn'):
+                np.testing.assert_array_equal(pooled[name], serial[name])
+
+
+    def test_dedup(self):
+
+        out = scatterLoads(self.U, self.Hs, self.Tp, self.direction, self.z, self.d, **self.kw)
+
+        # each case is evaluated on its own and must land in the same row
+        for i in range(len(self.U)):
+            single = scatterLoads(self.U[i:i+1], self.Hs[i:i+1], self.Tp[i:i+1], self.direction[i:i+1],
+                self.z, self.d, **self.kw)
+            for name in ('Px', 'Py', 'Pz', 'qdyn'):
+                np.testing.assert_array_equal(out[name][i], single[name][0])
+
+        # each unique wind speed and sea state is evaluated once
+        evaluated = {'wind': [], 'wave': []}
+        windTask, waveTask = ScatterLoads._windTask, ScatterLoads._waveTask
+
+        def countWind(args):
+            evaluated['wind'].extend(args[0])
+            return windTask(args)
+
+        def countWave(args):
+            evaluated['wave'].extend(zip(args[0], args[1]))
+            return waveTask(args)
+
+        try:
+            ScatterLoads._windTask, ScatterLoads._waveTask = countWind, countWave
+            scatterLoads(self.U, self.Hs, self.Tp, self.direction, self.z, self.d, cases_per_task=2, **self.kw)
+        finally:
+            ScatterLoads._windTask, ScatterLoads._waveTask = windTask, waveTask
+
+        self.assertEqual(sorted(evaluated['wind']), [8.0, 12.0, 25.0])
+        self.assertEqual(sorted(evaluated['wave']), [(2.0, 8.0), (2.0, 9.0), (4.0, 10.0), (6.0, 12.0)])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
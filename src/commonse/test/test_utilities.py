@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_utilities.py
+
+Copyright (c) NREL. All rights reserved.
+"""
+
+
+import unittest
+import warnings
+import numpy as np
+from openmdao.main.api import Component
+from openmdao.main.datatypes.api import Float, Array
+from commonse import utilities
+from commonse.utilities import InterpolationPlan, interpolation_plan, _interpolation_plans, pack_ragged, unpack_ragged, \
+    expand_ragged, fd_jacobian, probe_sparsity, check_gradient, _sparsity_patterns
+from commonse.environment import PowerWind
+from commonse.WindWaveDrag import TowerWaveDrag
+
+
+class TestInterpolationPlan(unittest.TestCase):
+
+    def setUp(self):
+
+        self.xp = np.array([0.0, 1.0, 2.5, 2.5, 4.0, 7.0])  # includes a repeated node
+        self.x = np.array([-1.0, 0.0, 0.3, 1.7, 3.1, 5.5, 7.0, 9.0])
+        self.fp = np.array([[1.0, 3.0, -2.0, 4.0, 0.5, 6.0],
+                            [0.0, 1.0, 4.0, 9.0, 16.0, 25.0]])
+
+
+    def test_interp(self):
+
+        plan = InterpolationPlan(self.xp, self.x)
+
+        y = plan(self.fp)
+        self.assertEqual(y.shape, (2, len(self.x)))
+        for i in range(2):
+            np.testing.assert_allclose(y[i], np.interp(self.x, self.xp, self.fp[i]), rtol=1e-15)
+            np.testing.assert_allclose(plan(self.fp[i]), y[i], rtol=1e-15)
+
+        np.testing.assert_allclose(InterpolationPlan([2.0], self.x)([5.0]), 5.0)
+
+
+    def test_matrix(self):
+
+        plan = InterpolationPlan(self.xp, self.x)
+        M = plan.matrix
+
+        self.assertEqual(M.shape, (len(self.x), len(self.xp)))
+        np.testing.assert_allclose(M.dot(self.fp.T).T, plan(self.fp), rtol=1e-15)
+
+
+    def test_deriv_x(self):
+
+        x = np.array([-1.0, 0.3, 1.7, 3.1, 5.5, 9.0])  # away from the nodes
+        dy = InterpolationPlan(self.xp, x).deriv_x(self.fp)
+
+        h = 1e-6
+        fd = (InterpolationPlan(self.xp, x + h)(self.fp) - InterpolationPlan(self.xp, x - h)(self.fp))/(2*h)
+
+        np.testing.assert_allclose(dy, fd, rtol=1e-8, atol=1e-8)
+        np.testing.assert_array_equal(dy[:, [0, -1]], 0.0)  # end values are held
+
+
+    def test_cache(self):
+
+        _interpolation_plans.clear()
+
+        plan = interpolation_plan(self.xp, self.x)
+        self.assertIs(interpolation_plan(list(self.xp), list(self.x)), plan)
+        self.assertEqual((_interpolation_plans.hits, _interpolation_plans.misses), (1, 1))
+
+        self.assertIsNot(interpolation_plan(self.xp, self.x[:-1]), plan)
+        self.assertEqual(_interpolation_plans.misses, 2)
+
+        # same bytes, different shape
+        plan = utilities.InterpolationPlan
+        utilities.InterpolationPlan = lambda xp, x: (xp.shape, x.shape)
+        try:
+            interpolation_plan(self.xp, self.x)
+            self.assertEqual(interpolation_plan(self.xp, self.x.reshape(2, 4)), ((6,), (2, 4)))
+            self.assertEqual(interpolation_plan(self.xp.reshape(2, 3), self.x), ((2, 3), (8,)))
+        finally:
+            utilities.InterpolationPlan = plan
+
+
+    def test_descending(self):
+
+        self.assertRaises(TypeError, InterpolationPlan, self.xp[::-1], self.x)
+        self.assertRaises(TypeError, interpolation_plan, self.xp[::-1], self.x)
+
+
+
+class TestRagged(unittest.TestCase):
+
+
+    def test_round_trip(self):
+
+        vec = [np.array([1.0, 2.0, 3.0]), np.zeros(0), np.linspace(0.0, 1.0, 5), np.array([7.0])]
+
+        flat, offsets = pack_ragged(vec)
+        np.testing.assert_array_equal(offsets, [0, 3, 3, 8, 9])
+        self.assertEqual(flat.shape, (9,))
+
+        for v, u in zip(vec, unpack_ragged(flat, offsets)):
+            np.testing.assert_array_equal(u, v)
+
+        # slices are taken along the last axis
+        cases = np.vstack([flat, 2*flat])
+        for v, u in zip(vec, unpack_ragged(cases, offsets)):
+            np.testing.assert_array_equal(u, np.vstack([v, 2*v]))
+
+        flat, offsets = pack_ragged([])
+        self.assertEqual(len(flat), 0)
+        self.assertEqual(unpack_ragged(flat, offsets), [])
+
+
+    def test_expand(self):
+
+        offsets = np.array([0, 3, 3, 8, 9])
+
+        np.testing.assert_array_equal(expand_ragged(2.0, offsets), 2.0)
+        np.testing.assert_array_equal(expand_ragged([1.0, 2.0, 3.0, 4.0], offsets), [1, 1, 1, 3, 3, 3, 3, 3, 4])
+        np.testing.assert_array_equal(expand_ragged(np.arange(9.0), offsets), np.arange(9.0))
+        self.assertEqual(expand_ragged(np.ones((2, 4)), offsets).shape, (2, 9))
+        self.assertRaises(ValueError, expand_ragged, np.ones(5), offsets)
+
+
+
+class _Scaled(Component):
+    """y = a*sin(x), complex-safe"""
+
+    x = Array(iotype='in')
+    a = Float(iotype='in')
+    y = Array(iotype='out')
+
+    def execute(self):
+        self.y = self.a*np.sin(self.x)
+
+    def list_deriv_vars(self):
+        return ('x', 'a'), ('y',)
+
+
+class _RealScaled(_Scaled):
+    """_Scaled whose scalar input rejects complex values, like an OpenMDAO Float"""
+
+    def __setattr__(self, name, value):
+        if name == 'a' and np.iscomplexobj(value):
+            raise TypeError('a must be a float')
+        super(_RealScaled, self).__setattr__(name, value)
+
+
+class _Magnitude(Component):
+    """y = x*|x|, np.abs silently drops the imaginary part"""
+
+    x = Array(iotype='in')
+    y = Array(iotype='out')
+
+    def execute(self):
+        self.y = self.x*np.abs(self.x)
+
+    def list_deriv_vars(self):
+        return ('x',), ('y',)
+
+
+def _fdWarnings(comp, **kwargs):
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter('always')
+        JFD = fd_jacobian(comp, **kwargs)
+
+    return JFD, [str(wi.message) for wi in w]
+
+
+def _countRuns(comp):
+    count = [0]
+    run = comp.run
+
+    def countedRun():
+        count[0] += 1
+        run()
+
+    comp.run = countedRun
+    return count
+
+
+class TestFDJacobian(unittest.TestCase):
+
+    def setUp(self):
+
+        self.wind = PowerWind()
+        self.wind.Uref = 10.0
+        self.wind.zref = 100.0
+        self.wind.z = np.linspace(5.0, 120.0, 12)
+        self.wind.z0 = 0.0
+        self.wind.shearExp = 0.2
+
+        self.drag = TowerWaveDrag()
+        self.drag.U = np.linspace(0.5, 2.5, 10)
+        self.drag.A = np.linspace(0.3, 1.5, 10)
+        self.drag.z = np.linspace(-30.0, 0.0, 10)
+        self.drag.d = np.linspace(6.0, 5.0, 10)
+        self.drag.beta = 20.0*np.ones(10)
+
+
+    def test_nprocs(self):
+
+        for comp in [self.wind, self.drag]:
+            JFD = fd_jacobian(comp)
+            np.testing.assert_allclose(JFD, comp.provideJ(), rtol=1e-6, atol=1e-5)
+            np.testing.assert_array_equal(fd_jacobian(comp, nprocs=2), JFD)
+            np.testing.assert_array_equal(fd_jacobian(comp, fd='forward', nprocs=2), fd_jacobian(comp, fd='forward'))
+
+
+    def test_complex_scalar(self):
+
+        # the profile is cast to float, so the z columns fall back to central
+        # differences with a warning
+        JFD, msg = _fdWarnings(self.wind, fd='complex')
+
+        np.testing.assert_array_equal(JFD, fd_jacobian(self.wind, fd='central'))
+        self.assertEqual(len(msg), 1)
+        self.assertIn('PowerWind is not complex-safe', msg[0])
+        for name in ['z[0]', 'z[11]']:
+            self.assertIn('\t' + name + ': ', msg[0])
+
+        # a scalar input that rejects complex values falls back silently,
+        # the array input is still complex stepped
+        for comp in [_Scaled(), _RealScaled()]:
+            comp.x = np.linspace(0.1, 1.5, 6)
+            comp.a = 2.0
+            JFD, msg = _fdWarnings(comp, fd='complex')
+
+            self.assertEqual(msg, [])
+            np.testing.assert_allclose(JFD[:, :6], np.diag(2.0*np.cos(comp.x)), rtol=1e-14)
+            np.testing.assert_allclose(JFD[:, 6], np.sin(comp.x), rtol=1e-8)
+
+
+    def test_complex_dropped(self):
+
+        comp = _Magnitude()
+        comp.x = np.array([-2.0, -0.5, 0.3, 1.0, 4.0])
+        JFD, msg = _fdWarnings(comp, fd='complex')
+
+        self.assertEqual(len(msg), 1)
+        self.assertIn('_Magnitude drops the imaginary part', msg[0])
+        np.testing.assert_array_equal(JFD, fd_jacobian(comp, fd='central'))
+        np.testing.assert_allclose(JFD, np.diag(2.0*np.abs(comp.x)), rtol=1e-8)
+
+
+
+    def test_sparsity(self):
+
+        for comp in [self.wind, self.drag]:
+            pattern = probe_sparsity(comp)
+
+            count = _countRuns(comp)
+            JFD = fd_jacobian(comp)
+            ndense = count[0]
+
+            count[0] = 0
+            JFDc, msg = _fdWarnings(comp, sparsity=pattern)
+            self.assertLess(count[0], ndense/3)
+            self.assertEqual(msg, [])
+            np.testing.assert_array_equal(JFDc, JFD)
+
+            self.assertEqual(check_gradient(comp, sparsity=pattern, show_missing_warnings=False),
+                             check_gradient(comp, show_missing_warnings=False))
+
+
+    def test_sparsity_probe(self):
+
+        _sparsity_patterns.clear()
+
+        for comp in [self.wind, self.drag]:
+            count = _countRuns(comp)
+            JFD = fd_jacobian(comp)
+            ndense = count[0]
+
+            # the first check is the dense sweep, later ones reuse its pattern
+            count[0] = 0
+            np.testing.assert_array_equal(fd_jacobian(comp, sparsity='probe'), JFD)
+            self.assertEqual(count[0], ndense)
+
+            for i in range(2):
+                count[0] = 0
+                np.testing.assert_array_equal(fd_jacobian(comp, sparsity='probe'), JFD)
+                self.assertLess(count[0], ndense/3)
+
+        self.assertEqual((_sparsity_patterns.hits, _sparsity_patterns.misses), (4, 2))
+
+
+    def test_sparsity_provideJ(self):
+
+        JFD, msg = _fdWarnings(self.drag, sparsity='provideJ')
+
+        self.assertEqual(len(msg), 1)
+        self.assertIn('taken from provideJ', msg[0])
+        np.testing.assert_array_equal(JFD, fd_jacobian(self.drag))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_utilization_envelope.py
+
+Copyright (c) NREL. All rights reserved.
+"""
+
+
+import unittest
+import numpy as np
+from commonse.UtilizationSupplement import vonMisesStressUtilization, shellBucklingEurocode, bucklingGL, \
+    UtilizationEnvelope, utilizationEnvelope
+
+
+class TestUtilizationEnvelope(unittest.TestCase):
+
+    def setUp(self):
+
+        n = 6
+        ncases = 23
+        rand = np.random.RandomState(1)
+
+        self.d = np.linspace(6.0, 3.87, n)
+        self.t = np.linspace(0.027, 0.018, n)
+        self.L = np.linspace(10.0, 25.0, n)
+        self.E = 210e9
+        self.sigma_y = 345e6
+        self.tower_height = 87.6
+
+        self.axial = rand.uniform(-1.5e8, 5e7, (n, ncases))
+        self.hoop = rand.uniform(-2e7, 1e7, (n, ncases))
+        self.shear = rand.uniform(-1e7, 1e7, (n, ncases))
+        self.Fz = rand.uniform(-8e6, -1e6, (n, ncases))
+        self.Myy = rand.uniform(-1e8, 1e8, (n, ncases))
+        self.ids = 100 + np.arange(ncases)
+
+
+    def envelope(self):
+
+        return UtilizationEnvelope(self.d, self.t, self.L, self.E, self.sigma_y, self.tower_height)
+
+
+    def cases(self, cols=None):
+
+        if cols is None:
+            cols = range(len(self.ids))
+
+        for j in cols:
+            yield self.ids[j], {'axial_stress': self.axial[:, j], 'hoop_stress': self.hoop[:, j],
+                                'shear_stress': self.shear[:, j], 'Fz': self.Fz[:, j], 'Myy': self.Myy[:, j]}
+
+
+    def assertEnvelope(self, env):
+        """compare with the max/argmax over all cases in a single pass"""
+
+        col = lambda x: np.asarray(x, dtype=float)[:, np.newaxis]*np.ones((1, len(self.ids)))
+        d, t, L, E, sigma_y = [col(x) for x in (self.d, self.t, self.L, self.E*np.ones(6), self.sigma_y*np.ones(6))]
+
+        ref = {}
+        ref['stress'] = vonMisesStressUtilization(self.axial, self.hoop, self.shear, 1.35*1.3*1.0, sigma_y)
+        ref['shell'] = shellBucklingEurocode(d, t, self.axial, self.hoop, self.shear, L, E, sigma_y, 1.35, 1.1)
+        ref['global'] = bucklingGL(d, t, self.Fz, self.Myy, self.tower_height, E, sigma_y, 1.35, 1.1, 1.1)
+
+        self.assertEqual(env.ncases, len(self.ids))
+        for name in env.checks:
+            np.testing.assert_array_equal(env.max[name], np.max(ref[name], axis=1))
+            np.testing.assert_array_equal(env.argmax[name], self.ids[np.argmax(ref[name], axis=1)])
+
+
+    def test_update(self):
+
+        # one case at a time
+        env = self.envelope()
+        for j in range(len(self.ids)):
+            env.update(self.axial[:, j], self.hoop[:, j], self.shear[:, j], self.Fz[:, j], self.Myy[:, j], self.ids[j])
+        self.assertEnvelope(env)
+
+        # all cases at once
+        env = self.envelope()
+        env.update(self.axial, self.hoop, self.shear, self.Fz, self.Myy, self.ids)
+        self.assertEnvelope(env)
+
+
+    def test_update_cases(self):
+
+        for chunk_size in (1, 5, 64):
+            env = self.envelope()
+            env.updateCases(self.cases(), chunk_size)
+            self.assertEnvelope(env)
+
+
+    def test_merge(self):
+
+        env = self.envelope()
+        partials = [env.copy(empty=True) for i in range(3)]
+        partials[0].updateCases(self.cases(range(0, 9)))
+        partials[1].updateCases(self.cases(range(9, 10)))
+        partials[2].updateCases(self.cases(range(10, 23)), chunk_size=4)
+
+        for partial in partials[::-1]:
+            env.merge(partial)
+        self.assertEnvelope(env)
+
+
+    def test_workers(self):
+
+        serial = utilizationEnvelope(self.cases(), self.envelope(), chunk_size=7)
+        self.assertEnvelope(serial)
+
+        # 23 cases do not divide evenly into the chunks
+        for chunk_size in (4, 7, 64):
+            pooled = utilizationEnvelope(self.cases(), self.envelope(), nworkers=2, chunk_size=chunk_size)
+            self.assertEqual(pooled.ncases, serial.ncases)
+            for name in serial.checks:
+                np.testing.assert_array_equal(pooled.max[name], serial.max[name])
+                np.testing.assert_array_equal(pooled.argmax[name], serial.argmax[name])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
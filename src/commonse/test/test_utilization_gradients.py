@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_utilization_gradients.py
+
+Copyright (c) NREL. All rights reserved.
+"""
+
+
+import unittest
+import numpy as np
+from commonse.UtilizationSupplement import vonMisesStressUtilization, hoopStressEurocode, bucklingGL, \
+    shellBucklingEurocode, shellBucklingEurocodeScalar, fatigue
+
+
+def _centralFD(f, args, k, step=1e-6):
+    """elementwise central difference of f w.r.t. args[k]"""
+
+    x = np.asarray(args[k], dtype=float)
+    h = step*np.abs(x)
+
+    plus = list(args)
+    plus[k] = x + h
+    minus = list(args)
+    minus[k] = x - h
+
+    return (f(*plus) - f(*minus))/(2*h)
+
+
+class TestUtilizationGradients(unittest.TestCase):
+
+    def setUp(self):
+
+        self.d = np.array([6.0, 5.5, 5.0, 4.5, 4.0, 3.87])
+        self.t = np.array([0.027, 0.0262, 0.0248, 0.0235, 0.02, 0.018])
+        self.L = np.array([10.0, 12.0, 15.0, 5.0, 20.0, 25.0])
+        self.sigma_z = np.array([-1.2e8, -9.0e7, -7.5e7, 6.0e7, -4.0e7, -1.0e7])
+        self.sigma_t = np.array([-2.0e7, -1.5e7, 1.2e7, -1.0e7, -5.0e6, -1.0e6])
+        self.tau_zt = np.array([1.0e7, -8.0e6, 6.0e6, 4.0e6, -2.0e6, 1.0e6])
+        self.E = 210e9*np.ones(6)
+        self.sigma_y = 345e6*np.ones(6)
+
+
+    def check(self, f, args, derivs, tol=1e-5):
+
+        for k, deriv in derivs:
+            fd = _centralFD(f, args, k)
+            np.testing.assert_allclose(deriv, fd, rtol=tol, atol=tol*np.max(np.abs(fd)))
+
+
+    def test_vonMises(self):
+
+        args = [self.sigma_z, self.sigma_t, self.tau_zt, 1.35, self.sigma_y]
+        out = vonMisesStressUtilization(*args, return_derivs=True)
+
+        self.check(vonMisesStressUtilization, args, zip([0, 1, 2, 4], out[1:]))
+
+
+    def test_hoop(self):
+
+        q = np.linspace(2000.0, 500.0, 6)
+        args = [np.zeros(6), self.d, self.t, self.L, q]
+        out = hoopStressEurocode(*args, return_derivs=True)
+
+        self.check(hoopStressEurocode, args, zip([1, 2, 3, 4], out[1:]))
+
+
+    def test_GL(self):
+
+        Fz = -np.linspace(8e6, 3e6, 6)
+        Myy = np.linspace(1e8, 1e7, 6)
+        args = [self.d, self.t, Fz, Myy, 87.6*np.ones(6), self.E, self.sigma_y]
+        out = bucklingGL(*args, return_derivs=True)
+
+        self.check(bucklingGL, args, zip([0, 1, 2, 3, 4], out[1:]))
+
+
+    def test_shell(self):
+
+        args = [self.d, self.t, self.sigma_z, self.sigma_t, self.tau_zt, self.L, self.E, self.sigma_y]
+        out = shellBucklingEurocode(*args, return_derivs=True)
+
+        np.testing.assert_allclose(out[0], shellBucklingEurocodeScalar(*args), rtol=1e-12)
+        self.check(shellBucklingEurocode, args, zip([0, 1, 2, 3, 4, 5], out[1:]))
+
+
+    def test_fatigue(self):
+
+        M_DEL = np.linspace(2e7, 5e6, 6)
+        N_DEL = 1e7*np.ones(6)
+
+        for m, N_knee in [(4, ()), ((3, 5), (5e6,))]:
+            f = lambda M, N, d, t: fatigue(M, N, d, t, m=m, N_knee=N_knee)
+            args = [M_DEL, N_DEL, self.d, self.t]
+            out = fatigue(*args, m=m, N_knee=N_knee, return_derivs=True)
+
+            self.check(f, args, zip([0, 1, 2, 3], out[1:]))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
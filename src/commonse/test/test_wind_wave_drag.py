@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_wind_wave_drag.py
+
+Copyright (c) NREL. All rights reserved.
+"""
+
+
+import math
+import unittest
+import numpy as np
+from commonse.WindWaveDrag import cylinderDrag, drag_spline, TowerWindDrag, TowerWaveDrag, AeroHydroLoads, FluidLoads, \
+    yawedLoads, morisonForce, memberWindLoads, memberWaveLoads
+from commonse.csystem import DirectionVector
+from commonse.utilities import pack_ragged, unpack_ragged
+
+
+def cylinderDragAkima(Re):
+    """cylinderDrag evaluated directly from the akima spline"""
+
+    ReN = Re / 1.0e6
+
+    cd = np.zeros_like(Re)
+    dcd_dRe = np.zeros_like(Re)
+    idx = ReN > 0
+    cd[idx], dcd_dRe[idx] = drag_spline.interp(np.log10(ReN[idx]))
+    dcd_dRe[idx] /= (Re[idx]*math.log(10))  # chain rule
+
+    return cd, dcd_dRe
+
+
+
+class TestCylinderDrag(unittest.TestCase):
+
+
+    def test_akima(self):
+
+        # zero velocity, below, inside, and above the table (1e-5 to 10 in Re/1e6)
+        Re = np.concatenate([[0.0], np.logspace(-2, 9, 500), [1.0e5, 3.0e5, 1.0e6]])
+
+        cd, dcd = cylinderDrag(Re)
+        cd_ref, dcd_ref = cylinderDragAkima(Re)
+
+        self.assertEqual(cd[0], 0.0)
+        self.assertEqual(dcd[0], 0.0)
+        np.testing.assert_allclose(cd, cd_ref, rtol=1e-12, atol=1e-14)
+        np.testing.assert_allclose(dcd, dcd_ref, rtol=1e-10, atol=1e-14*np.max(np.abs(dcd_ref)))
+
+
+    def test_shape(self):
+
+        Re = np.logspace(3, 8, 12).reshape(3, 4)
+
+        cd, dcd = cylinderDrag(Re)
+        cd_ref, dcd_ref = cylinderDragAkima(Re.ravel())
+
+        self.assertEqual(cd.shape, (3, 4))
+        np.testing.assert_allclose(cd.ravel(), cd_ref, rtol=1e-12)
+        np.testing.assert_allclose(dcd.ravel(), dcd_ref, rtol=1e-10)
+
+
+
+class TestTowerWindDrag(unittest.TestCase):
+
+    def setUp(self):
+
+        self.drag = TowerWindDrag()
+        self.drag.U = np.linspace(5.0, 12.0, 10)
+        self.drag.z = np.linspace(0.0, 90.0, 10)
+        self.drag.d = np.linspace(6.0, 3.87, 10)
+        self.drag.beta = 10.0*np.ones(10)
+
+
+    def test_sparse(self):
+
+        self.drag.run()
+
+        J = self.drag.provideJ()
+        self.drag.sparse_jacobian = True
+        Jsparse = self.drag.provideJ()
+
+        self.assertEqual(Jsparse.shape, J.shape)
+        np.testing.assert_array_equal(Jsparse.toarray(), J)
+
+
+
+class TestTowerWaveDrag(unittest.TestCase):
+
+    def setUp(self):
+
+        self.drag = TowerWaveDrag()
+        self.drag.U = np.linspace(0.5, 2.5, 10)
+        self.drag.A = np.linspace(0.3, 1.5, 10)
+        self.drag.z = np.linspace(-30.0, 0.0, 10)
+        self.drag.d = np.linspace(6.0, 5.0, 10)
+        self.drag.beta = 20.0*np.ones(10)
+
+
+    def test_sparse(self):
+
+        self.drag.run()
+
+        J = self.drag.provideJ()
+        self.drag.sparse_jacobian = True
+        Jsparse = self.drag.provideJ()
+
+        self.assertEqual(Jsparse.shape, J.shape)
+        np.testing.assert_array_equal(Jsparse.toarray(), J)
+
+
+    def test_time_domain(self):
+
+        drag = self.drag
+        t = 0.5*np.arange(237)
+        phase = 2*np.pi*t[:, np.newaxis]/9.0
+        U = np.cos(phase)*drag.U  # oscillating flow (nt x nz)
+        A = -np.sin(phase)*drag.A
+
+        loads = drag.timeDomainLoads(U, A, chunk_size=len(t))
+        Px, Py, Pz, qdyn = loads
+
+        # step by step
+        for i in range(len(t)):
+            Fp = morisonForce(U[i], A[i], drag.d, drag.rho, drag.mu, drag.cm, drag.cd_usr)
+            np.testing.assert_allclose(Px[i], Fp*np.cos(np.radians(drag.beta)), rtol=1e-14, atol=1e-12)
+            np.testing.assert_allclose(Py[i], Fp*np.sin(np.radians(drag.beta)), rtol=1e-14, atol=1e-12)
+            np.testing.assert_array_equal(Pz[i], 0.0)
+            np.testing.assert_allclose(qdyn[i], 0.5*drag.rho*U[i]**2, rtol=1e-14)
+
+        # a time step at the peak velocity matches the steady outputs
+        drag.run()
+        i = 18  # cos(phase) = 1
+        np.testing.assert_allclose(qdyn[i], drag.waveLoads.qdyn, rtol=1e-14)
+
+        # chunked (last chunk is partial)
+        for chunk_size in (1, 50, 1000):
+            for c, l in zip(drag.timeDomainLoads(U, A, chunk_size=chunk_size), loads):
+                np.testing.assert_array_equal(c, l)
+
+        # streaming
+        chunks = [(t[i:i+64], U[i:i+64], A[i:i+64]) for i in range(0, len(t), 64)]
+        out = list(drag.iterTimeDomainLoads(chunks))
+        np.testing.assert_array_equal(np.concatenate([c[0] for c in out]), t)
+        for k in range(4):
+            np.testing.assert_array_equal(np.vstack([c[k+1] for c in out]), loads[k])
+
+
+
+class TestAeroHydroLoads(unittest.TestCase):
+
+    def setUp(self):
+
+        # wind, wave, and tower grids all differ (wind.beta is read on the tower grid)
+        self.wind = FluidLoads()
+        self.wind.z = np.linspace(0.0, 95.0, 20)
+        self.wind.Px = np.linspace(100.0, 900.0, 20)
+        self.wind.Py = np.linspace(-50.0, 80.0, 20)
+        self.wind.Pz = np.zeros(20)
+        self.wind.qdyn = np.linspace(10.0, 90.0, 20)
+        self.wind.beta = np.linspace(8.0, 12.0, 20)
+
+        self.wave = FluidLoads()
+        self.wave.z = np.linspace(-30.0, 0.0, 7)
+        self.wave.Px = np.linspace(3000.0, 1000.0, 7)
+        self.wave.Py = np.linspace(500.0, 200.0, 7)
+        self.wave.Pz = np.zeros(7)
+        self.wave.qdyn = np.linspace(800.0, 2000.0, 7)
+
+        self.z = np.linspace(-30.0, 90.0, 20)
+
+
+    def perYaw(self, yaw):
+        """one yaw angle through DirectionVector, as AeroHydroLoads did before yawedLoads"""
+
+        wind = self.wind
+        wave = self.wave
+        z = self.z
+        betaMain = np.interp(z[-1], z, wind.beta)
+        windLoads = DirectionVector(wind.Px, wind.Py, wind.Pz).inertialToWind(betaMain).windToYaw(yaw)
+        waveLoads = DirectionVector(wave.Px, wave.Py, wave.Pz).inertialToWind(betaMain).windToYaw(yaw)
+
+        Px = np.interp(z, wind.z, windLoads.x) + np.interp(z, wave.z, waveLoads.x)
+        Py = np.interp(z, wind.z, windLoads.y) + np.interp(z, wave.z, waveLoads.y)
+        Pz = np.interp(z, wind.z, windLoads.z) + np.interp(z, wave.z, waveLoads.z)
+        qdyn = np.interp(z, wind.z, wind.qdyn) + np.interp(z, wave.z, wave.qdyn)
+
+        return Px, Py, Pz, qdyn
+
+
+    def test_yawed(self):
+
+        yaw = np.array([-30.0, 0.0, 5.0, 90.0, 180.0])
+        loads = yawedLoads(self.z, self.wind, self.wave, yaw)
+
+        for i in range(len(yaw)):
+            for batched, ref in zip(loads, self.perYaw(yaw[i])):
+                np.testing.assert_allclose(batched[i], ref, rtol=1e-12, atol=1e-10)
+
+
+    def test_component(self):
+
+        comp = AeroHydroLoads()
+        comp.windLoads = self.wind
+        comp.waveLoads = self.wave
+        comp.z = self.z
+        comp.yaw = 5.0
+        comp.run()
+
+        Px, Py, Pz, qdyn = self.perYaw(5.0)
+        np.testing.assert_allclose(comp.Px, Px, rtol=1e-12, atol=1e-10)
+        np.testing.assert_allclose(comp.Py, Py, rtol=1e-12, atol=1e-10)
+        np.testing.assert_allclose(comp.Pz, Pz, rtol=1e-12, atol=1e-10)
+        np.testing.assert_allclose(comp.qdyn, qdyn, rtol=1e-12, atol=1e-10)
+
+
+
+class TestMemberLoads(unittest.TestCase):
+
+    def setUp(self):
+
+        # members of different lengths, one with a user drag coefficient
+        n = [6, 3, 9]
+        self.d = [5.0, 1.2, 0.8]
+        self.beta = [0.0, 30.0, -60.0]
+        self.cd_usr = [0.0, 0.9, 0.0]
+        self.cm = [2.0, 1.8, 2.0]
+
+        self.z, self.offsets = pack_ragged([np.linspace(-30.0, 0.0, k) for k in n])
+        self.U = pack_ragged([np.linspace(0.5, 2.0, k) for k in n])[0]
+        self.A = pack_ragged([np.linspace(0.2, 1.0, k) for k in n])[0]
+
+
+    def test_wind(self):
+
+        loads = memberWindLoads(self.offsets, 10*self.U, self.d, self.beta, cd_usr=self.cd_usr)
+        members = zip(*[unpack_ragged(P, self.offsets) for P in loads])
+
+        for i, (Px, Py, Pz, qdyn) in enumerate(members):
+            drag = TowerWindDrag()
+            drag.U = unpack_ragged(10*self.U, self.offsets)[i]
+            drag.z = unpack_ragged(self.z, self.offsets)[i]
+            drag.d = self.d[i]*np.ones(len(drag.z))
+            drag.beta = self.beta[i]*np.ones(len(drag.z))
+            drag.cd_usr = self.cd_usr[i]
+            drag.run()
+
+            np.testing.assert_allclose(Px, drag.windLoads.Px, rtol=1e-13, atol=1e-12)
+            np.testing.assert_allclose(Py, drag.windLoads.Py, rtol=1e-13, atol=1e-12)
+            np.testing.assert_allclose(Pz, drag.windLoads.Pz, rtol=1e-13, atol=1e-12)
+            np.testing.assert_allclose(qdyn, drag.windLoads.qdyn, rtol=1e-13)
+
+
+    def test_wave(self):
+
+        loads = memberWaveLoads(self.offsets, self.U, self.A, self.d, self.beta, cm=self.cm, cd_usr=self.cd_usr)
+        members = zip(*[unpack_ragged(P, self.offsets) for P in loads])
+
+        for i, (Px, Py, Pz, qdyn) in enumerate(members):
+            drag = TowerWaveDrag()
+            drag.U = unpack_ragged(self.U, self.offsets)[i]
+            drag.A = unpack_ragged(self.A, self.offsets)[i]
+            drag.z = unpack_ragged(self.z, self.offsets)[i]
+            drag.d = self.d[i]*np.ones(len(drag.z))
+            drag.beta = self.beta[i]*np.ones(len(drag.z))
+            drag.cm = self.cm[i]
+            drag.cd_usr = self.cd_usr[i]
+            drag.run()
+
+            np.testing.assert_allclose(Px, drag.waveLoads.Px, rtol=1e-13, atol=1e-12)
+            np.testing.assert_allclose(Py, drag.waveLoads.Py, rtol=1e-13, atol=1e-12)
+            np.testing.assert_allclose(Pz, drag.waveLoads.Pz, rtol=1e-13, atol=1e-12)
+            np.testing.assert_allclose(qdyn, drag.waveLoads.qdyn, rtol=1e-13)
+
+
+    def test_cases(self):
+
+        # a leading case dimension is evaluated case by case
+        U = np.vstack([self.U, 2*self.U])
+        A = np.vstack([self.A, -self.A])
+
+        loads = memberWaveLoads(self.offsets, U, A, self.d, self.beta, cm=self.cm, cd_usr=self.cd_usr)
+
+        for k in range(2):
+            single = memberWaveLoads(self.offsets, U[k], A[k], self.d, self.beta, cm=self.cm, cd_usr=self.cd_usr)
+            for P, Pk in zip(loads, single):
+                np.testing.assert_array_equal(P[k], Pk)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,7 +7,12 @@ Created by Andrew Ning on 2013-05-31.
 Copyright (c) NREL. All rights reserved.
 """
 
+from collections import OrderedDict
+import cPickle
+import multiprocessing
+import warnings
 import numpy as np
+import scipy.sparse as sp
 from scipy.linalg import solve_banded
 from openmdao.main.interfaces import IAssembly
 
@@ -57,6 +62,117 @@ def vstack(vec):
     return np.vstack(newvec)
 
 
+def sparse_hstack(vec):
+    """sparse version of hstack, returns a CSR matrix.  useful for assembling Jacobians
+    that are mostly diagonal blocks.  1D arrays are assumed to be column vectors,
+    2D arrays and scipy.sparse matrices are used as is"""
+
+    newvec = []
+    for v in vec:
+        if not sp.issparse(v) and len(v.shape) == 1:
+            v = v[:, np.newaxis]
+        newvec.append(sp.csr_matrix(v))
+
+    return sp.hstack(newvec, format='csr')
+
+
+def sparse_vstack(vec):
+    """sparse version of vstack, returns a CSR matrix.
+    1D arrays are assumed to be row vectors"""
+
+    newvec = []
+    for v in vec:
+        if not sp.issparse(v) and len(v.shape) == 1:
+            v = v[np.newaxis, :]
+        newvec.append(sp.csr_matrix(v))
+
+    return sp.vstack(newvec, format='csr')
+
+
+def pack_ragged(vec):
+    """concatenate a list of 1D arrays of different lengths (e.g., one per member)
+    into a flat array.  offsets[i]:offsets[i+1] is the slice of the i-th array"""
+
+    offsets = np.zeros(len(vec)+1, dtype=int)
+    offsets[1:] = np.cumsum([len(v) for v in vec])
+
+    if len(vec) == 0:
+        return np.zeros(0), offsets
+
+    return np.concatenate([np.asarray(v, dtype=float) for v in vec]), offsets
+
+
+def unpack_ragged(flat, offsets):
+    """inverse of pack_ragged, returns a list of views into flat
+    (slices are taken along the last axis)"""
+
+    return [flat[..., offsets[i]:offsets[i+1]] for i in range(len(offsets)-1)]
+
+
+def expand_ragged(x, offsets):
+    """broadcast a scalar, per-segment (nseg,), or already packed (n,) parameter
+    to the packed layout defined by offsets (along the last axis)"""
+
+    x = np.asarray(x, dtype=float)
+    counts = np.diff(offsets)
+
+    if x.ndim == 0 or x.shape[-1] == offsets[-1]:
+        return x
+    elif x.shape[-1] == len(counts):
+        return np.repeat(x, counts, axis=-1)
+    else:
+        raise ValueError('expected {} (per segment) or {} (packed) values, got {}'.format(
+            len(counts), offsets[-1], x.shape[-1]))
+
+
+class LRUCache(object):
+    """bounded least-recently-used cache.  once maxsize entries are stored
+    the entry that was used longest ago is discarded"""
+
+    def __init__(self, maxsize=128):
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+
+    def get(self, key, default=None):
+
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self._data[key] = value  # move to most recently used
+        self.hits += 1
+        return value
+
+
+    def put(self, key, value):
+
+        self._data.pop(key, None)
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+    def clear(self):
+
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+    def __len__(self):
+        return len(self._data)
+
+
 def _checkIfFloat(x):
     try:
         n = len(x)
@@ -85,12 +201,18 @@ def linspace_with_deriv(start, stop, num):
     return y, dy_dstart, dy_dstop
 
 
-def interp_with_deriv(x, xp, yp):
+def interp_with_deriv(x, xp, yp, sparse=False):
     """linear interpolation and its derivative. To be precise, linear interpolation is not
-    differentiable right at the control points, but in general it works well enough"""
-    # TODO: put in Fortran to speed up
+    differentiable right at the control points, but in general it works well enough.
+    Points outside of xp are linearly extrapolated.
+
+    with sparse=True the derivatives dy/dx (diagonal), dy/dxp, and dy/dyp are
+    returned as scipy.sparse CSR matrices (each row has at most two nonzeros)"""
 
     x, n = _checkIfFloat(x)
+    x = np.asarray(x, dtype=float)
+    xp = np.asarray(xp, dtype=float)
+    yp = np.asarray(yp, dtype=float)
 
     if np.any(np.diff(xp) < 0):
         raise TypeError('xp must be in ascending order')
@@ -98,36 +220,146 @@ def interp_with_deriv(x, xp, yp):
     # n = len(x)
     m = len(xp)
 
-    y = np.zeros(n)
-    dydx = np.zeros(n)
-    dydxp = np.zeros((n, m))
-    dydyp = np.zeros((n, m))
-
-    for i in range(n):
-        if x[i] < xp[0]:
-            j = 0  # linearly extrapolate
-        elif x[i] > xp[-1]:
-            j = m-2
-        else:
-            for j in range(m-1):
-                if xp[j+1] > x[i]:
-                    break
-        x1 = xp[j]
-        y1 = yp[j]
-        x2 = xp[j+1]
-        y2 = yp[j+1]
+    # bracketing interval (end intervals are used to extrapolate)
+    j = np.clip(np.searchsorted(xp, x, side='right') - 1, 0, m-2)
+    x1 = xp[j]
+    y1 = yp[j]
+    x2 = xp[j+1]
+    y2 = yp[j+1]
+
+    w = (x - x1)/(x2 - x1)
+    slope = (y2 - y1)/(x2 - x1)
+
+    y = y1 + slope*(x - x1)
+    dydx = slope
+    dydxp_j = slope*(x - x2)/(x2 - x1)
+    dydxp_j1 = -slope*w
+    dydyp_j = 1 - w
+    dydyp_j1 = w
+
+    if sparse:
+        rows = np.concatenate([np.arange(n), np.arange(n)])
+        cols = np.concatenate([j, j+1])
+        dydx = sp.diags(dydx, 0, format='csr')
+        dydxp = sp.csr_matrix((np.concatenate([dydxp_j, dydxp_j1]), (rows, cols)), shape=(n, m))
+        dydyp = sp.csr_matrix((np.concatenate([dydyp_j, dydyp_j1]), (rows, cols)), shape=(n, m))
 
-        y[i] = y1 + (y2 - y1)*(x[i] - x1)/(x2 - x1)
-        dydx[i] = (y2 - y1)/(x2 - x1)
-        dydxp[i, j] = (y2 - y1)*(x[i] - x2)/(x2 - x1)**2
-        dydxp[i, j+1] = -(y2 - y1)*(x[i] - x1)/(x2 - x1)**2
-        dydyp[i, j] = 1 - (x[i] - x1)/(x2 - x1)
-        dydyp[i, j+1] = (x[i] - x1)/(x2 - x1)
+    else:
+        i = np.arange(n)
+        dydx = np.diag(dydx)
+        dydxp = np.zeros((n, m))
+        dydyp = np.zeros((n, m))
+        dydxp[i, j] = dydxp_j
+        dydxp[i, j+1] = dydxp_j1
+        dydyp[i, j] = dydyp_j
+        dydyp[i, j+1] = dydyp_j1
 
     if n == 1:
         y = y[0]
 
-    return y, np.diag(dydx), dydxp, dydyp
+    return y, dydx, dydxp, dydyp
+
+
+class InterpolationPlan(object):
+    """Linear interpolation from a fixed source grid xp onto fixed target points x.
+    Bracketing indices and weights are computed once, so resampling any number of
+    data sets defined on xp (e.g., loads onto a tower grid) is a single fancy-indexing
+    pass.  Matches np.interp, including holding the end values outside of xp.
+
+    Parameters
+    ----------
+    xp : array_like(float)
+        source grid, in ascending order
+    x : array_like(float)
+        target points
+
+    """
+
+    def __init__(self, xp, x):
+
+        xp = np.asarray(xp, dtype=float)
+        x = np.asarray(x, dtype=float)
+
+        if np.any(np.diff(xp) < 0):
+            raise TypeError('xp must be in ascending order')
+
+        m = len(xp)
+        n = len(x)
+
+        if m == 1:
+            j = np.zeros(n, dtype=int)
+            w = np.zeros(n)
+            j1 = j
+
+        else:
+            j = np.clip(np.searchsorted(xp, x, side='right') - 1, 0, m-2)
+            j1 = j + 1
+            dx = xp[j1] - xp[j]
+            w = np.zeros(n)
+            idx = dx > 0
+            w[idx] = (x[idx] - xp[j[idx]])/dx[idx]
+            w = np.clip(w, 0.0, 1.0)  # hold end values
+
+        self.xp = xp
+        self.x = x
+        self.j = j
+        self.j1 = j1
+        self.w = w
+        self.shape = (n, m)
+
+
+    def __call__(self, fp):
+        """interpolate data defined on xp.  fp may have leading dimensions,
+        e.g., (nsets, m) returns (nsets, n)"""
+
+        fp = np.asarray(fp)
+        return fp[..., self.j]*(1.0 - self.w) + fp[..., self.j1]*self.w
+
+
+    @property
+    def matrix(self):
+        """sparse (n x m) interpolation matrix.  y = matrix * fp, so this
+        is also the derivative of the interpolated values w.r.t. fp"""
+
+        n, m = self.shape
+        rows = np.concatenate([np.arange(n), np.arange(n)])
+        cols = np.concatenate([self.j, self.j1])
+        vals = np.concatenate([1.0 - self.w, self.w])
+
+        return sp.csr_matrix((vals, (rows, cols)), shape=self.shape)
+
+
+    def deriv_x(self, fp):
+        """derivative of the interpolated values w.r.t. the target points x
+        (zero outside of xp where the end values are held)"""
+
+        fp = np.asarray(fp, dtype=float)
+        dx = self.xp[self.j1] - self.xp[self.j]
+        slope = np.zeros(fp.shape[:-1] + (self.shape[0],))
+        idx = np.logical_and(dx > 0, np.logical_and(self.x >= self.xp[0], self.x <= self.xp[-1]))
+        slope[..., idx] = (fp[..., self.j1[idx]] - fp[..., self.j[idx]])/dx[idx]
+
+        return slope
+
+
+
+_interpolation_plans = LRUCache(maxsize=64)
+
+
+def interpolation_plan(xp, x):
+    """cached :class:`InterpolationPlan` for a (source grid, target points) pair.
+    Repeated calls with the same grids (e.g., every run of a component) reuse the plan."""
+
+    xp = np.asarray(xp, dtype=float)
+    x = np.asarray(x, dtype=float)
+    key = (xp.shape, x.shape, xp.dtype.str, xp.tostring(), x.tostring())
+
+    plan = _interpolation_plans.get(key)
+    if plan is None:
+        plan = InterpolationPlan(xp, x)
+        _interpolation_plans.put(key, plan)
+
+    return plan
 
 
 def cubic_with_deriv(x, xp, yp):
@@ -311,6 +543,49 @@ def smooth_abs(x, dx=0.01):
 
 
 
+def cubic_hermite_eval(x1, x2, f1, f2, g1, g2, x):
+    """closed-form version of cubic_spline_eval (Hermite basis functions).
+    all arguments are broadcast against each other so many segments can be
+    evaluated at once"""
+
+    h = x2 - x1
+    s = (x - x1)/h
+    s2 = s*s
+    s3 = s2*s
+
+    return (2*s3 - 3*s2 + 1)*f1 + (s3 - 2*s2 + s)*h*g1 + (3*s2 - 2*s3)*f2 + (s3 - s2)*h*g2
+
+
+def cubic_hermite_deriv(x1, x2, f1, f2, g1, g2, x):
+    """partial derivatives of cubic_hermite_eval w.r.t. all of its arguments
+
+    Returns
+    -------
+    dF_dx1, dF_dx2, dF_df1, dF_df2, dF_dg1, dF_dg2, dF_dx
+
+    """
+
+    h = x2 - x1
+    s = (x - x1)/h
+    s2 = s*s
+    s3 = s2*s
+
+    # Hermite basis functions
+    h00 = 2*s3 - 3*s2 + 1
+    h10 = s3 - 2*s2 + s
+    h01 = 3*s2 - 2*s3
+    h11 = s3 - s2
+
+    dF_ds = (6*s2 - 6*s)*f1 + (3*s2 - 4*s + 1)*h*g1 + (6*s - 6*s2)*f2 + (3*s2 - 2*s)*h*g2
+    dF_dh = h10*g1 + h11*g2  # at constant s
+
+    dF_dx = dF_ds/h
+    dF_dx1 = dF_ds*(s - 1)/h - dF_dh
+    dF_dx2 = -dF_ds*s/h + dF_dh
+
+    return dF_dx1, dF_dx2, h00, h01, h10*h, h11*h, dF_dx
+
+
 def cubic_spline_eval(x1, x2, f1, f2, g1, g2, x):
 
     spline = CubicSplineSegment(x1, x2, f1, f2, g1, g2)
@@ -347,29 +622,29 @@ class CubicSplineSegment(object):
 
 
     def eval_deriv_params(self, xvec, dx1, dx2, df1, df2, dg1, dg2):
+        """derivative of the spline at xvec w.r.t. a parameter that x1, x2, f1, f2, g1, g2
+        depend on (dx1, ..., dg2 are their derivatives w.r.t. that parameter).
+        with A*coeff = b:  dF = phi(x)^T A^-1 (db - dA*coeff),  phi(x) = [x**3, x**2, x, 1],
+        so one solve with A^T for all points gives the result"""
 
         x1 = self.x1
         x2 = self.x2
-        dA_dx1 = np.matrix([[3*x1**2, 2*x1, 1.0, 0.0],
+        dA_dx1 = np.array([[3*x1**2, 2*x1, 1.0, 0.0],
                   [0.0, 0.0, 0.0, 0.0],
                   [6*x1, 2.0, 0.0, 0.0],
                   [0.0, 0.0, 0.0, 0.0]])
-        dA_dx2 = np.matrix([[0.0, 0.0, 0.0, 0.0],
+        dA_dx2 = np.array([[0.0, 0.0, 0.0, 0.0],
                   [3*x2**2, 2*x2, 1.0, 0.0],
                   [0.0, 0.0, 0.0, 0.0],
                   [6*x2, 2.0, 0.0, 0.0]])
         df = np.array([df1, df2, dg1, dg2])
-        c = np.matrix(self.coeff).T
-
-        n = len(xvec)
-        dF = np.zeros(n)
-        for i in range(n):
-            x = np.array([xvec[i]**3, xvec[i]**2, xvec[i], 1.0])
-            d = np.linalg.solve(self.A.T, x)
-            dF_dx1 = -d*dA_dx1*c
-            dF_dx2 = -d*dA_dx2*c
-            dF_df = np.linalg.solve(self.A.T, x)
-            dF[i] = np.dot(dF_df, df) + dF_dx1[0]*dx1 + dF_dx2[0]*dx2
+        c = self.coeff
+
+        xvec = np.asarray(xvec, dtype=float)
+        Phi = np.vstack([xvec**3, xvec**2, xvec, np.ones_like(xvec)])
+        d = np.linalg.solve(self.A.T, Phi)  # (4, n), one factorization for all points
+
+        dF = np.dot(df, d) - np.dot(np.dot(dA_dx1, c), d)*dx1 - np.dot(np.dot(dA_dx2, c), d)*dx2
 
         return dF
 
@@ -505,12 +780,12 @@ def _explodeall(comp, vtype='inputs'):
     return alloutputs
 
 
-def _getColumnOfOutputs(comp, outputs, m):
+def _getColumnOfOutputs(comp, outputs, m, dtype=float):
 
     # fill out column of outputs
     m1 = 0
     m2 = 0
-    f = np.zeros(m)
+    f = np.zeros(m, dtype=dtype)
     for i, out in enumerate(outputs):
 
         # get function value at center
@@ -530,6 +805,324 @@ def _getColumnOfOutputs(comp, outputs, m):
     return f
 
 
+def _fdColumns(comp, inputs):
+    """(input name, index) of every column of the Jacobian (index is None for scalars)"""
+
+    columns = []
+    for inp in inputs:
+        x = _getvar(comp, inp)
+        if np.array(x).shape == ():
+            columns.append((inp, None))
+        else:
+            columns.extend([(inp, k) for k in range(len(x))])
+
+    return columns
+
+
+class ComplexStepError(Exception):
+    """raised when a component does not propagate a complex step"""
+    pass
+
+
+class ComplexInputError(ComplexStepError):
+    """raised when an input does not accept complex values (e.g., a Float trait)"""
+    pass
+
+
+def _colorColumns(pattern):
+    """group structurally orthogonal columns of a sparsity pattern (no two columns
+    in a group share a nonzero row) with the greedy Curtis-Powell-Reid coloring,
+    taking the densest columns first"""
+
+    pattern = np.asarray(pattern, dtype=bool)
+    order = np.argsort(-np.sum(pattern, axis=0), kind='mergesort')
+
+    groups = []
+    used = []  # rows already taken by each group
+    for j in order:
+        rows = pattern[:, j]
+        for g, u in zip(groups, used):
+            if not np.any(np.logical_and(u, rows)):
+                g.append(j)
+                u |= rows
+                break
+        else:
+            groups.append([j])
+            used.append(np.copy(rows))
+
+    return [sorted(g) for g in groups]
+
+
+def _setGroup(comp, group, x0, values):
+    """set entry j of the group to values[j] (may be complex), all other entries to x0"""
+
+    x = OrderedDict()
+    for (inp, k), v in zip(group, values):
+        if k is None:
+            x[inp] = v
+        else:
+            if inp not in x:
+                x[inp] = np.array(x0[inp], dtype=np.result_type(x0[inp], v))
+            x[inp][k] = v
+
+    for inp in x:
+        _setvar(comp, inp, x[inp])
+
+
+def _fdGroup(comp, group, outputs, m, f, fd, step_size):
+    """finite difference of all outputs for a simultaneous step in every (input, index)
+    entry of group.  returns the change in the outputs and, for each entry, the divisor
+    that turns it into that entry's derivative.  the component is reset to its
+    original inputs afterwards"""
+
+    # get x values at center (save location)
+    x0 = OrderedDict()
+    for inp, k in group:
+        if inp not in x0:
+            x = _getvar(comp, inp)
+            x0[inp] = x if k is None else np.copy(x)
+    xc = np.array([x0[inp] if k is None else x0[inp][k] for inp, k in group])
+
+    try:
+        if fd == 'complex':
+            h = 1e-30*np.ones(len(group))
+
+            # any silent cast of the complex inputs/outputs to real is an error
+            with warnings.catch_warnings():
+                warnings.simplefilter('error', np.ComplexWarning)
+                try:
+                    _setGroup(comp, group, x0, xc + 1j*h)
+                except Exception, e:
+                    # e.g., scalar Float traits reject complex values
+                    raise ComplexInputError('{}: {}'.format(e.__class__.__name__, e))
+                try:
+                    comp.run()
+                    fp = _getColumnOfOutputs(comp, outputs, m, complex)
+                    propagated = any(np.iscomplexobj(_getvar(comp, out)) for out in outputs)
+                except Exception, e:
+                    raise ComplexStepError('{}: {}'.format(e.__class__.__name__, e))
+
+            if not propagated:
+                raise ComplexStepError('the imaginary step was discarded (outputs are real)')
+
+            return fp.imag, h
+
+        # take a step
+        h = np.maximum(np.abs(step_size*xc), step_size)
+        _setGroup(comp, group, x0, xc + h)
+        comp.run()
+
+        fp = _getColumnOfOutputs(comp, outputs, m)
+
+        if fd == 'central':
+
+            # step back
+            _setGroup(comp, group, x0, (xc + h) - 2*h)
+            comp.run()
+
+            fm = _getColumnOfOutputs(comp, outputs, m)
+
+            return fp - fm, 2*h
+
+        else:
+            return fp - f, h
+
+    finally:
+        # reset state
+        for inp in x0:
+            _setvar(comp, inp, x0[inp])
+        comp.run()
+
+
+def _fdJacobian(comp, columns, groups, pattern, outputs, m, f, fd, step_size):
+    """finite difference Jacobian, shape (m, len(columns)), filled in for the columns
+    of the given groups.  the columns of a group are perturbed together and each is
+    read from its own rows of the sparsity pattern.  if a group changes an output
+    outside those rows the pattern is wrong, and its columns are redone one at a time.
+    columns where the complex step fails are central differenced instead and, unless
+    the input just does not accept complex values, returned with the reason in failed"""
+
+    JFD = np.zeros((m, len(columns)))
+    failed = []
+
+    queue = [(g, fd) for g in groups]
+    while len(queue) > 0:
+        g, fdg = queue.pop(0)
+        group = [columns[j] for j in g]
+
+        try:
+            df, div = _fdGroup(comp, group, outputs, m, f, fdg, step_size)
+        except ComplexStepError, e:
+            if not isinstance(e, ComplexInputError):
+                failed.extend([(inp, k, str(e)) for inp, k in group])
+            fdg = 'central'
+            df, div = _fdGroup(comp, group, outputs, m, f, fdg, step_size)
+
+        if len(g) == 1:
+            JFD[:, g[0]] = df/div[0]
+            continue
+
+        covered = np.any(pattern[:, g], axis=1)
+        if np.any(df[np.logical_not(covered)] != 0):
+            queue[0:0] = [([j], fdg) for j in g]
+            continue
+
+        for j, d in zip(g, div):
+            rows = pattern[:, j]
+            JFD[rows, j] = df[rows]/d
+
+    return JFD, failed
+
+
+def _fdTask(args):
+    """finite differences for a subset of the groups on a private copy of the component (pool task)"""
+
+    pickled_comp, columns, groups, pattern, outputs, m, f, fd, step_size = args
+
+    return _fdJacobian(cPickle.loads(pickled_comp), columns, groups, pattern, outputs, m, f, fd, step_size)
+
+
+def _fdJacobianProcs(comp, columns, groups, pattern, outputs, m, f, fd, step_size, nprocs):
+    """_fdJacobian with the groups split among nprocs worker processes"""
+
+    if nprocs > 1 and len(groups) > 1:
+        pickled_comp = cPickle.dumps(comp, cPickle.HIGHEST_PROTOCOL)
+        blocks = np.array_split(np.arange(len(groups)), min(nprocs, len(groups)))
+        tasks = [(pickled_comp, columns, [groups[i] for i in b], pattern, outputs, m, f, fd, step_size) for b in blocks]
+
+        pool = multiprocessing.Pool(len(tasks))
+        try:
+            results = pool.map(_fdTask, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+        # each worker fills in only the columns of its own groups
+        JFD = sum([r[0] for r in results])
+        failed = sum([r[1] for r in results], [])
+
+    else:
+        JFD, failed = _fdJacobian(comp, columns, groups, pattern, outputs, m, f, fd, step_size)
+
+    return JFD, failed
+
+
+_sparsity_patterns = LRUCache(maxsize=64)
+
+
+def fd_jacobian(comp, fd='central', step_size=1e-6, nprocs=1, sparsity=None):
+    """finite difference Jacobian of a component, in the same layout as provideJ
+    (rows follow the outputs and columns the inputs of list_deriv_vars)
+
+    Parameters
+    ----------
+    comp : obj
+        An OpenMDAO component
+    fd : str
+        the type of finite difference to use.  options are central, forward, or complex.
+        see check_gradient
+    step_size : float
+        step size to use in finite differencing
+    nprocs : int
+        number of processes for the finite differencing.  with nprocs > 1 the component
+        is pickled and the columns are split among worker processes (results are identical)
+    sparsity : str or array_like(bool)
+        sparsity pattern used to group columns ('probe', 'provideJ', or an (m, n)
+        boolean pattern).  see check_gradient
+
+    Returns
+    -------
+    JFD : ndarray(float)
+        finite difference Jacobian
+
+    """
+
+    inputs, outputs = comp.list_deriv_vars()
+
+    comp.run()
+
+    m = 0
+    for out in outputs:
+        y = _getvar(comp, out)
+        m += 1 if np.array(y).shape == () else len(y)
+
+    # fill out column of outputs
+    f = _getColumnOfOutputs(comp, outputs, m)
+
+    columns = _fdColumns(comp, inputs)
+    n = len(columns)
+
+    # group structurally orthogonal columns
+    probe = isinstance(sparsity, basestring) and sparsity == 'probe'
+    if probe:
+        key = (comp.__class__, tuple(inputs), tuple(outputs), m, n)
+        pattern = _sparsity_patterns.get(key)
+        if pattern is None:
+            groups = [[j] for j in range(n)]  # this sweep is the probe
+        else:
+            groups = _colorColumns(pattern)
+    elif sparsity is None:
+        pattern = None
+        groups = [[j] for j in range(n)]
+    else:
+        if isinstance(sparsity, basestring) and sparsity == 'provideJ':
+            warnings.warn('the sparsity pattern of ' + comp.__class__.__name__ + ' is taken from provideJ, '
+                + 'so nonzeros it leaves out are not checked independently')
+            J = comp.provideJ()
+            pattern = (J.toarray() if sp.issparse(J) else np.asarray(J)) != 0
+        else:
+            pattern = np.asarray(sparsity, dtype=bool)
+        if pattern.shape != (m, n):
+            raise TypeError('Incorrect sparsity pattern size. The pattern is of shape {}, but it should be ({}, {})'.format(pattern.shape, m, n))
+        groups = _colorColumns(pattern)
+
+    JFD, failed = _fdJacobianProcs(comp, columns, groups, pattern, outputs, m, f, fd, step_size, nprocs)
+
+    if len(failed) > 0:
+        warnings.warn(comp.__class__.__name__ + ' is not complex-safe, central differences were used for\n\t'
+            + '\n\t'.join([inp + ('' if k is None else '[' + str(k) + ']') + ': ' + reason for inp, k, reason in failed]))
+
+    # silently dropping the imaginary part (np.abs, np.maximum, ...) still gives complex
+    # outputs, so check the complex step against one central difference with all columns
+    # stepped at once
+    if fd == 'complex' and len(failed) < n:
+        df, div = _fdGroup(comp, columns, outputs, m, f, 'central', step_size)
+        if np.any(np.abs(0.5*df - np.dot(JFD, 0.5*div)) > 1e-9*np.abs(f) + 1e-5*np.abs(0.5*df)):
+            warnings.warn(comp.__class__.__name__ + ' drops the imaginary part of the complex step (it disagrees '
+                + 'with central differences), central differences were used for every column')
+            JFD = _fdJacobianProcs(comp, columns, groups, pattern, outputs, m, f, 'central', step_size, nprocs)[0]
+
+    if probe and pattern is None:
+        _sparsity_patterns.put(key, JFD != 0)
+
+    return JFD
+
+
+def probe_sparsity(comp, step_size=1e-6, nprocs=1):
+    """sparsity pattern of a component from forward differences at its current inputs
+    (one run per column).  an entry is nonzero if stepping that input changes that
+    output at all.  the pattern can be passed as sparsity to check_gradient or
+    fd_jacobian for components with the same structure
+
+    Parameters
+    ----------
+    comp : obj
+        An OpenMDAO component
+    step_size : float
+        step size to use in finite differencing
+    nprocs : int
+        number of processes for the finite differencing
+
+    Returns
+    -------
+    pattern : ndarray(bool)
+        True where the Jacobian is structurally nonzero
+
+    """
+
+    return fd_jacobian(comp, 'forward', step_size, nprocs) != 0
+
+
 def check_for_missing_unit_tests(modules):
     """A heuristic check to find components that don't have a corresonding unit test
     for its gradients.
@@ -572,7 +1165,7 @@ def check_for_missing_unit_tests(modules):
 
 
 def check_gradient_unit_test(unittest, comp, fd='central', step_size=1e-6, tol=1e-6, display=False,
-        show_missing_warnings=True, show_scaling_warnings=False, min_grad=1e-6, max_grad=1e6):
+        show_missing_warnings=True, show_scaling_warnings=False, min_grad=1e-6, max_grad=1e6, nprocs=1, sparsity=None):
     """compare provided analytic gradients to finite-difference gradients with unit testing.
     Same as check_gradient, but provides a unit test for each gradient for convenience.
     the unit tests checks that the error for each gradient is less than tol.
@@ -582,7 +1175,14 @@ def check_gradient_unit_test(unittest, comp, fd='central', step_size=1e-6, tol=1
     comp : obj
         An OpenMDAO component that provides analytic gradients through provideJ()
     fd : str
-        the type of finite difference to use.  options are central or forward
+        the type of finite difference to use.  options are central, forward, or complex.
+        complex uses a complex step (one run per column, exact to machine precision) and
+        requires execute to be complex-safe.  it only applies to inputs that accept complex
+        values: OpenMDAO Float traits do not, so scalar inputs are central differenced
+        (silently).  columns whose run fails or whose outputs come back real are central
+        differenced with a warning.  a component that silently drops the imaginary part
+        (e.g., np.abs) is caught by comparing with one central difference along all
+        columns at once and is then central differenced throughout, also with a warning
     step_size : float
         step size to use in finite differencing
     tol : float
@@ -597,10 +1197,23 @@ def check_gradient_unit_test(unittest, comp, fd='central', step_size=1e-6, tol=1
         to challenges in solving the full linear system
     min_grad/max_grad : float
         quantifies what "very small" or "very large" means when using show_scaling_warnings
+    nprocs : int
+        number of processes for the finite differencing.  with nprocs > 1 the component
+        is pickled and the columns are split among worker processes (results are identical)
+    sparsity : str or array_like(bool)
+        if given, structurally orthogonal columns are grouped (Curtis-Powell-Reid coloring)
+        and perturbed together, e.g., a diagonal Jacobian costs one group instead of
+        one run per column.  either an (m, n) boolean structural pattern, e.g., from
+        probe_sparsity, or 'probe': the first check of a component class (and Jacobian
+        size) is dense, and the nonzeros it finds are cached and used by later checks.
+        'provideJ' uses the nonzeros of the analytic Jacobian under test, so a nonzero
+        it wrongly leaves out may be charged to another column of the same group; it
+        issues a warning.  a group whose step changes outputs outside the pattern is
+        redone one column at a time
     """
 
     names, errors = check_gradient(comp, fd, step_size, tol, display, show_missing_warnings,
-        show_scaling_warnings, min_grad, max_grad)
+        show_scaling_warnings, min_grad, max_grad, nprocs, sparsity)
 
     for name, err in zip(names, errors):
         try:
@@ -611,7 +1224,7 @@ def check_gradient_unit_test(unittest, comp, fd='central', step_size=1e-6, tol=1
 
 
 def check_gradient(comp, fd='central', step_size=1e-6, tol=1e-6, display=False,
-        show_missing_warnings=True, show_scaling_warnings=False, min_grad=1e-6, max_grad=1e6):
+        show_missing_warnings=True, show_scaling_warnings=False, min_grad=1e-6, max_grad=1e6, nprocs=1, sparsity=None):
     """compare provided analytic gradients to finite-difference gradients
 
     Parameters
@@ -619,7 +1232,14 @@ def check_gradient(comp, fd='central', step_size=1e-6, tol=1e-6, display=False,
     comp : obj
         An OpenMDAO component that provides analytic gradients through provideJ()
     fd : str
-        the type of finite difference to use.  options are central or forward
+        the type of finite difference to use.  options are central, forward, or complex.
+        complex uses a complex step (one run per column, exact to machine precision) and
+        requires execute to be complex-safe.  it only applies to inputs that accept complex
+        values: OpenMDAO Float traits do not, so scalar inputs are central differenced
+        (silently).  columns whose run fails or whose outputs come back real are central
+        differenced with a warning.  a component that silently drops the imaginary part
+        (e.g., np.abs) is caught by comparing with one central difference along all
+        columns at once and is then central differenced throughout, also with a warning
     step_size : float
         step size to use in finite differencing
     tol : float
@@ -634,6 +1254,19 @@ def check_gradient(comp, fd='central', step_size=1e-6, tol=1e-6, display=False,
         to challenges in solving the full linear system
     min_grad/max_grad : float
         quantifies what "very small" or "very large" means when using show_scaling_warnings
+    nprocs : int
+        number of processes for the finite differencing.  with nprocs > 1 the component
+        is pickled and the columns are split among worker processes (results are identical)
+    sparsity : str or array_like(bool)
+        if given, structurally orthogonal columns are grouped (Curtis-Powell-Reid coloring)
+        and perturbed together, e.g., a diagonal Jacobian costs one group instead of
+        one run per column.  either an (m, n) boolean structural pattern, e.g., from
+        probe_sparsity, or 'probe': the first check of a component class (and Jacobian
+        size) is dense, and the nonzeros it finds are cached and used by later checks.
+        'provideJ' uses the nonzeros of the analytic Jacobian under test, so a nonzero
+        it wrongly leaves out may be charged to another column of the same group; it
+        issues a warning.  a group whose step changes outputs outside the pattern is
+        redone one column at a time
 
     Returns
     -------
@@ -667,6 +1300,8 @@ def check_gradient(comp, fd='central', step_size=1e-6, tol=1e-6, display=False,
 
     comp.run()
     J = comp.provideJ()
+    if sp.issparse(J):
+        J = J.toarray()
 
     # compute size of Jacobian
     m = 0
@@ -694,74 +1329,11 @@ def check_gradient(comp, fd='central', step_size=1e-6, tol=1e-6, display=False,
         nvec.append(nsub)
         cnvec.append(n)
 
-    JFD = np.zeros((m, n))
-
-    if J.shape != JFD.shape:
+    if J.shape != (m, n):
         raise TypeError('Incorrect Jacobian size. Your provided Jacobian is of shape {}, but it should be ({}, {})'.format(J.shape, m, n))
 
 
-    # fill out column of outputs
-    f = _getColumnOfOutputs(comp, outputs, m)
-
-    n1 = 0
-
-    for j, inp in enumerate(inputs):
-
-        # get x value at center (save location)
-        x = _getvar(comp, inp)
-        if np.array(x).shape == ():
-            x0 = x
-            lenx = 1
-        else:
-            x = np.copy(x)  # so not pointing to same memory address
-            x0 = np.copy(x)
-            lenx = len(x)
-
-        for k in range(lenx):
-
-            # take a step
-            if lenx == 1:
-                h = np.abs(step_size*x)
-                if h < step_size:
-                    h = step_size
-                x += h
-            else:
-                h = np.abs(step_size*x[k])
-                if h < step_size:
-                    h = step_size
-                x[k] += h
-            _setvar(comp, inp, x)
-            comp.run()
-
-            # fd
-            fp = _getColumnOfOutputs(comp, outputs, m)
-
-            if fd == 'central':
-
-                # step back
-                if lenx == 1:
-                    x -= 2*h
-                else:
-                    x[k] -= 2*h
-                _setvar(comp, inp, x)
-                comp.run()
-
-                fm = _getColumnOfOutputs(comp, outputs, m)
-
-                deriv = (fp - fm)/(2*h)
-
-            else:
-                deriv = (fp - f)/h
-
-
-            JFD[:, n1+k] = deriv
-
-            # reset state
-            x = np.copy(x0)
-            _setvar(comp, inp, x0)
-            comp.run()
-
-        n1 += lenx
+    JFD = fd_jacobian(comp, fd, step_size, nprocs, sparsity)
 
 
     # error checking